@@ -0,0 +1,6 @@
+"""
+Offline benchmarks of the preprocessing, embedding and storage hot paths.
+
+Run ``python -m benchmarks --output results.json`` from the repository root, and later
+``python -m benchmarks --baseline results.json`` to compare a change against it.
+"""
@@ -0,0 +1,113 @@
+import os
+
+# 基准测试必须可以离线运行，禁止huggingface访问网络
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.suite import BenchmarkOptions, BenchmarkResult, compare, list_cases, run_benchmarks
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metadata(options: BenchmarkOptions) -> dict:
+    import numpy
+    import pydantic
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "pydantic": pydantic.__version__,
+        "options": options.model_dump(mode="json"),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Runs the offline benchmark suite.")
+    parser.add_argument("--documents", type=int, default=200, help="number of synthetic articles")
+    parser.add_argument("--words", type=int, default=800, help="average number of words per article")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per benchmark, after one warm-up run")
+    parser.add_argument("--vector-backend", choices=["qdrant", "numpy"], default="qdrant")
+    parser.add_argument("--embedding-model", help="local sentence-transformers model, defaults to a tiny random one")
+    parser.add_argument("--only", nargs="*", help="run only the benchmarks starting with these prefixes")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    parser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    parser.add_argument("--baseline", type=Path, help="compare the results with this JSON file")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="throughput drop reported as a regression (default: 0.1)"
+    )
+    args = parser.parse_args()
+    if args.repeats < 1:
+        parser.error("--repeats must be at least 1")
+
+    if args.list:
+        print("\n".join(list_cases()))
+        return 0
+
+    options = BenchmarkOptions(
+        num_documents=args.documents,
+        words_per_document=args.words,
+        seed=args.seed,
+        repeats=args.repeats,
+        vector_backend=args.vector_backend,
+        embedding_model=args.embedding_model,
+    )
+    results = run_benchmarks(options, only=args.only)
+
+    report = {"metadata": _metadata(options), "results": [result.model_dump() for result in results]}
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.baseline is None:
+        print(f"{'benchmark':<36} {'items/s':>14} {'best s':>10} {'median s':>10}")
+        for result in results:
+            if result.skipped:
+                print(f"{result.name:<36} {'skipped: ' + result.skipped}")
+            else:
+                throughput = f"{result.items_per_second:,.1f}" if result.items_per_second is not None else "-"
+                print(
+                    f"{result.name:<36} {throughput:>14} "
+                    f"{result.best_seconds:>10.4f} {result.median_seconds:>10.4f}"
+                )
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline["metadata"]["options"] != report["metadata"]["options"]:
+        print("warning: the baseline was run with other options, the results may not be comparable", file=sys.stderr)
+
+    comparisons = compare(results, [BenchmarkResult(**result) for result in baseline["results"]], args.tolerance)
+    print(f"{'benchmark':<36} {'baseline/s':>14} {'current/s':>14} {'change':>9}")
+    for comparison in comparisons:
+        baseline_value = f"{comparison.baseline:,.1f}" if comparison.baseline else "-"
+        current_value = f"{comparison.current:,.1f}" if comparison.current else "-"
+        change = f"{comparison.change:+.1%}" if comparison.change is not None else "-"
+        flag = "  REGRESSION" if comparison.regression else ""
+        print(f"{comparison.name:<36} {baseline_value:>14} {current_value:>14} {change:>9}{flag}")
+
+    # 有性能回退时返回非零，便于在CI中使用
+    return 1 if any(comparison.regression for comparison in comparisons) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
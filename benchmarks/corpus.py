@@ -0,0 +1,72 @@
+import random
+import uuid
+
+from llmtwin.domain.document import ArticleDocument
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vi", "so", "pe", "du", "ra", "xi", "ol", "an", "em", "ib"]
+# 模拟爬取的文章中常见的噪声：markdown、链接、emoji和特殊符号
+_NOISE = ["**", "##", "[link](https://example.com/page)", "🚀", "—", "→", "`code`", "(see above)", "&amp;", "\n\n"]
+
+
+def make_vocabulary(size: int = 5000, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+
+def make_text(rng: random.Random, vocabulary: list[str], num_words: int) -> str:
+    parts = []
+    sentence_length = 0
+    for _ in range(num_words):
+        word = rng.choice(vocabulary)
+        if sentence_length == 0:
+            word = word.capitalize()
+        parts.append(word)
+        sentence_length += 1
+        if rng.random() < 0.02:
+            parts.append(rng.choice(_NOISE))
+        if sentence_length >= rng.randint(8, 25):
+            parts[-1] += rng.choice([".", ".", ".", "?", "!"])
+            sentence_length = 0
+
+    return " ".join(parts) + "."
+
+
+def make_corpus(num_documents: int, words_per_document: int = 800, seed: int = 0) -> list[ArticleDocument]:
+    """
+    Generates a reproducible corpus of synthetic articles shaped like the crawled ones.
+
+    Args:
+        num_documents (int): The number of articles.
+        words_per_document (int): The average number of words of an article body.
+        seed (int): The random seed, the same seed always gives the same corpus.
+
+    Returns:
+        list[ArticleDocument]: The articles.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(seed=seed)
+    authors = [(uuid.UUID(int=rng.getrandbits(128), version=4), f"Author {i}") for i in range(max(1, num_documents // 20))]
+
+    documents = []
+    for i in range(num_documents):
+        author_id, author_full_name = rng.choice(authors)
+        num_words = max(20, int(rng.gauss(words_per_document, words_per_document / 4)))
+        documents.append(
+            ArticleDocument(
+                _id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                content={
+                    "Title": make_text(rng, vocabulary, rng.randint(4, 10)),
+                    "Subtitle": make_text(rng, vocabulary, rng.randint(8, 20)) if rng.random() < 0.7 else None,
+                    "Content": make_text(rng, vocabulary, num_words),
+                },
+                platform=rng.choice(["medium", "substack", "blog"]),
+                author_id=author_id,
+                author_full_name=author_full_name,
+                link=f"https://example.com/articles/{i}",
+            )
+        )
+
+    return documents
@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Literal
+
+from llmtwin.domain.base import nosql, vector
+
+_SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+
+@contextmanager
+def local_databases(vector_backend: Literal["qdrant", "numpy"] = "qdrant") -> Iterator[None]:
+    """Points the domain models at mongomock and an in-process vector store, restoring the connections after."""
+    import mongomock
+    import mongomock.collection
+
+    if vector_backend == "numpy":
+        from llmtwin.numpy_store import NumpyVectorStore
+
+        vector_database = NumpyVectorStore(":memory:")
+    else:
+        from qdrant_client import QdrantClient
+
+        vector_database = QdrantClient(":memory:")
+
+    previous = nosql._database, vector._database, mongomock.collection.BSON
+    nosql._database = mongomock.MongoClient()["benchmarks"]
+    vector._database = vector_database
+    # mongomock用BSON.encode校验写入的文档时不带codec options，无法编码UUID；跳过这一步校验
+    mongomock.collection.BSON = None
+    try:
+        yield
+    finally:
+        nosql._database, vector._database, mongomock.collection.BSON = previous
+
+
+def build_tokenizer(directory: Path, vocabulary: list[str]):
+    """Builds a WordPiece tokenizer over the vocabulary of the synthetic corpus, without downloading anything."""
+    from transformers import BertTokenizerFast
+
+    directory.mkdir(parents=True, exist_ok=True)
+    vocab_file = directory / "vocab.txt"
+    vocab_file.write_text("\n".join(_SPECIAL_TOKENS + vocabulary + list(".,!?")) + "\n")
+
+    return BertTokenizerFast(vocab_file=str(vocab_file))
+
+
+def build_tiny_model(directory: Path, vocabulary: list[str], max_seq_length: int = 128) -> Path:
+    """
+    Builds and saves a randomly initialized two-layer sentence-transformers model, so that inference can be
+    benchmarked offline. Its embeddings are meaningless, only its cost is representative of a small model.
+    """
+    model_path = directory / "model"
+    if (model_path / "modules.json").exists():
+        return model_path
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers import models as st_models
+    from transformers import BertConfig, BertModel
+
+    transformer_path = directory / "transformer"
+    tokenizer = build_tokenizer(transformer_path, vocabulary)
+    config = BertConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=128,
+        max_position_embeddings=max_seq_length + 2,
+    )
+    torch.manual_seed(0)
+    BertModel(config).save_pretrained(transformer_path)
+    tokenizer.save_pretrained(transformer_path)
+
+    transformer = st_models.Transformer(str(transformer_path), max_seq_length=max_seq_length)
+    pooling = st_models.Pooling(transformer.get_word_embedding_dimension())
+    SentenceTransformer(modules=[transformer, pooling]).save(str(model_path))
+
+    return model_path
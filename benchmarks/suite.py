@@ -0,0 +1,349 @@
+import statistics
+import time
+from pathlib import Path
+from typing import Callable, Literal, NamedTuple
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel, ConfigDict, Field
+
+from benchmarks.corpus import make_corpus, make_vocabulary
+from benchmarks.local import build_tiny_model, build_tokenizer, local_databases
+from llmtwin.domain.base.nosql import BaseDocument
+from llmtwin.domain.base.trusted import SCHEMA_VERSION_FIELD, get_reader, schema_version
+from llmtwin.domain.base.vector import get_database
+from llmtwin.domain.chunk_document import ChunkArticle
+from llmtwin.domain.cleaned_document import CleanedArticle
+from llmtwin.domain.document import ArticleDocument
+from llmtwin.domain.embed_document import EmbedArticle
+from llmtwin.preprocess.chunk_func import chunk_by_tokens
+from llmtwin.preprocess.clean_func import clean_text
+from llmtwin.preprocess.clean_handler import ArticleCleanHandler
+
+
+class BenchmarkResult(BaseModel):
+    name: str
+    items: int = 0
+    best_seconds: float | None = None
+    median_seconds: float | None = None
+    items_per_second: float | None = None
+    # 缺少可选依赖（如torch）时跳过，并记录原因
+    skipped: str | None = None
+
+
+class BenchmarkOptions(BaseModel):
+    num_documents: int = 200
+    words_per_document: int = 800
+    seed: int = 0
+    repeats: int = Field(default=5, gt=0)
+    vector_backend: Literal["qdrant", "numpy"] = "qdrant"
+    vector_size: int = 384
+    num_queries: int = 100
+    # 默认在work_dir中生成一个随机初始化的小模型，也可以指定本地已有的模型目录
+    embedding_model: str | None = None
+    work_dir: Path = Path.home() / ".cache" / "llmtwin" / "benchmarks"
+
+
+class Case(NamedTuple):
+    run: Callable[[], int]
+    setup: Callable[[], None] | None = None
+
+
+class BenchmarkContext:
+    def __init__(self, options: BenchmarkOptions) -> None:
+        self.options = options
+        self.vocabulary = make_vocabulary(seed=options.seed)
+        self.documents = make_corpus(options.num_documents, options.words_per_document, seed=options.seed)
+        handler = ArticleCleanHandler()
+        self.cleaned = [handler.clean(document) for document in self.documents]
+        self.tokenizer = build_tokenizer(options.work_dir / "tokenizer", self.vocabulary)
+        chunks_batch = chunk_by_tokens(
+            [cleaned.content for cleaned in self.cleaned], tokenizer=self.tokenizer, max_tokens=254, overlap_tokens=32
+        )
+        self.chunks = [
+            ChunkArticle(
+                content=chunk,
+                platform=cleaned.platform,
+                link=cleaned.link,
+                document_id=cleaned.id,
+                author_id=cleaned.author_id,
+                author_full_name=cleaned.author_full_name,
+            )
+            for cleaned, chunks in zip(self.cleaned, chunks_batch, strict=True)
+            for chunk in chunks
+        ]
+
+        rng = np.random.default_rng(options.seed)
+        self.embeddings = rng.standard_normal((len(self.chunks), options.vector_size), dtype=np.float32)
+        self.queries = rng.standard_normal((options.num_queries, options.vector_size), dtype=np.float32)
+
+
+_CASES: dict[str, Callable[[BenchmarkContext], Case]] = {}
+
+
+def benchmark(name: str):
+    def register(factory: Callable[[BenchmarkContext], Case]):
+        _CASES[name] = factory
+        return factory
+
+    return register
+
+
+@benchmark("clean_text")
+def _clean_text(context: BenchmarkContext) -> Case:
+    texts = ["#### ".join(value for value in document.content.values() if value) for document in context.documents]
+    return Case(run=lambda: len([clean_text(text) for text in texts]))
+
+
+@benchmark("chunk_by_tokens")
+def _chunk_by_tokens(context: BenchmarkContext) -> Case:
+    texts = [cleaned.content for cleaned in context.cleaned]
+    return Case(
+        run=lambda: len(chunk_by_tokens(texts, tokenizer=context.tokenizer, max_tokens=254, overlap_tokens=32))
+    )
+
+
+def _model_payloads(context: BenchmarkContext, model_class) -> list[dict]:
+    # 与数据库中读出的数据形状相同
+    if model_class is ArticleDocument:
+        return [document.model_dump(by_alias=True) for document in context.documents]
+    if model_class is CleanedArticle:
+        return [cleaned.model_dump() for cleaned in context.cleaned]
+    if model_class is ChunkArticle:
+        return [chunk.model_dump() for chunk in context.chunks]
+    return [
+        {**chunk.model_dump(), "embedding": embedding.tolist()}
+        for chunk, embedding in zip(context.chunks, context.embeddings)
+    ]
+
+
+def _model_case(model_class, kind: Literal["validate", "construct", "trusted"]) -> Callable[[BenchmarkContext], Case]:
+    def factory(context: BenchmarkContext) -> Case:
+        payloads = _model_payloads(context, model_class)
+        if kind == "validate":
+            return Case(run=lambda: len([model_class.model_validate(payload) for payload in payloads]))
+        if kind == "trusted":
+            reader = get_reader(model_class, "bson" if issubclass(model_class, BaseDocument) else "json")
+            for payload in payloads:
+                payload[SCHEMA_VERSION_FIELD] = schema_version(model_class)
+            return Case(run=lambda: len([reader.read(payload, trusted=True) for payload in payloads]))
+        return Case(run=lambda: len([model_class.model_construct(**payload) for payload in payloads]))
+
+    return factory
+
+
+for _model_class in (ArticleDocument, CleanedArticle, ChunkArticle, EmbedArticle):
+    for _kind in ("validate", "construct", "trusted"):
+        benchmark(f"model.{_model_class.__name__}.{_kind}")(_model_case(_model_class, _kind))
+
+
+@benchmark("embedding.encode")
+def _embedding_encode(context: BenchmarkContext) -> Case:
+    from llmtwin.networks.embeddings import EmbeddingModelSingleton
+
+    model_id = context.options.embedding_model or str(
+        build_tiny_model(context.options.work_dir / "tiny-model", context.vocabulary)
+    )
+    model = EmbeddingModelSingleton(model_id=model_id, device="cpu", backend="torch")
+    texts = [chunk.content for chunk in context.chunks]
+
+    return Case(run=lambda: len(model(texts, to_list=False)))
+
+
+@benchmark("mongo.bulk_insert")
+def _mongo_bulk_insert(context: BenchmarkContext) -> Case:
+    from llmtwin.domain.base.nosql import get_database as get_mongo_database
+
+    return Case(
+        run=lambda: len(ArticleDocument.bulk_insert(context.documents, by_alias=True).inserted_ids),
+        setup=lambda: get_mongo_database().drop_collection(ArticleDocument.get_collection_name()),
+    )
+
+
+@benchmark("mongo.bulk_find")
+def _mongo_bulk_find(context: BenchmarkContext) -> Case:
+    from llmtwin.domain.base.nosql import get_database as get_mongo_database
+
+    get_mongo_database().drop_collection(ArticleDocument.get_collection_name())
+    ArticleDocument.bulk_insert(context.documents, by_alias=True)
+
+    return Case(run=lambda: len(ArticleDocument.bulk_find({})))
+
+
+def _embedded_chunks(context: BenchmarkContext) -> list[EmbedArticle]:
+    return [
+        EmbedArticle.model_construct(**chunk.model_dump(), embedding=embedding)
+        for chunk, embedding in zip(context.chunks, context.embeddings)
+    ]
+
+
+def _recreate_vector_collection(context: BenchmarkContext) -> None:
+    if EmbedArticle.collection_exists():
+        get_database().delete_collection(EmbedArticle.get_collection_name())
+    EmbedArticle.create_collection(vector_size=context.options.vector_size)
+
+
+@benchmark("vector.bulk_insert")
+def _vector_bulk_insert(context: BenchmarkContext) -> Case:
+    documents = _embedded_chunks(context)
+
+    def run() -> int:
+        EmbedArticle.bulk_insert(documents)
+        return len(documents)
+
+    return Case(run=run, setup=lambda: _recreate_vector_collection(context))
+
+
+@benchmark("vector.bulk_find")
+def _vector_bulk_find(context: BenchmarkContext) -> Case:
+    documents = _embedded_chunks(context)
+    _recreate_vector_collection(context)
+    EmbedArticle.bulk_insert(documents)
+
+    return Case(run=lambda: len(EmbedArticle.bulk_find(limit=len(documents))[0]))
+
+
+@benchmark("vector.query")
+def _vector_query(context: BenchmarkContext) -> Case:
+    documents = _embedded_chunks(context)
+    _recreate_vector_collection(context)
+    EmbedArticle.bulk_insert(documents)
+    queries = context.queries.tolist()
+
+    return Case(run=lambda: len([EmbedArticle.query(query, limit=10) for query in queries]))
+
+
+def _exported_snapshot(context: BenchmarkContext):
+    from llmtwin import snapshot
+
+    directory = context.options.work_dir / "snapshot"
+    _recreate_vector_collection(context)
+    EmbedArticle.bulk_insert(_embedded_chunks(context))
+    return snapshot, directory
+
+
+@benchmark("snapshot.export")
+def _snapshot_export(context: BenchmarkContext) -> Case:
+    snapshot, directory = _exported_snapshot(context)
+
+    return Case(run=lambda: snapshot.export_collection(EmbedArticle, directory).num_points)
+
+
+@benchmark("snapshot.import")
+def _snapshot_import(context: BenchmarkContext) -> Case:
+    snapshot, directory = _exported_snapshot(context)
+    snapshot.export_collection(EmbedArticle, directory)
+
+    def run() -> int:
+        # 本地qdrant不支持并发写入
+        results = snapshot.import_collection(EmbedArticle, directory, recreate=True, concurrency=1)
+        return sum(result.num_points for result in results)
+
+    return Case(run=run)
+
+
+def list_cases() -> list[str]:
+    return list(_CASES)
+
+
+def measure(case: Case, repeats: int) -> tuple[int, list[float]]:
+    """Runs the case once to warm up, then ``repeats`` times, returning the items processed and the timings."""
+    timings = []
+    items = 0
+    for i in range(repeats + 1):
+        if case.setup is not None:
+            case.setup()
+        start = time.perf_counter()
+        items = case.run()
+        elapsed = time.perf_counter() - start
+        if i > 0:
+            timings.append(elapsed)
+
+    return items, timings
+
+
+def run_benchmarks(options: BenchmarkOptions, only: list[str] | None = None) -> list[BenchmarkResult]:
+    """
+    Runs the benchmarks on a synthetic corpus against local stand-ins of MongoDB and Qdrant.
+
+    Args:
+        options (BenchmarkOptions): The corpus size and the run options.
+        only (list[str] | None): Runs only the benchmarks whose name starts with one of these prefixes.
+
+    Returns:
+        list[BenchmarkResult]: The result of every benchmark. The throughput is computed from the best time.
+    """
+    context = BenchmarkContext(options)
+    logger.info(
+        "Generated the benchmark corpus.", documents=len(context.documents), chunks=len(context.chunks)
+    )
+
+    results = []
+    with local_databases(options.vector_backend):
+        for name, factory in _CASES.items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+
+            try:
+                case = factory(context)
+            except ImportError as e:
+                logger.warning(f"Skipped benchmark {name}: {e}")
+                results.append(BenchmarkResult(name=name, skipped=f"missing dependency: {e.name or e}"))
+                continue
+
+            items, timings = measure(case, options.repeats)
+            best = min(timings)
+            result = BenchmarkResult(
+                name=name,
+                items=items,
+                best_seconds=best,
+                median_seconds=statistics.median(timings),
+                items_per_second=items / best if best > 0 else None,
+            )
+            results.append(result)
+            # 计时精度不足时没有吞吐量
+            throughput = f"{result.items_per_second:,.0f}" if result.items_per_second is not None else "-"
+            logger.info(f"{name}: {throughput} items/s", items=items, best_seconds=round(best, 4))
+
+    return results
+
+
+class Comparison(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    baseline: float | None
+    current: float | None
+    # 吞吐量的相对变化，正数表示变快
+    change: float | None
+    regression: bool
+
+
+def compare(
+    results: list[BenchmarkResult], baseline: list[BenchmarkResult], tolerance: float = 0.1
+) -> list[Comparison]:
+    """
+    Compares the throughput of every benchmark with a baseline run.
+
+    A benchmark regressed if its throughput dropped by more than ``tolerance``, e.g. 0.1 for 10%. Benchmarks
+    skipped or missing in either run are reported without a change.
+    """
+    baseline_by_name = {result.name: result for result in baseline}
+
+    comparisons = []
+    for result in results:
+        previous = baseline_by_name.get(result.name)
+        before = previous.items_per_second if previous is not None else None
+        after = result.items_per_second
+        change = after / before - 1 if before and after else None
+        comparisons.append(
+            Comparison(
+                name=result.name,
+                baseline=before,
+                current=after,
+                change=change,
+                regression=change is not None and change < -tolerance,
+            )
+        )
+
+    return comparisons
@@ -1,26 +1,122 @@
-from pymongo import MongoClient
-from qdrant_client import QdrantClient
+import os
+import re
+from threading import Lock
+
+from loguru import logger
+
+from .settings import settings
+
+
+class DatabaseConnectionError(RuntimeError):
+    pass
+
+
+_URI_CREDENTIALS = re.compile(r'(?<=://)[^/@]+@')
+
+
+def _redact_uri(uri: str) -> str:
+    """Hides the user and password of a connection URI, so it can be logged."""
+    return _URI_CREDENTIALS.sub('***@', uri)
+
+
+def ping_mongo(client) -> None:
+    """Raises DatabaseConnectionError if no MongoDB server answers within the server selection timeout."""
+    try:
+        client.admin.command('ping')
+    except Exception as e:
+        raise DatabaseConnectionError(
+            f'MongoDB at {_redact_uri(settings.MONGO_DATABASE_HOST)} is not reachable: {e}'
+        ) from e
+
+
+def ping_qdrant(client) -> None:
+    """Raises DatabaseConnectionError if Qdrant does not answer within its timeout."""
+    try:
+        client.get_collections()
+    except Exception as e:
+        raise DatabaseConnectionError(f'Qdrant at {_redact_uri(settings.QDRANT_DATABASE_URL)} is not reachable: {e}') from e
+
+
+def _is_qdrant_path(location: str) -> bool:
+    # 只有文件系统路径使用qdrant的本地模式，没有scheme的"host:port"仍然是远程服务
+    return location.startswith(('/', './', '../', '~')) or os.path.isabs(location)
 
-mongo_uri = "mongodb://localhost:27017/"
-qdrant_url = "http://localhost:6333"
 
 class MongoDBConnection:
     _instance = None
-    def __new__(cls,*args, **kwargs):
-        if cls._instance is None:
-            try:
-                # print(kwargs)
-                cls._instance = MongoClient(mongo_uri, connect=True, **kwargs)
-            except Exception as e:
-                print(f'Exception {e} occurred when connecting to MongoDB.')
+    _lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        with cls._lock:
+            if cls._instance is None:
+                # 延迟导入，只在第一次真正连接时才付出导入的开销
+                from pymongo import MongoClient
+
+                options = {
+                    'maxPoolSize': settings.MONGO_MAX_POOL_SIZE,
+                    'minPoolSize': settings.MONGO_MIN_POOL_SIZE,
+                    'connectTimeoutMS': settings.MONGO_CONNECT_TIMEOUT_MS,
+                    'serverSelectionTimeoutMS': settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    'socketTimeoutMS': settings.MONGO_SOCKET_TIMEOUT_MS,
+                    'readPreference': settings.MONGO_READ_PREFERENCE,
+                }
+                if settings.MONGO_COMPRESSORS:
+                    options['compressors'] = settings.MONGO_COMPRESSORS
+                options.update(kwargs)
+
+                try:
+                    client = MongoClient(settings.MONGO_DATABASE_HOST, connect=True, **options)
+                except Exception as e:
+                    raise DatabaseConnectionError(f'Invalid MongoDB configuration: {e}') from e
+
+                if settings.DATABASE_HEALTH_CHECK:
+                    ping_mongo(client)
+                cls._instance = client
+                logger.info('Connected to MongoDB.', host=_redact_uri(settings.MONGO_DATABASE_HOST), **options)
+
         return cls._instance
 
+
 class QdrantConnection:
-    _instance=None
+    _instance = None
+    _lock = Lock()
+
     def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            try:
-                cls._instance = QdrantClient(url=qdrant_url)
-            except Exception as e:
-                print(f'Exception {e} occurred when connecting to MongoDB.')
-        return cls._instance
\ No newline at end of file
+        with cls._lock:
+            if cls._instance is None:
+                from qdrant_client import QdrantClient
+
+                location = settings.QDRANT_DATABASE_URL
+                # 设置为":memory:"或本地路径时在进程内运行qdrant，可以在没有qdrant服务的情况下测试
+                if location == ':memory:':
+                    options = {'location': location}
+                elif _is_qdrant_path(location):
+                    options = {'path': os.path.expanduser(location)}
+                else:
+                    options = {
+                        'url': location,
+                        'prefer_grpc': settings.QDRANT_PREFER_GRPC,
+                        'grpc_port': settings.QDRANT_GRPC_PORT,
+                        'timeout': settings.QDRANT_TIMEOUT,
+                        'api_key': settings.QDRANT_API_KEY,
+                        'grpc_options': {
+                            'grpc.keepalive_time_ms': settings.QDRANT_GRPC_KEEPALIVE_MS,
+                            'grpc.keepalive_timeout_ms': settings.QDRANT_GRPC_KEEPALIVE_TIMEOUT_MS,
+                            'grpc.keepalive_permit_without_calls': 1,
+                        },
+                    }
+                options.update(kwargs)
+
+                try:
+                    client = QdrantClient(**options)
+                except Exception as e:
+                    raise DatabaseConnectionError(f'Invalid Qdrant configuration: {e}') from e
+
+                if settings.DATABASE_HEALTH_CHECK:
+                    ping_qdrant(client)
+                cls._instance = client
+                logger.info(
+                    'Connected to Qdrant.', location=_redact_uri(location), prefer_grpc=options.get('prefer_grpc', False)
+                )
+
+        return cls._instance
@@ -0,0 +1,90 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+PayloadIndexType = Literal["keyword", "uuid", "integer", "float", "text", "bool", "datetime"]
+
+
+class CollectionConfig(BaseModel):
+    """
+    The storage and index configuration of the Qdrant collection of a VectorBaseDocument class.
+
+    ``None`` leaves a parameter to the Qdrant server default. The ``search_*`` fields are the defaults used by
+    ``VectorBaseDocument.search`` and can be overridden per query.
+    """
+
+    # 标量量化把每个维度从float32压缩为int8（内存约为1/4），二值量化压缩为1 bit（约1/32），配合rescore使用
+    quantization: Literal["none", "scalar", "binary"] = "none"
+    quantization_always_ram: bool = True
+    hnsw_m: int | None = Field(default=None, gt=0)
+    hnsw_ef_construct: int | None = Field(default=None, gt=0)
+    on_disk_vectors: bool | None = None
+    on_disk_payload: bool | None = None
+    payload_indexes: dict[str, PayloadIndexType] = Field(default_factory=dict)
+
+    # 精简payload：qdrant中只保留id和过滤字段，其余字段压缩后存在MongoDB，检索后再批量取回
+    slim_payload: bool = False
+    side_store_fields: set[str] = Field(default_factory=set)
+    # 整个集合都相同的字段（如模型元数据），只存一份
+    shared_fields: set[str] = Field(default_factory=set)
+
+    search_hnsw_ef: int | None = Field(default=None, gt=0)
+    search_rescore: bool | None = None
+    search_oversampling: float | None = Field(default=None, ge=1.0)
+
+    @property
+    def offloaded_fields(self) -> set[str]:
+        """The fields left out of the Qdrant payload."""
+        return self.side_store_fields | self.shared_fields if self.slim_payload else set()
+
+    def to_hnsw_config(self):
+        from qdrant_client.http.models import HnswConfigDiff
+
+        if self.hnsw_m is None and self.hnsw_ef_construct is None:
+            return None
+
+        return HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def to_quantization_config(self, for_update: bool = False):
+        """Returns the quantization config, or with ``for_update`` the Disabled marker that removes it."""
+        from qdrant_client.http.models import (
+            BinaryQuantization,
+            BinaryQuantizationConfig,
+            Disabled,
+            ScalarQuantization,
+            ScalarQuantizationConfig,
+            ScalarType,
+        )
+
+        if self.quantization == "scalar":
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=self.quantization_always_ram)
+            )
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=self.quantization_always_ram))
+
+        return Disabled.DISABLED if for_update else None
+
+    def to_search_params(
+        self, hnsw_ef: int | None = None, rescore: bool | None = None, oversampling: float | None = None, exact: bool = False
+    ):
+        """Returns the search params for the given overrides and the configured defaults, or None if all unset."""
+        from qdrant_client.http.models import QuantizationSearchParams, SearchParams
+
+        hnsw_ef = hnsw_ef or self.search_hnsw_ef
+        rescore = self.search_rescore if rescore is None else rescore
+        oversampling = oversampling or self.search_oversampling
+
+        quantization = None
+        if self.quantization != "none" and (rescore is not None or oversampling is not None):
+            quantization = QuantizationSearchParams(rescore=rescore, oversampling=oversampling)
+
+        if hnsw_ef is None and quantization is None and not exact:
+            return None
+
+        return SearchParams(hnsw_ef=hnsw_ef, exact=exact, quantization=quantization)
+
+    def to_payload_schema(self, index_type: PayloadIndexType):
+        from qdrant_client.http.models import PayloadSchemaType
+
+        return PayloadSchemaType(index_type)
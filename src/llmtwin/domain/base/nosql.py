@@ -1,14 +1,33 @@
 import uuid
-from typing import TypeVar, Generic, Type
+from itertools import batched
+from typing import Iterable, Iterator, TypeVar, Generic, Type
 from pydantic import BaseModel, Field, UUID4
-from pymongo.results import InsertOneResult, InsertManyResult
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertOneResult, InsertManyResult
 from bson.codec_options import CodecOptions
 from bson.binary import UuidRepresentation
 from abc import ABC, abstractmethod
+from threading import Lock
+from pymongo.database import Database
+import bson
+from .trusted import SCHEMA_VERSION_FIELD, get_reader, schema_version
 from ...connection import MongoDBConnection
+from ...metrics import metrics
 from ...settings import settings
 
-_database = MongoDBConnection(uuidRepresentation='standard').get_database(settings.DATABASE_NAME)
+# 第一次访问数据库时才建立连接，导入模块不会连接MongoDB
+_database: Database | None = None
+_database_lock = Lock()
+
+
+def get_database() -> Database:
+    global _database
+
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = MongoDBConnection(uuidRepresentation='standard').get_database(settings.DATABASE_NAME)
+    return _database
 
 T = TypeVar('T', bound="BaseDocument")
 
@@ -35,32 +54,174 @@ class BaseDocument(BaseModel, ABC, Generic[T]):
         pass
 
     @classmethod
-    def from_mongo(cls: Type[T], data: dict, **kwargs) -> T:
-        return cls.model_validate(data, **kwargs)
+    def from_mongo(cls: Type[T], data: dict, trusted: bool | None = None, partial: bool = False, **kwargs) -> T:
+        """Builds the document from its raw dict, without validation in trusted mode, see ``TrustedReader``."""
+        return get_reader(cls, "bson").read(data, trusted=trusted, partial=partial, **kwargs)
     
     def to_mongo(self: T, **kwargs) -> dict:
-        return self.model_dump(**kwargs)
+        data = self.model_dump(**kwargs)
+        data[SCHEMA_VERSION_FIELD] = schema_version(type(self))
+        return data
 
     @classmethod
     def find_one(cls: Type[T], filter_options: dict, **kwargs) -> T:
-        collection = _database[cls.get_collection_name()]
-        result = collection.find_one(filter_options)
+        collection = get_database()[cls.get_collection_name()]
+        with metrics.track('mongo.find_one', collection=cls.get_collection_name()):
+            result = collection.find_one(filter_options)
         return cls.from_mongo(result, **kwargs)
     
     def insert(self: T, **kwargs) -> InsertOneResult:
-        collection = _database[self.get_collection_name()]
-        result = collection.insert_one(self.to_mongo(**kwargs))
+        collection = get_database()[self.get_collection_name()]
+        with metrics.track('mongo.insert', collection=self.get_collection_name()):
+            result = collection.insert_one(self.to_mongo(**kwargs))
         return result
     
     @classmethod
-    def bulk_find(cls: Type[T], filter_options: dict, **kwargs) -> list[T]:
-        collection = _database[cls.get_collection_name()]
-        instances = collection.find(filter_options)
-        result = [cls.from_mongo(instance, **kwargs) for instance in instances]
+    def bulk_find(
+        cls: Type[T],
+        filter_options: dict,
+        projection: dict | list[str] | None = None,
+        trusted: bool | None = None,
+        **kwargs,
+    ) -> list[T]:
+        """Returns the matching documents.
+
+        Args:
+            filter_options (dict): The MongoDB filter.
+            projection (dict | list[str] | None): The fields to return, only these are sent by the server.
+                The documents are then built without validation. Defaults to all fields.
+            trusted (bool | None): Whether to decode whole batches and skip the validation of documents stamped
+                with the current schema. Defaults to TRUSTED_READS.
+        """
+        trusted = settings.TRUSTED_READS if trusted is None else trusted
+        collection = get_database()[cls.get_collection_name()]
+        with metrics.track('mongo.find', collection=cls.get_collection_name()) as timer:
+            instances = list(_find(collection, filter_options, projection, raw_batches=trusted))
+            timer.items = len(instances)
+        partial = projection is not None
+        result = [cls.from_mongo(instance, trusted=trusted, partial=partial, **kwargs) for instance in instances]
         return result
     
     @classmethod
     def bulk_insert(cls: Type[T], doc_list: list[T], **kwargs) -> InsertManyResult:
-        collection = _database[cls.get_collection_name()]
-        result = collection.insert_many(doc.to_mongo(**kwargs) for doc in doc_list)
-        return result
\ No newline at end of file
+        collection = get_database()[cls.get_collection_name()]
+        with metrics.track('mongo.insert_many', items=len(doc_list), collection=cls.get_collection_name()):
+            result = collection.insert_many(doc.to_mongo(**kwargs) for doc in doc_list)
+        return result
+
+    @classmethod
+    def iter_find(
+        cls: Type[T],
+        filter_options: dict | None = None,
+        batch_size: int = 1000,
+        projection: dict | list[str] | None = None,
+        sort_key: str = '_id',
+        resume_after: UUID4 | None = None,
+        trusted: bool | None = None,
+        **kwargs,
+    ) -> Iterator[T]:
+        """Lazily iterates over the matching documents.
+
+        Documents are pulled from the server ``batch_size`` at a time and validated one by one,
+        so memory stays constant no matter how large the collection is.
+
+        Args:
+            filter_options (dict | None): The MongoDB filter. Defaults to matching every document.
+            batch_size (int): The number of documents fetched per round trip.
+            projection (dict | list[str] | None): The fields to return, only these are sent by the server.
+                The documents are then built without validation. Defaults to all fields.
+            sort_key (str): The field to iterate in ascending order of. Ties are broken by ``_id``.
+            resume_after (UUID4 | None): Only yield documents whose ``_id`` is greater than this one.
+                Only supported when iterating in ``_id`` order.
+            trusted (bool | None): Whether to decode whole batches and skip the validation of documents stamped
+                with the current schema. Defaults to TRUSTED_READS.
+
+        Yields:
+            T: The validated documents.
+        """
+        filter_options = dict(filter_options or {})
+        if resume_after is not None:
+            if sort_key != '_id':
+                raise ValueError("resume_after is only supported when sort_key is '_id'.")
+            filter_options = {'$and': [filter_options, {'_id': {'$gt': resume_after}}]}
+
+        sort = [(sort_key, ASCENDING)]
+        if sort_key != '_id':
+            sort.append(('_id', ASCENDING))
+
+        trusted = settings.TRUSTED_READS if trusted is None else trusted
+        partial = projection is not None
+        collection = get_database()[cls.get_collection_name()]
+        # 游标按需拉取，耗时和调用方的处理混在一起，这里只统计读取的文档数
+        num_documents = 0
+        try:
+            for instance in _find(collection, filter_options, projection, sort, batch_size, raw_batches=trusted):
+                num_documents += 1
+                yield cls.from_mongo(instance, trusted=trusted, partial=partial, **kwargs)
+        finally:
+            metrics.increment(
+                'stage_items_total', num_documents, stage='mongo.iter_find', collection=cls.get_collection_name()
+            )
+
+    @classmethod
+    def bulk_upsert(cls: Type[T], doc_list: Iterable[T], batch_size: int = 1000, **kwargs) -> list[BulkWriteResult]:
+        """Upserts the documents by ``_id`` in unordered batches of ``batch_size``.
+
+        Unlike ``bulk_insert`` this is idempotent, so re-running a job does not fail on duplicate keys,
+        and ``doc_list`` may be a generator as only one batch is held in memory at a time.
+
+        Returns:
+            list[BulkWriteResult]: The result of every batch written.
+        """
+        kwargs.setdefault('by_alias', True)
+        collection = get_database()[cls.get_collection_name()]
+
+        results = []
+        for batch in batched(doc_list, batch_size):
+            requests = []
+            for doc in batch:
+                data = doc.to_mongo(**kwargs)
+                requests.append(ReplaceOne({'_id': data['_id']}, data, upsert=True))
+            with metrics.track('mongo.bulk_write', items=len(requests), collection=cls.get_collection_name()):
+                results.append(collection.bulk_write(requests, ordered=False))
+
+        return results
+
+    @classmethod
+    def bulk_delete(cls: Type[T], filter_options: dict) -> DeleteResult:
+        """Deletes the documents matching the MongoDB filter."""
+        collection = get_database()[cls.get_collection_name()]
+        with metrics.track('mongo.delete_many', collection=cls.get_collection_name()) as timer:
+            result = collection.delete_many(filter_options)
+            timer.items = result.deleted_count
+        return result
+
+def _find(
+    collection,
+    filter_options: dict,
+    projection: dict | list[str] | None = None,
+    sort: list | None = None,
+    batch_size: int = 0,
+    raw_batches: bool = False,
+) -> Iterator[dict]:
+    """Iterates over the matching documents, decoding every batch returned by the server with one ``decode_all`` call."""
+    cursor = None
+    if raw_batches:
+        try:
+            cursor = collection.find_raw_batches(filter_options, projection)
+        except NotImplementedError:
+            # mongomock等不支持原始批次的实现退回普通游标
+            raw_batches = False
+    if cursor is None:
+        cursor = collection.find(filter_options, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
+
+    with cursor:
+        if not raw_batches:
+            yield from cursor
+            return
+        for batch in cursor:
+            yield from bson.decode_all(batch, collection.codec_options)
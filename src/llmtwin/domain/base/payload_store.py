@@ -0,0 +1,72 @@
+import json
+import zlib
+from typing import Iterable
+from uuid import UUID
+
+from bson.binary import Binary
+from pymongo import ReplaceOne
+
+from .nosql import get_database
+
+_COLLECTION_METADATA_ID = "__collection_metadata__"
+_MAX_IDS_PER_QUERY = 10000
+
+
+class PayloadStore:
+    """
+    A MongoDB side store for the payload fields of a Qdrant collection that are only needed once a point has
+    been retrieved, e.g. the chunk text. Every point's fields are stored as one zlib-compressed JSON blob keyed
+    by the point id, and the fields identical across the collection are stored once.
+    """
+
+    def __init__(self, vector_collection_name: str, compression_level: int = 6) -> None:
+        self._collection_name = f"{vector_collection_name}_payloads"
+        self._compression_level = compression_level
+
+    @property
+    def collection(self):
+        return get_database()[self._collection_name]
+
+    def put_many(self, payloads: dict[UUID, dict]) -> None:
+        if not payloads:
+            return
+
+        requests = [
+            ReplaceOne({"_id": _id}, {"_id": _id, "data": Binary(self._compress(payload))}, upsert=True)
+            for _id, payload in payloads.items()
+        ]
+        self.collection.bulk_write(requests, ordered=False)
+
+    def get_many(self, ids: Iterable[UUID]) -> dict[UUID, dict]:
+        ids = list(dict.fromkeys(ids))
+        payloads = {}
+        for start in range(0, len(ids), _MAX_IDS_PER_QUERY):
+            cursor = self.collection.find({"_id": {"$in": ids[start : start + _MAX_IDS_PER_QUERY]}})
+            payloads.update((entry["_id"], self._decompress(entry["data"])) for entry in cursor)
+
+        return payloads
+
+    def delete_many(self, ids: Iterable[UUID]) -> int:
+        ids = list(ids)
+        if not ids:
+            return 0
+
+        return self.collection.delete_many({"_id": {"$in": ids}}).deleted_count
+
+    def get_collection_metadata(self) -> dict:
+        entry = self.collection.find_one({"_id": _COLLECTION_METADATA_ID})
+        return self._decompress(entry["data"]) if entry else {}
+
+    def set_collection_metadata(self, metadata: dict) -> None:
+        self.collection.replace_one(
+            {"_id": _COLLECTION_METADATA_ID},
+            {"_id": _COLLECTION_METADATA_ID, "data": Binary(self._compress(metadata))},
+            upsert=True,
+        )
+
+    def _compress(self, payload: dict) -> bytes:
+        return zlib.compress(json.dumps(payload, separators=(",", ":")).encode(), self._compression_level)
+
+    @staticmethod
+    def _decompress(data: bytes) -> dict:
+        return json.loads(zlib.decompress(data))
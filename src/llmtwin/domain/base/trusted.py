@@ -0,0 +1,219 @@
+import hashlib
+import random
+import types
+import typing
+from datetime import datetime
+from functools import cache
+from threading import Lock
+from typing import Any, Callable, Literal, Type
+from uuid import UUID
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+
+from ...metrics import metrics
+from ...settings import settings
+
+# 每个写入的文档都带上模型的schema版本，读取时版本一致才跳过校验
+SCHEMA_VERSION_FIELD = "_schema"
+
+# 解码器直接给出的类型：BSON保留UUID和datetime，JSON payload中它们是字符串
+_DECODED_TYPES = {
+    "bson": (str, int, float, bool, dict, list, type(None), UUID, datetime, Any),
+    "json": (str, int, float, bool, dict, list, type(None), Any),
+}
+
+# 校验失败或抽样发现类型不一致的模型，本进程内不再走可信路径
+_untrusted: set[type] = set()
+_untrusted_lock = Lock()
+
+
+@cache
+def schema_version(model_class: Type[BaseModel]) -> str:
+    """A fingerprint of the fields of the model, which changes whenever a field is added, removed or retyped."""
+    fields = sorted(
+        (name, field.alias or "", repr(field.annotation)) for name, field in model_class.model_fields.items()
+    )
+    return hashlib.blake2b(repr(fields).encode(), digest_size=8).hexdigest()
+
+
+class TrustedReader:
+    """
+    Builds the models read from a database with ``model_construct`` instead of a full validation.
+
+    Only documents stamped with the current ``schema_version`` of the model are trusted, the others (written
+    before the stamp existed or by another version of the model) are validated. A ``TRUSTED_READS_SAMPLE_RATE``
+    fraction of the trusted documents is still validated, and if one fails or validates to different types
+    the model is validated for the rest of the process, so schema drift is caught on the first sample.
+
+    Values the decoder cannot give in the field type, e.g. UUIDs stored as strings in a Qdrant payload, are
+    converted; models with fields it cannot convert cheaply, e.g. datetimes in JSON, are always validated.
+    """
+
+    def __init__(self, model_class: Type[BaseModel], decoder: Literal["bson", "json"]) -> None:
+        self.model_class = model_class
+        self.decoder = decoder
+        self.schema_version = schema_version(model_class)
+        self.converters = _plan_converters(model_class, _DECODED_TYPES[decoder])
+        if self.converters is None:
+            logger.info(f"{model_class.__name__} has fields that cannot be read without validation, reads are validated.")
+        # model_construct逐个字段处理别名和默认值，比Rust中的校验还慢；这里预先算好每个字段的读取方式
+        self._keys = [(field.alias or name, name) for name, field in model_class.model_fields.items()]
+        self._field_converters = [
+            (name, self.converters[key]) for key, name in self._keys if key in (self.converters or {})
+        ]
+        self._fast_construct = not model_class.__private_attributes__
+
+    def read(self, data: dict, trusted: bool | None = None, partial: bool = False, **kwargs) -> BaseModel:
+        """
+        Builds a model from a decoded document.
+
+        Args:
+            data (dict): The decoded document.
+            trusted (bool | None): Whether to skip the validation of stamped documents. Defaults to TRUSTED_READS.
+            partial (bool): Whether only some fields were read, e.g. with a projection. Partial documents cannot
+                be validated and are always built without validation.
+            **kwargs: Passed to ``model_validate``.
+        """
+        trusted = settings.TRUSTED_READS if trusted is None else trusted
+        # 模型忽略多余的字段，版本号留在data中即可
+        stamp = data.get(SCHEMA_VERSION_FIELD)
+
+        if partial:
+            return self._construct(data)
+
+        if not trusted or self.converters is None or self.model_class in _untrusted:
+            return self.model_class.model_validate(data, **kwargs)
+
+        if stamp != self.schema_version:
+            # 可信读取的文档不逐个计数，只统计回退到校验的文档
+            metrics.increment("trusted_reads_total", stage="deserialize", model=self.model_class.__name__, mode="stale")
+            return self.model_class.model_validate(data, **kwargs)
+
+        if settings.TRUSTED_READS_SAMPLE_RATE > 0 and random.random() < settings.TRUSTED_READS_SAMPLE_RATE:
+            metrics.increment("trusted_reads_total", stage="deserialize", model=self.model_class.__name__, mode="sampled")
+            return self._validate_sample(data, **kwargs)
+
+        return self._construct(data)
+
+    def _construct(self, data: dict) -> BaseModel:
+        values = {name: data[key] for key, name in self._keys if key in data}
+        if len(values) < len(self._keys):
+            for key, name in self._keys:
+                if name in values:
+                    continue
+                if name in data:
+                    values[name] = data[name]
+        fields_set = set(values)
+        for name, convert in self._field_converters:
+            value = values.get(name)
+            if value is not None:
+                values[name] = convert(value)
+
+        if len(values) < len(self._keys):
+            for name, field in self.model_class.model_fields.items():
+                if name not in values and not field.is_required():
+                    values[name] = field.get_default(call_default_factory=True, validated_data=values)
+
+        if not self._fast_construct:
+            return self.model_class.model_construct(fields_set, **values)
+
+        # 与model_construct设置的属性相同
+        model = self.model_class.__new__(self.model_class)
+        object.__setattr__(model, "__dict__", values)
+        object.__setattr__(model, "__pydantic_fields_set__", fields_set)
+        object.__setattr__(model, "__pydantic_extra__", None)
+        object.__setattr__(model, "__pydantic_private__", None)
+        return model
+
+    def _validate_sample(self, data: dict, **kwargs) -> BaseModel:
+        try:
+            validated = self.model_class.model_validate(data, **kwargs)
+        except ValidationError:
+            self._distrust("a stamped document failed validation")
+            raise
+
+        constructed = self._construct(dict(data))
+        for name in self.model_class.model_fields:
+            if not _same_kind(getattr(constructed, name, None), getattr(validated, name, None)):
+                self._distrust(f"field {name} is read as {type(getattr(constructed, name, None)).__name__}")
+                break
+
+        return validated
+
+    def _distrust(self, reason: str) -> None:
+        with _untrusted_lock:
+            if self.model_class in _untrusted:
+                return
+            _untrusted.add(self.model_class)
+        metrics.increment("trusted_reads_drift_total", stage="deserialize", model=self.model_class.__name__)
+        logger.error(
+            f"Schema drift in the stored {self.model_class.__name__} documents: {reason}. "
+            "Validating every document read from now on."
+        )
+
+
+@cache
+def get_reader(model_class: Type[BaseModel], decoder: Literal["bson", "json"]) -> TrustedReader:
+    return TrustedReader(model_class, decoder)
+
+
+def _plan_converters(model_class: Type[BaseModel], decoded_types: tuple) -> dict[str, Callable] | None:
+    """Returns the converter of every field, keyed by its key in the stored data, or None if one has no cheap converter."""
+    converters = {}
+    for name, field in model_class.model_fields.items():
+        convert = _converter(field.annotation, decoded_types)
+        if convert is False:
+            return None
+        if convert is not None:
+            converters[field.alias or name] = convert
+    return converters
+
+
+def _converter(annotation, decoded_types: tuple) -> Callable | None | Literal[False]:
+    # None：解码出的值可以直接使用；False：无法不经校验地转换
+    origin = typing.get_origin(annotation)
+    if origin is typing.Annotated:
+        return _converter(typing.get_args(annotation)[0], decoded_types)
+
+    if origin is typing.Union or origin is types.UnionType:
+        converters = [_converter(arg, decoded_types) for arg in typing.get_args(annotation)]
+        if False in converters:
+            return False
+        converters = [convert for convert in converters if convert is not None]
+        if len(converters) > 1:
+            return False
+        return converters[0] if converters else None
+
+    if origin in (list, tuple, set):
+        args = typing.get_args(annotation)
+        convert = _converter(args[0], decoded_types) if args else None
+        if convert is False:
+            return False
+        if convert is None:
+            return None if origin is list else origin
+        return lambda values: origin(convert(value) for value in values)
+
+    if origin is dict or annotation in decoded_types:
+        return None
+    if annotation is UUID:
+        return _to_uuid
+    if annotation is np.ndarray:
+        # 向量以list读出，与校验时走list[float]分支的结果相同
+        return None
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return lambda value: annotation.model_validate(value) if isinstance(value, dict) else value
+
+    return False
+
+
+def _to_uuid(value):
+    return UUID(value) if isinstance(value, str) else value
+
+
+def _same_kind(a, b) -> bool:
+    if type(a) is type(b):
+        return True
+    # 整数写入float字段时，校验会转换成float
+    return isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool)
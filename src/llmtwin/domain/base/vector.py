@@ -1,21 +1,116 @@
 from xml.dom.minidom import Document
 from ...connection import QdrantConnection
+from ...metrics import metrics
+from .collection_config import CollectionConfig
+from .trusted import SCHEMA_VERSION_FIELD, get_reader, schema_version
+from ...settings import settings
 from pydantic import BaseModel, UUID4, Field
 from abc import ABC, abstractmethod
-from typing import Type, Generic, TypeVar
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import batched
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Type, Generic, TypeVar
 import numpy as np
+import random
+import time
 import uuid
 from uuid import UUID
 
-from qdrant_client.http import exceptions
-from qdrant_client.http.models import Distance, VectorParams, UpdateResult
-from qdrant_client.models import CollectionInfo, PointStruct, Record
+from loguru import logger
 
+# 导入qdrant_client需要一秒多，只在真正访问qdrant时才导入
+if TYPE_CHECKING:
+    from qdrant_client import QdrantClient
+    from qdrant_client.http.models import Filter, UpdateResult
+    from qdrant_client.models import CollectionInfo, PointStruct, Record
 
-_database = QdrantConnection()
+    from ...networks.sparse import SparseEmbedding
+    from .payload_store import PayloadStore
+
+
+_database: "QdrantClient | None" = None
+_database_lock = Lock()
+
+
+def get_database() -> "QdrantClient":
+    global _database
+
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                if settings.VECTOR_BACKEND == "numpy":
+                    from llmtwin.numpy_store import NumpyVectorStore
+
+                    _database = NumpyVectorStore(
+                        settings.NUMPY_VECTOR_STORE_PATH,
+                        ivf_lists=settings.NUMPY_VECTOR_STORE_IVF_LISTS,
+                        ivf_probes=settings.NUMPY_VECTOR_STORE_IVF_PROBES,
+                    )
+                else:
+                    _database = QdrantConnection()
+    return _database
 
 T = TypeVar('T', bound='VectorBaseDocument')
 
+# 开启稀疏向量时，集合使用命名向量：稠密向量和BM25稀疏向量
+DENSE_VECTOR_NAME = 'dense'
+SPARSE_VECTOR_NAME = 'sparse'
+
+# 每个集合共享字段的缓存，避免每批写入和每次hydrate都读取MongoDB
+_collection_metadata: dict[str, dict] = {}
+
+_TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+_MAX_BACKOFF = 30.0
+
+
+class UpsertBatchResult(BaseModel):
+    """The outcome of writing one batch of points with ``VectorBaseDocument.bulk_upsert``."""
+
+    batch_index: int
+    num_points: int
+    attempts: int
+    status: str | None = None
+    operation_id: int | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _vector_nbytes(documents: Iterable["VectorBaseDocument"]) -> int:
+    # 只统计稠密向量的大小（float32），payload的序列化大小要编码后才知道
+    return sum(4 * len(embedding) for document in documents if (embedding := getattr(document, "embedding", None)) is not None)
+
+
+def _dense_vector(vector) -> list:
+    if isinstance(vector, dict):
+        return vector.get(DENSE_VECTOR_NAME) or []
+    return vector or []
+
+
+def _is_transient(error: Exception) -> bool:
+    from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+    # 网络错误、超时、限流和服务端5xx错误可以重试，其余错误（如向量维度不对）重试也没用
+    if isinstance(error, (ResponseHandlingException, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code in _TRANSIENT_STATUS_CODES
+
+    try:
+        import grpc
+    except ImportError:
+        return False
+    if isinstance(error, grpc.RpcError) and hasattr(error, 'code'):
+        return error.code() in (
+            grpc.StatusCode.UNAVAILABLE,
+            grpc.StatusCode.DEADLINE_EXCEEDED,
+            grpc.StatusCode.RESOURCE_EXHAUSTED,
+        )
+
+    return False
+
 class VectorBaseDocument(BaseModel, Generic[T], ABC):
     # 注意：由于qdrant不像mongodb那样自动提供id，因此必须手动设置id
     # 由于id是每次实例化时随机生成的，因此不能固定id（会在不同实例共享），而是需要提供一个生成方法。
@@ -32,10 +127,17 @@ class VectorBaseDocument(BaseModel, Generic[T], ABC):
         pass
 
     @classmethod
-    def from_record(cls: Type[T], record: Record) -> T:
+    def from_record(cls: Type[T], record: "Record", validate: bool = True, trusted: bool | None = None) -> T:
+        """Builds the document from a point, without validation in trusted mode, see ``TrustedReader``.
+
+        With ``validate=False``, e.g. when only some payload fields were read, it is never validated. With slim
+        payloads the offloaded fields are still missing, the document is validated by ``hydrate`` instead.
+        """
         # Record 是一个包含 id, score, vector, payload等属性的结构。代表qdrant查询的返回结果。
         payload = record.payload or {}
         vector = record.vector
+        if isinstance(vector, dict):
+            vector = vector.get(DENSE_VECTOR_NAME)
         # 读取id时从str转换为UUID
         _id = UUID(record.id, version=4)
 
@@ -47,75 +149,516 @@ class VectorBaseDocument(BaseModel, Generic[T], ABC):
         if 'embedding' in cls.model_fields:
             attributes['embedding'] = vector or None
 
-        return cls(**attributes)
+        # 只取了部分payload字段，或字段存在side store中尚未取回时，无法通过完整校验
+        if not validate or cls.get_collection_config().offloaded_fields:
+            return get_reader(cls, "json").read(attributes, partial=True)
+
+        return get_reader(cls, "json").read(attributes, trusted=trusted)
     
-    def to_point(self: T) -> PointStruct:
-        attributes = self.model_dump()
+    def to_point(self: T) -> "PointStruct":
+        # embedding不经过model_dump，避免逐个float复制
+        attributes = self.model_dump(
+            exclude={'embedding', 'sparse_embedding', *self.get_collection_config().offloaded_fields}
+        )
 
         # 生成id时，从UUID转换为str
         _id = str(attributes.pop('id'))
-        vector = attributes.pop('embedding', {})
-        if isinstance(vector, np.ndarray):
-            vector.tolist()
+        attributes[SCHEMA_VERSION_FIELD] = schema_version(type(self))
+        vector = getattr(self, 'embedding', None)
+        if vector is None:
+            vector = {}
+        elif isinstance(vector, np.ndarray):
+            vector = vector.tolist()
+
+        from qdrant_client.models import PointStruct, SparseVector
 
-        return PointStruct(id=_id, vector=vector, payload=attributes)
+        if self.use_sparse_vectors():
+            vector = {DENSE_VECTOR_NAME: vector} if len(vector) > 0 else {}
+            sparse_embedding = getattr(self, 'sparse_embedding', None)
+            if sparse_embedding is not None and sparse_embedding.indices:
+                vector[SPARSE_VECTOR_NAME] = SparseVector.model_construct(
+                    indices=sparse_embedding.indices, values=sparse_embedding.values
+                )
+
+        # 字段已经由文档本身校验过，跳过PointStruct对向量的逐元素校验
+        return PointStruct.model_construct(id=_id, vector=vector, payload=attributes)
     
     @classmethod
-    def bulk_insert(cls: Type[T], documents: list[T]) -> UpdateResult:
+    def bulk_insert(cls: Type[T], documents: list[T]) -> "UpdateResult":
         collection_name = cls.get_collection_name()
         points = [doc.to_point() for doc in documents]
 
-        result = _database.upsert(
-            collection_name=collection_name,
-            points=points,
-        )
+        # 先写side store，保证检索到的点总能取回其内容
+        cls._store_offloaded_fields(documents)
+        with metrics.track(
+            "vector.upsert", items=len(points), nbytes=_vector_nbytes(documents), collection=collection_name
+        ):
+            result = get_database().upsert(
+                collection_name=collection_name,
+                points=points,
+            )
         return result
     
     @classmethod
-    def bulk_find(cls: Type[T], limit: int=10, **kwargs) -> tuple[list[T], UUID4 | None]:
+    def bulk_upsert(
+        cls: Type[T],
+        documents: Iterable[T],
+        batch_size: int = settings.QDRANT_WRITE_BATCH_SIZE,
+        concurrency: int = settings.QDRANT_WRITE_CONCURRENCY,
+        wait_for_result: bool = settings.QDRANT_WRITE_WAIT,
+        max_retries: int = settings.QDRANT_WRITE_MAX_RETRIES,
+        backoff: float = settings.QDRANT_WRITE_BACKOFF,
+    ) -> list[UpsertBatchResult]:
+        """Upserts the documents in batches, with at most ``concurrency`` requests in flight at a time.
+
+        ``documents`` may be a generator: only the batches in flight are held in memory. Batches failing with
+        a transient error (network errors, timeouts, 429 and 5xx responses) are retried with exponential
+        backoff and jitter. A batch that still fails is reported in its result instead of stopping the others.
+
+        Args:
+            documents (Iterable[T]): The documents to upsert.
+            batch_size (int): The number of points per upsert request.
+            concurrency (int): The largest number of upsert requests in flight.
+            wait_for_result (bool): Whether every request waits for the points to be persisted. With False the
+                server only acknowledges receiving them, which is faster but the points may not be searchable yet.
+            max_retries (int): The number of retries of a batch failing with a transient error.
+            backoff (float): The delay in seconds before the first retry, doubled after every retry.
+
+        Returns:
+            list[UpsertBatchResult]: The result of every batch, in input order.
+        """
+        def prepare(batch: tuple[T, ...]) -> tuple[list["PointStruct"], int]:
+            points = [doc.to_point() for doc in batch]
+            try:
+                cls._store_offloaded_fields(batch)
+            except Exception as e:
+                raise RuntimeError(f"Failed to store the offloaded payloads: {e!r}") from e
+            return points, _vector_nbytes(batch)
+
+        return cls._upsert_batches(
+            batched(documents, batch_size), prepare, concurrency, wait_for_result, max_retries, backoff
+        )
+
+    @classmethod
+    def upsert_points(
+        cls: Type[T],
+        point_batches: Iterable[list["PointStruct"]],
+        concurrency: int = settings.QDRANT_WRITE_CONCURRENCY,
+        wait_for_result: bool = settings.QDRANT_WRITE_WAIT,
+        max_retries: int = settings.QDRANT_WRITE_MAX_RETRIES,
+        backoff: float = settings.QDRANT_WRITE_BACKOFF,
+    ) -> list[UpsertBatchResult]:
+        """Like ``bulk_upsert``, but for batches of points built beforehand, e.g. restored from a snapshot.
+
+        The points are written as they are: nothing is written to the side store of the offloaded fields.
+        """
+
+        def prepare(batch: list["PointStruct"]) -> tuple[list["PointStruct"], int]:
+            return batch, sum(4 * len(_dense_vector(point.vector)) for point in batch)
+
+        return cls._upsert_batches(point_batches, prepare, concurrency, wait_for_result, max_retries, backoff)
+
+    @classmethod
+    def _upsert_batches(
+        cls: Type[T],
+        batches: Iterable,
+        prepare: Callable[[object], tuple[list["PointStruct"], int]],
+        concurrency: int,
+        wait_for_result: bool,
+        max_retries: int,
+        backoff: float,
+    ) -> list[UpsertBatchResult]:
+        collection_name = cls.get_collection_name()
+
+        def upsert_batch(batch_index: int, batch) -> UpsertBatchResult:
+            try:
+                points, nbytes = prepare(batch)
+            except Exception as e:
+                logger.error(f"Failed to prepare batch {batch_index} of {collection_name}: {e!r}")
+                return UpsertBatchResult(batch_index=batch_index, num_points=len(batch), attempts=0, error=repr(e))
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    with metrics.track("vector.upsert", items=len(points), nbytes=nbytes, collection=collection_name):
+                        result = get_database().upsert(
+                            collection_name=collection_name, points=points, wait=wait_for_result
+                        )
+                    return UpsertBatchResult(
+                        batch_index=batch_index,
+                        num_points=len(points),
+                        attempts=attempt,
+                        status=result.status.value if result.status is not None else None,
+                        operation_id=result.operation_id,
+                    )
+                except Exception as e:
+                    if attempt > max_retries or not _is_transient(e):
+                        logger.error(
+                            f"Failed to upsert batch {batch_index} of {len(points)} points into {collection_name} "
+                            f"after {attempt} attempts: {e!r}"
+                        )
+                        return UpsertBatchResult(
+                            batch_index=batch_index, num_points=len(points), attempts=attempt, error=repr(e)
+                        )
+
+                    delay = min(_MAX_BACKOFF, backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                    metrics.increment("retries_total", stage="vector.upsert", collection=collection_name)
+                    logger.warning(f"Retrying batch {batch_index} of {collection_name} in {delay:.2f}s: {e!r}")
+                    time.sleep(delay)
+
+        results = []
+        in_flight: set[Future] = set()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for batch_index, batch in enumerate(batches):
+                # 限制同时进行的请求数，同时也限制了内存中的批次数
+                if len(in_flight) >= concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    results.extend(future.result() for future in done)
+                in_flight.add(executor.submit(upsert_batch, batch_index, batch))
+
+            results.extend(future.result() for future in in_flight)
+
+        return sorted(results, key=lambda result: result.batch_index)
+
+    @classmethod
+    def bulk_delete(cls: Type[T], ids: list[UUID4], delete_filter: "Filter | None" = None) -> "UpdateResult":
+        """Deletes the points with the given ids, restricted to those also matching ``delete_filter`` if given."""
+        from qdrant_client.http.models import Filter, FilterSelector, HasIdCondition
+
+        collection_name = cls.get_collection_name()
+        conditions = [HasIdCondition(has_id=[str(_id) for _id in ids])]
+        if delete_filter is not None:
+            conditions.append(delete_filter)
+
+        with metrics.track("vector.delete", items=len(ids), collection=collection_name):
+            result = get_database().delete(
+                collection_name=collection_name,
+                points_selector=FilterSelector(filter=Filter(must=conditions)),
+            )
+
+        if cls.get_collection_config().offloaded_fields and ids:
+            # 同样内容的chunk共享id，只删除确实已经不在qdrant中的点的side store记录
+            remaining = get_database().retrieve(
+                collection_name=collection_name, ids=[str(_id) for _id in ids], with_payload=False, with_vectors=False
+            )
+            remaining_ids = {UUID(str(point.id)) for point in remaining}
+            cls._payload_store().delete_many([_id for _id in ids if _id not in remaining_ids])
+
+        return result
+
+    @classmethod
+    def bulk_set_payload(
+        cls: Type[T], ids: list[UUID4], payload: dict, update_filter: "Filter | None" = None
+    ) -> "UpdateResult":
+        """Sets payload fields of the points with the given ids, restricted to those also matching ``update_filter`` if given."""
+        from qdrant_client.http.models import Filter, FilterSelector, HasIdCondition
+
+        collection_name = cls.get_collection_name()
+        conditions = [HasIdCondition(has_id=[str(_id) for _id in ids])]
+        if update_filter is not None:
+            conditions.append(update_filter)
+
+        with metrics.track("vector.set_payload", items=len(ids), collection=collection_name):
+            return get_database().set_payload(
+                collection_name=collection_name,
+                payload=payload,
+                points=FilterSelector(filter=Filter(must=conditions)),
+            )
+
+    @classmethod
+    def bulk_find(cls: Type[T], limit: int=10, trusted: bool | None = None, **kwargs) -> tuple[list[T], UUID4 | None]:
         collection_name = cls.get_collection_name()
         # offset是用id表示，因此要类似id那样做转换
         offset = kwargs.pop('offset', None)
         offset = str(offset) if offset else None
+        with_payloads = kwargs.pop('with_payloads', True)
 
-        results, next_offset = _database.scroll(
-            collection_name=collection_name,
-            limit=limit,
-            with_vectors=kwargs.pop('with_vectors', False),
-            with_payload=kwargs.pop('with_payloads', True),
-            offset=offset,
-            **kwargs
-        )
+        with metrics.track("vector.scroll", collection=collection_name) as timer:
+            results, next_offset = get_database().scroll(
+                collection_name=collection_name,
+                limit=limit,
+                with_vectors=kwargs.pop('with_vectors', False),
+                with_payload=with_payloads,
+                offset=offset,
+                **kwargs
+            )
+            timer.items = len(results)
 
-        documents = [cls.from_record(record) for record in results]
+        validate = with_payloads is True
+        documents = [cls.from_record(record, validate=validate, trusted=trusted) for record in results]
+        if validate:
+            documents = cls.hydrate(documents, trusted=trusted)
         if next_offset is not None:
             next_offset = UUID(next_offset, version=4)
         
         return documents, next_offset
+
+    @classmethod
+    def iter_find(
+        cls: Type[T],
+        page_size: int = 256,
+        with_payloads: bool | list[str] = True,
+        with_vectors: bool = False,
+        scroll_filter: "Filter | None" = None,
+        prefetch: bool = True,
+        trusted: bool | None = None,
+        **kwargs,
+    ) -> Iterator[T]:
+        """Iterates over the whole collection, following ``next_offset`` page by page.
+
+        While the caller processes a page, the next one is already being fetched in a background
+        thread, so at most two pages are held in memory.
+
+        Args:
+            page_size (int): The number of points fetched per scroll request.
+            with_payloads (bool | list[str]): Whether to return the payload, or the payload fields to return.
+                When only some fields are selected the documents are built without validation.
+            with_vectors (bool): Whether to return the vectors.
+            scroll_filter (Filter | None): Only return the points matching this filter.
+            prefetch (bool): Whether to fetch the next page while the current one is being consumed.
+            trusted (bool | None): Whether to skip the validation of points stamped with the current schema.
+                Defaults to TRUSTED_READS.
+
+        Yields:
+            T: The documents of the collection.
+        """
+        collection_name = cls.get_collection_name()
+        validate = with_payloads is True
+
+        def fetch_page(offset):
+            with metrics.track("vector.scroll", collection=collection_name) as timer:
+                page = get_database().scroll(
+                    collection_name=collection_name,
+                    limit=page_size,
+                    offset=offset,
+                    with_payload=with_payloads,
+                    with_vectors=with_vectors,
+                    scroll_filter=scroll_filter,
+                    **kwargs
+                )
+                timer.items = len(page[0])
+            return page
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            records, next_offset = fetch_page(None)
+            while True:
+                next_page = None
+                if next_offset is not None and prefetch:
+                    next_page = executor.submit(fetch_page, next_offset)
+
+                documents = [cls.from_record(record, validate=validate, trusted=trusted) for record in records]
+                if with_payloads is True:
+                    documents = cls.hydrate(documents, trusted=trusted)
+                yield from documents
+
+                if next_offset is None:
+                    break
+                records, next_offset = next_page.result() if next_page else fetch_page(next_offset)
     
     @classmethod
     def query(cls: Type[T], query_vector: list, limit: int=10, **kwargs) -> list[T]:
+        """Returns the ``limit`` documents closest to the query vector.
+
+        ``hnsw_ef``, ``rescore``, ``oversampling`` and ``exact`` override the search defaults of the
+        collection config, trading latency for recall. Other keyword arguments are passed to ``query_points``.
+        """
+        return [document for document, _ in cls.search(query_vector, limit=limit, **kwargs)]
+
+    @classmethod
+    def search(cls: Type[T], query_vector: list, limit: int=10, hydrate: bool = True, **kwargs) -> list[tuple[T, float]]:
+        """Like ``query``, but also returns the similarity score of every document, best first.
+
+        With ``hydrate=False`` the fields offloaded to the side store are not fetched, see ``hydrate``.
+        """
         collection_name = cls.get_collection_name()
-        results = _database.query_points(
-            collection_name=collection_name,
-            query=query_vector,
-            limit=limit,
-            with_payload=kwargs.pop('with_payloads', True),
-            with_vectors=kwargs.pop('with_vectors', False),
-            **kwargs
-        )
+        if cls.use_sparse_vectors():
+            kwargs.setdefault('using', DENSE_VECTOR_NAME)
+        kwargs.setdefault('search_params', cls._search_params(kwargs))
+        with metrics.track("vector.search", collection=collection_name) as timer:
+            results = get_database().query_points(
+                collection_name=collection_name,
+                query=query_vector,
+                limit=limit,
+                with_payload=kwargs.pop('with_payloads', True),
+                with_vectors=kwargs.pop('with_vectors', False),
+                **kwargs
+            )
+            timer.items = len(results.points)
 
-        documents = [cls.from_record(doc) for doc in results.points]
-        return documents
+        documents = [cls.from_record(point) for point in results.points]
+        if hydrate:
+            documents = cls.hydrate(documents)
+        return list(zip(documents, [point.score for point in results.points], strict=True))
     
     
     @classmethod
-    def get_or_create_collection(cls: Type[T], vector_size: int | None = None, use_vector_index: bool = True) -> CollectionInfo:
+    def hybrid_search(
+        cls: Type[T],
+        query_vector: list,
+        sparse_vector: "SparseEmbedding",
+        limit: int = 10,
+        prefetch_limit: int | None = None,
+        query_filter: "Filter | None" = None,
+        hydrate: bool = True,
+        **kwargs,
+    ) -> list[tuple[T, float]]:
+        """Searches the dense and the sparse vectors and fuses both rankings with reciprocal rank fusion.
+
+        The fusion runs inside Qdrant, so only the fused top ``limit`` documents are returned.
+
+        Args:
+            query_vector (list): The dense query embedding.
+            sparse_vector (SparseEmbedding): The sparse (BM25) query embedding.
+            limit (int): The number of documents to return.
+            prefetch_limit (int | None): The number of candidates taken from each ranking. Defaults to ``limit``.
+            query_filter (Filter | None): Only return the points matching this filter.
+            hydrate (bool): Whether to fetch the fields offloaded to the side store, see ``hydrate``.
+
+        Returns:
+            list[tuple[T, float]]: The documents and their fused scores, best first.
+        """
+        from qdrant_client.http.models import Fusion, FusionQuery, Prefetch, SparseVector
+
+        assert cls.use_sparse_vectors(), f"{cls.__name__} does not index sparse vectors."
+
+        prefetch_limit = prefetch_limit or limit
+        # ef和rescore只作用于稠密向量的近邻检索
+        prefetch = [
+            Prefetch(
+                query=query_vector,
+                using=DENSE_VECTOR_NAME,
+                limit=prefetch_limit,
+                filter=query_filter,
+                params=cls._search_params(kwargs),
+            )
+        ]
+        if sparse_vector.indices:
+            prefetch.append(
+                Prefetch(
+                    query=SparseVector(indices=sparse_vector.indices, values=sparse_vector.values),
+                    using=SPARSE_VECTOR_NAME,
+                    limit=prefetch_limit,
+                    filter=query_filter,
+                )
+            )
+
+        with metrics.track("vector.hybrid_search", collection=cls.get_collection_name()) as timer:
+            results = get_database().query_points(
+                collection_name=cls.get_collection_name(),
+                prefetch=prefetch,
+                query=FusionQuery(fusion=Fusion.RRF),
+                limit=limit,
+                with_payload=kwargs.pop('with_payloads', True),
+                with_vectors=kwargs.pop('with_vectors', False),
+                **kwargs
+            )
+            timer.items = len(results.points)
+
+        documents = [cls.from_record(point) for point in results.points]
+        if hydrate:
+            documents = cls.hydrate(documents)
+        return list(zip(documents, [point.score for point in results.points], strict=True))
+
+    @classmethod
+    def hydrate(cls: Type[T], documents: list[T], trusted: bool | None = None) -> list[T]:
+        """Fills in the fields the collection config offloads from the Qdrant payload, with one bulk read.
+
+        With slim payloads, documents read from Qdrant only hold the ids and the filter fields. Hydrate only
+        the documents that are actually used, e.g. the final top-k of a search. The documents are updated in
+        place, and validated like whole documents once their fields are filled in, see ``from_record``.
+        """
+        config = cls.get_collection_config()
+        if not config.offloaded_fields or not documents:
+            return documents
+
+        store = cls._payload_store()
+        payloads = store.get_many([document.id for document in documents])
+        shared = cls._get_collection_metadata(store) if config.shared_fields else {}
+        reader = get_reader(cls, "json")
+
+        num_missing = 0
+        for document in documents:
+            payload = payloads.get(document.id)
+            if payload is None:
+                # 缺少的字段无法补全，文档保持未校验的状态
+                num_missing += 1
+                continue
+            # side store中的版本号与payload同时写入，版本一致时可信读取
+            hydrated = reader.read({**document.__dict__, **shared, **payload}, trusted=trusted)
+            object.__setattr__(document, "__dict__", hydrated.__dict__)
+            object.__setattr__(document, "__pydantic_fields_set__", hydrated.__pydantic_fields_set__)
+
+        if num_missing:
+            logger.warning(f"{num_missing} of {len(documents)} points of {cls.get_collection_name()} have no stored payload.")
+
+        return documents
+
+    @classmethod
+    def _payload_store(cls: Type[T]) -> "PayloadStore":
+        from .payload_store import PayloadStore
+
+        return PayloadStore(cls.get_collection_name())
+
+    @classmethod
+    def _get_collection_metadata(cls: Type[T], store: "PayloadStore") -> dict:
+        collection_name = cls.get_collection_name()
+        if collection_name not in _collection_metadata:
+            _collection_metadata[collection_name] = store.get_collection_metadata()
+        return _collection_metadata[collection_name]
+
+    @classmethod
+    def _store_offloaded_fields(cls: Type[T], documents: Iterable[T]) -> None:
+        config = cls.get_collection_config()
+        if not config.offloaded_fields:
+            return
+
+        documents = list(documents)
+        if not documents:
+            return
+
+        store = cls._payload_store()
+        if config.side_store_fields:
+            store.put_many(
+                {
+                    document.id: {
+                        **document.model_dump(mode='json', include=config.side_store_fields),
+                        SCHEMA_VERSION_FIELD: schema_version(cls),
+                    }
+                    for document in documents
+                }
+            )
+        if config.shared_fields:
+            # 共享字段只在变化时（如更换embedding模型）才重新写入
+            shared = documents[0].model_dump(mode='json', include=config.shared_fields)
+            if cls._get_collection_metadata(store) != shared:
+                store.set_collection_metadata(shared)
+                _collection_metadata[cls.get_collection_name()] = shared
+
+    @classmethod
+    def _search_params(cls: Type[T], kwargs: dict):
+        """Pops the search overrides from ``kwargs`` and builds the search params with the collection defaults."""
+        return cls.get_collection_config().to_search_params(
+            hnsw_ef=kwargs.pop('hnsw_ef', None),
+            rescore=kwargs.pop('rescore', None),
+            oversampling=kwargs.pop('oversampling', None),
+            exact=kwargs.pop('exact', False),
+        )
+
+    @classmethod
+    def get_collection_config(cls: Type[T]) -> CollectionConfig:
+        """The quantization, HNSW, on-disk storage and payload index configuration of the collection."""
+        return CollectionConfig()
+
+    @classmethod
+    def use_sparse_vectors(cls: Type[T]) -> bool:
+        """Whether the collection has a BM25 sparse vector next to the dense one, as named vectors."""
+        return False
+
+    @classmethod
+    def get_or_create_collection(cls: Type[T], vector_size: int | None = None, use_vector_index: bool = True) -> "CollectionInfo":
         collection_name = cls.get_collection_name()
 
-        try:
-            return _database.get_collection(collection_name=collection_name)
-        except exceptions.UnexpectedResponse:
+        if not get_database().collection_exists(collection_name=collection_name):
             # use_vector_index = cls.get_use_vector_index()
 
             collection_created = cls._create_collection(
@@ -124,7 +667,11 @@ class VectorBaseDocument(BaseModel, Generic[T], ABC):
             if collection_created is False:
                 raise RuntimeError(f"Couldn't create collection {collection_name}") from None
 
-            return _database.get_collection(collection_name=collection_name)
+        return get_database().get_collection(collection_name=collection_name)
+
+    @classmethod
+    def collection_exists(cls: Type[T]) -> bool:
+        return get_database().collection_exists(collection_name=cls.get_collection_name())
 
     @classmethod
     def create_collection(cls: Type[T], vector_size: int, use_vector_index: bool = True) -> bool:
@@ -135,14 +682,100 @@ class VectorBaseDocument(BaseModel, Generic[T], ABC):
 
     @classmethod
     def _create_collection(cls, collection_name: str, vector_size: int, use_vector_index: bool = True) -> bool:
+        from qdrant_client.http.models import Distance, SparseVectorParams, VectorParams
+
+        config = cls.get_collection_config()
         if use_vector_index is True:
             assert vector_size is not None, "vector_size must be provided when use_vector_index is True."
-            vectors_config = VectorParams(size=vector_size, distance=Distance.COSINE)
+            vectors_config = VectorParams(size=vector_size, distance=Distance.COSINE, on_disk=config.on_disk_vectors)
         else:
             vectors_config = {}
 
-        return _database.create_collection(collection_name=collection_name, vectors_config=vectors_config)
-    
+        sparse_vectors_config = None
+        if use_vector_index is True and cls.use_sparse_vectors():
+            vectors_config = {DENSE_VECTOR_NAME: vectors_config}
+            sparse_vectors_config = {SPARSE_VECTOR_NAME: SparseVectorParams()}
+
+        created = get_database().create_collection(
+            collection_name=collection_name,
+            vectors_config=vectors_config,
+            sparse_vectors_config=sparse_vectors_config,
+            hnsw_config=config.to_hnsw_config() if use_vector_index else None,
+            quantization_config=config.to_quantization_config() if use_vector_index else None,
+            on_disk_payload=config.on_disk_payload,
+        )
+        if created:
+            cls._create_payload_indexes(collection_name, config, existing={})
+
+        return created
+
+    @classmethod
+    def _create_payload_indexes(cls, collection_name: str, config: CollectionConfig, existing: dict) -> list[str]:
+        created = []
+        for field_name, index_type in config.payload_indexes.items():
+            if field_name in existing:
+                continue
+            get_database().create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=config.to_payload_schema(index_type),
+                wait=True,
+            )
+            created.append(field_name)
+
+        return created
+
+    @classmethod
+    def apply_collection_config(cls: Type[T]) -> dict:
+        """Applies the collection config to an existing collection, e.g. after changing it in the settings.
+
+        Qdrant rebuilds the HNSW graph and the quantized vectors in the background, the collection stays
+        searchable meanwhile. Payload indexes missing from the collection are created; indexes not in the
+        config are left in place. Collections created without named vectors keep their vector layout.
+
+        Returns:
+            dict: The parameters that were sent and the payload indexes that were created.
+        """
+        from qdrant_client.http.models import CollectionParamsDiff, VectorParamsDiff
+
+        collection_name = cls.get_collection_name()
+        config = cls.get_collection_config()
+        info = get_database().get_collection(collection_name=collection_name)
+
+        changes = {}
+        vectors = info.config.params.vectors
+        if vectors:
+            hnsw_config = config.to_hnsw_config()
+            quantization_config = config.to_quantization_config(for_update=True)
+            vector_names = list(vectors) if isinstance(vectors, dict) else ['']
+            vectors_config = None
+            if config.on_disk_vectors is not None:
+                vectors_config = {name: VectorParamsDiff(on_disk=config.on_disk_vectors) for name in vector_names}
+
+            get_database().update_collection(
+                collection_name=collection_name,
+                vectors_config=vectors_config,
+                hnsw_config=hnsw_config,
+                quantization_config=quantization_config,
+                collection_params=(
+                    CollectionParamsDiff(on_disk_payload=config.on_disk_payload)
+                    if config.on_disk_payload is not None else None
+                ),
+            )
+            changes.update(
+                hnsw_config=hnsw_config,
+                quantization_config=quantization_config,
+                on_disk_vectors=config.on_disk_vectors,
+                on_disk_payload=config.on_disk_payload,
+            )
+
+        changes['created_payload_indexes'] = cls._create_payload_indexes(
+            collection_name, config, existing=info.payload_schema or {}
+        )
+        logger.info(f"Applied the collection config of {collection_name}.", **{k: str(v) for k, v in changes.items()})
+
+        return changes
+
     @classmethod
     def get_use_vector_index(cls: Type[T]) -> bool:
         return 
\ No newline at end of file
@@ -0,0 +1,20 @@
+from llmtwin.domain.base.nosql import BaseDocument
+from pydantic import UUID4
+
+class ChunkLink(BaseDocument):
+    # 被去重的chunk没有自己的向量，检索到canonical chunk时可以通过这里找到它出现过的其他文档
+    chunk_id: UUID4
+    canonical_id: UUID4
+    document_id: UUID4
+    author_id: UUID4
+    platform: str
+    link: str | None = None
+    distance: int
+
+    @classmethod
+    def get_collection_name(cls) -> str:
+        return "chunk_links"
+
+    @classmethod
+    def get_category(cls) -> str:
+        return "ChunkLink"
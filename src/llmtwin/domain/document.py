@@ -1,6 +1,8 @@
+from datetime import datetime, timezone
+
 from llmtwin.domain.base.nosql import BaseDocument
 from llmtwin.domain.data_category import DataCategory
-from pydantic import UUID4
+from pydantic import UUID4, Field
 
 class ArticleDocument(BaseDocument):
     content: dict
@@ -8,6 +10,12 @@ class ArticleDocument(BaseDocument):
     author_id: UUID4
     author_full_name: str
     link: str
+    # 每次写入时更新，增量处理只读取上次运行之后更新的文档；不经过这些模型写入的程序也需要在修改内容时更新它
+    updated_at: datetime | None = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def to_mongo(self, **kwargs) -> dict:
+        self.updated_at = datetime.now(timezone.utc)
+        return super().to_mongo(**kwargs)
 
     @classmethod
     def get_collection_name(cls) -> str:
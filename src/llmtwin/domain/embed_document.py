@@ -1,17 +1,52 @@
 from abc import ABC
+from functools import cache
 
+from llmtwin.domain.base.collection_config import CollectionConfig
 from llmtwin.domain.base.vector import VectorBaseDocument
 from llmtwin.domain.data_category import DataCategory
-from pydantic import UUID4, Field
+from llmtwin.networks.sparse import SparseEmbedding
+from llmtwin.settings import settings
+import numpy as np
+from pydantic import UUID4, ConfigDict, Field
 
 class EmbedDocument(VectorBaseDocument, ABC):
+    # embedding可以是embedding矩阵中的一行（float32视图），避免逐个float转换成Python对象
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     content: str
-    embedding: list[float] | None
+    embedding: np.ndarray | list[float] | None
+    # BM25稀疏向量，只在开启混合检索时写入qdrant，不属于payload
+    sparse_embedding: SparseEmbedding | None = None
     platform: str
     author_id: UUID4
+    # 旧版本写入的点没有document_id，增量处理不会删除这些点
+    document_id: UUID4 | None = None
     author_full_name: str
     metadata: dict = Field(default_factory=dict)
 
+    @classmethod
+    def use_sparse_vectors(cls) -> bool:
+        return settings.HYBRID_SEARCH_ENABLED
+
+    @classmethod
+    @cache
+    def get_collection_config(cls) -> CollectionConfig:
+        return CollectionConfig(
+            quantization=settings.QDRANT_QUANTIZATION,
+            hnsw_m=settings.QDRANT_HNSW_M,
+            hnsw_ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT,
+            on_disk_vectors=settings.QDRANT_ON_DISK_VECTORS,
+            on_disk_payload=settings.QDRANT_ON_DISK_PAYLOAD,
+            # 检索时常用这些字段过滤，没有索引时过滤需要扫描payload
+            payload_indexes={"author_id": "uuid", "document_id": "uuid", "platform": "keyword"},
+            search_hnsw_ef=settings.QDRANT_SEARCH_HNSW_EF,
+            search_rescore=settings.QDRANT_SEARCH_RESCORE,
+            search_oversampling=settings.QDRANT_SEARCH_OVERSAMPLING,
+            slim_payload=settings.QDRANT_SLIM_PAYLOADS,
+            side_store_fields={"content", "author_full_name", "link"},
+            shared_fields={"metadata"},
+        )
+
 class EmbedArticle(EmbedDocument):
     link: str
 
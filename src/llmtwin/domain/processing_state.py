@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from llmtwin.domain.base.nosql import BaseDocument
+from pydantic import UUID4, Field
+
+class ProcessingState(BaseDocument):
+    # id与原始文档的id相同
+    fingerprint: str
+    data_category: str
+    chunk_ids: list[UUID4] = Field(default_factory=list)
+    processed_at: datetime
+
+    @classmethod
+    def get_collection_name(cls) -> str:
+        return "processing_state"
+
+    @classmethod
+    def get_category(cls) -> str:
+        return "ProcessingState"
+
+class ProcessingWatermark(BaseDocument):
+    # 原始文档集合中updated_at不晚于watermark的文档都已处理；pipeline配置变化后watermark失效
+    source_collection: str
+    config_fingerprint: str
+    watermark: datetime
+
+    @classmethod
+    def get_collection_name(cls) -> str:
+        return "processing_watermarks"
+
+    @classmethod
+    def get_category(cls) -> str:
+        return "ProcessingWatermark"
@@ -2,9 +2,14 @@ import os
 
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
 
+from itertools import batched
 from llmtwin.networks.embeddings import EmbeddingModelSingleton
+from llmtwin.networks.sparse import save_bm25_encoders
 from typing import TypeVar
 from llmtwin.domain.embed_document import EmbedArticle
+from llmtwin.domain.chunk_link import ChunkLink
+from llmtwin.preprocess.dedup import ChunkDeduplicator
+from llmtwin.settings import settings
 from llmtwin.preprocess.dispatcher import ChunkDispatcher, EmbedDispatcher
 from llmtwin.domain.cleaned_document import CleanedDocument, CleanedArticle
 from tqdm import tqdm
@@ -13,22 +18,31 @@ from llmtwin.domain.embed_document import EmbedDocument
 CleanedDocumentT = TypeVar("CleanedDocumentT", bound=CleanedDocument)
 EmbedDocumentT = TypeVar("EmbedDocumentT", bound=EmbedDocument)
 
-def chunk_and_embed(document: CleanedDocumentT | list[CleanedDocumentT]) -> list[EmbedDocumentT]:
+def chunk_and_embed(
+    document: CleanedDocumentT | list[CleanedDocumentT], deduplicator: ChunkDeduplicator | None = None
+) -> list[EmbedDocumentT]:
     """Chunks and embeds the given document(s).
 
     Args:
         document (CleanedDocumentT | list[CleanedDocumentT]): The document or list of documents to chunk and embed.
         chunk_size (int): The size of each chunk.
         overlap (int): The overlap between chunks.
+        deduplicator (ChunkDeduplicator | None): Drops the duplicate chunks before embedding, keeping its index
+            across calls.
 
     """
     if not isinstance(document, list):
         document = [document]
     
+    chunks_batch = ChunkDispatcher.dispatch_batch(document)
+    if deduplicator is not None:
+        chunks_batch, links, _ = deduplicator.deduplicate(chunks_batch)
+        if links:
+            ChunkLink.bulk_upsert(links)
+
     chunked_documents = []
-    for doc in tqdm(document, desc="Chunking documents"):
-        ChunkDispatcher.dispatch(doc)
-        chunked_documents.extend(ChunkDispatcher.dispatch(doc))
+    for chunks in tqdm(chunks_batch, desc="Chunking documents"):
+        chunked_documents.extend(chunks)
     
     embedded_documents = EmbedDispatcher.dispatch(chunked_documents)
     
@@ -36,10 +50,19 @@ def chunk_and_embed(document: CleanedDocumentT | list[CleanedDocumentT]) -> list
 
 if __name__ == "__main__":
 
-    cleaned_doc, _ = CleanedArticle.bulk_find(limit=999, with_payloads=True)
-    result = chunk_and_embed(cleaned_doc)
-    print(f"Processed {len(result)} embedded documents.")
     EmbedArticle.get_or_create_collection(vector_size= EmbeddingModelSingleton().embedding_size, use_vector_index=True)
-    # save result to qdrant
-    inset_result = EmbedArticle.bulk_insert(result)
-    print(inset_result)
\ No newline at end of file
+
+    # 自动翻页读取整个cleaned_articles集合，按批处理
+    cleaned_docs = CleanedArticle.iter_find(page_size=256, with_payloads=True)
+    deduplicator = ChunkDeduplicator(mode=settings.CHUNK_DEDUP_MODE) if settings.CHUNK_DEDUP_MODE != "off" else None
+    num_embedded = 0
+    for cleaned_batch in batched(cleaned_docs, 256):
+        result = chunk_and_embed(list(cleaned_batch), deduplicator=deduplicator)
+        # save result to qdrant
+        upsert_results = EmbedArticle.bulk_upsert(result)
+        num_embedded += sum(upsert_result.num_points for upsert_result in upsert_results if upsert_result.ok)
+        print(upsert_results)
+    save_bm25_encoders()
+    if deduplicator is not None:
+        deduplicator.log_stats()
+    print(f"Processed {num_embedded} embedded documents.")
\ No newline at end of file
@@ -1,21 +1,50 @@
+import multiprocessing
+from itertools import batched
+from typing import Iterable, Iterator
+
 from llmtwin.domain.base.nosql import BaseDocument
 from llmtwin.domain.cleaned_document import CleanedArticle, CleanedDocument
 from llmtwin.domain.document import ArticleDocument
+from llmtwin.preprocess.clean_pool import clean_in_pool, create_clean_pool
 from llmtwin.preprocess.dispatcher import CleanDispatcher
 
+
+def iter_clean_documents(
+    raw_documents: Iterable[BaseDocument], workers: int = 1, chunk_size: int = 64
+) -> Iterator[CleanedDocument]:
+    if workers <= 1:
+        for document in raw_documents:
+            yield CleanDispatcher.dispatch(document)
+        return
+
+    with create_clean_pool(workers) as executor:
+        yield from clean_in_pool(executor, raw_documents, chunk_size=chunk_size, max_pending=2 * workers)
+
+
 def clean_documents(
-    raw_documents: list[BaseDocument],
+    raw_documents: Iterable[BaseDocument],
+    workers: int = 1,
+    chunk_size: int = 64,
 ) -> list[CleanedDocument]:
-    cleaned_documents = []
-    for document in raw_documents:
-        cleaned_document = CleanDispatcher.dispatch(document)
-        cleaned_documents.append(cleaned_document)
-    return cleaned_documents
+    """
+    Cleans the given documents.
+
+    Args:
+        raw_documents (Iterable[BaseDocument]): The documents to clean.
+        workers (int): The number of worker processes. 1 cleans serially in the current process.
+        chunk_size (int): The number of documents sent to a worker process at a time.
+
+    Returns:
+        list[CleanedDocument]: The cleaned documents, in input order.
+    """
+    return list(iter_clean_documents(raw_documents, workers=workers, chunk_size=chunk_size))
 
 
 if __name__ == "__main__":
-    raw_docs = ArticleDocument.bulk_find({}, by_alias=True)
-    cleaned_docs = clean_documents(raw_docs)
     CleanedArticle.get_or_create_collection(use_vector_index=False)
-    result = CleanedArticle.bulk_insert(cleaned_docs)
-    print(result)
\ No newline at end of file
+    # 逐批读取并清洗，避免把整个documents集合读进内存
+    raw_docs = ArticleDocument.iter_find({}, batch_size=1000, by_alias=True)
+    cleaned_docs = iter_clean_documents(raw_docs, workers=multiprocessing.cpu_count())
+    for cleaned_batch in batched(cleaned_docs, 1000):
+        result = CleanedArticle.bulk_insert(list(cleaned_batch))
+        print(result)
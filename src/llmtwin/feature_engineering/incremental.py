@@ -0,0 +1,337 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from itertools import batched
+from threading import Lock
+from typing import Type
+from uuid import UUID
+
+from loguru import logger
+
+from llmtwin.domain.base.nosql import BaseDocument, get_database
+from llmtwin.domain.base.vector import VectorBaseDocument
+from llmtwin.domain.chunk_document import ChunkArticle, ChunkDocument
+from llmtwin.domain.chunk_link import ChunkLink
+from llmtwin.domain.cleaned_document import CleanedDocument
+from llmtwin.domain.data_category import DataCategory
+from llmtwin.domain.embed_document import EmbedArticle, EmbedDocument
+from llmtwin.domain.processing_state import ProcessingState, ProcessingWatermark
+from llmtwin.networks.sparse import get_bm25_encoder
+from llmtwin.preprocess.dispatcher import ChunkHandlerFactory
+from llmtwin.settings import settings
+
+# 原始文档中记录写入或修改时间的字段
+WATERMARK_FIELD = "updated_at"
+
+
+class ChangeTracker:
+    """
+    Tracks which raw documents have already gone through the pipeline, so that a run only processes the new or
+    changed ones.
+
+    Every processed document gets a ProcessingState holding a fingerprint of its content and pipeline
+    configuration, the ids of the chunks it produced and when it was processed. A state is only saved once
+    all the chunks of its document have been written, so an interrupted run is picked up again by the next one.
+
+    With deduplication, a chunk shared by several documents is written once, under the id of the first one,
+    and the others record its id among their chunks. When the owner of the point no longer has the chunk, the
+    point is moved to another document having it instead of being deleted.
+
+    When the whole raw collection is read, ``changed_filter`` pushes a watermark into the MongoDB filter: only
+    the documents updated since the last complete run (and those without ``updated_at``) are read and
+    fingerprinted. The raw models set ``updated_at`` whenever they are written; programs writing the raw
+    collection directly must set it too when they change a document, otherwise the change is only picked up
+    once the watermark is reset, e.g. by a change of the pipeline configuration.
+    Documents deleted from the raw collection are only cleaned up by ``prune_deleted``.
+    """
+
+    def __init__(
+        self,
+        vector_classes: dict[DataCategory, list[Type[VectorBaseDocument]]] | None = None,
+        state_batch_size: int = 256,
+    ) -> None:
+        # 文档的chunk变化时，需要从这些集合中删除过期的点
+        self._vector_classes = vector_classes or {DataCategory.Article: [ChunkArticle, EmbedArticle]}
+        self._state_batch_size = state_batch_size
+        self._lock = Lock()
+        self._fingerprints: dict[UUID, str] = {}
+        self._previous_chunk_ids: dict[UUID, list[UUID]] = {}
+        self._pending: dict[UUID, list] = {}
+        self._completed: list[ProcessingState] = []
+        self._chunk_metadata: dict[str, dict] = {}
+        self._scan: tuple[Type[BaseDocument], str, datetime] | None = None
+        self._chunk_index_created = False
+
+    def fingerprint(self, document: BaseDocument) -> str:
+        # 除了内容本身，chunk参数和embedding模型变化时也需要重新处理；修改时间不影响处理结果
+        data = {
+            "document": document.model_dump(mode="json", exclude={"id", WATERMARK_FIELD}),
+            "chunk_metadata": self._get_chunk_metadata(document.get_category()),
+            "embedding_model_id": settings.TEXT_EMBEDDING_MODEL_ID,
+        }
+        return hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def config_fingerprint(self, data_category: str) -> str:
+        """A fingerprint of the pipeline configuration of a category, the part of ``fingerprint`` not read from the document."""
+        data = {
+            "chunk_metadata": self._get_chunk_metadata(data_category),
+            "embedding_model_id": settings.TEXT_EMBEDDING_MODEL_ID,
+        }
+        return hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def _get_chunk_metadata(self, data_category: str) -> dict:
+        # 每个文档都要计算指纹，chunk参数在一次运行中不变，只取一次
+        metadata = self._chunk_metadata.get(data_category)
+        if metadata is None:
+            metadata = self._chunk_metadata[data_category] = ChunkHandlerFactory.create_handler(data_category).metadata
+        return metadata
+
+    def changed_filter(self, document_class: Type[BaseDocument]) -> dict:
+        """
+        Returns the MongoDB filter of the raw documents that may have changed since the last complete run.
+
+        The selected documents still go through ``filter_changed``. ``flush`` moves the watermark to the start
+        of this run once all of them have been processed, so a failed or partial run reads them again.
+
+        Args:
+            document_class (Type[BaseDocument]): The raw document class whose whole collection is read.
+
+        Returns:
+            dict: The filter, empty on the first run or after the pipeline configuration changed.
+        """
+        config_fingerprint = self.config_fingerprint(document_class.get_category())
+        with self._lock:
+            self._scan = (document_class, config_fingerprint, datetime.now(timezone.utc))
+
+        watermark = self._find_watermark(document_class)
+        if watermark is None or watermark.config_fingerprint != config_fingerprint:
+            return {}
+        # 没有updated_at的文档（在这个字段之前写入的）无法判断，仍然比较指纹
+        return {"$or": [{WATERMARK_FIELD: {"$gt": watermark.watermark}}, {WATERMARK_FIELD: None}]}
+
+    def filter_changed(self, documents: list[BaseDocument]) -> list[BaseDocument]:
+        """
+        Returns the documents that are new or changed since they were last processed.
+
+        Args:
+            documents (list[BaseDocument]): A batch of raw documents.
+
+        Returns:
+            list[BaseDocument]: The documents that need to be processed.
+        """
+        fingerprints = {document.id: self.fingerprint(document) for document in documents}
+        states = {
+            state.id: state
+            for state in ProcessingState.iter_find({"_id": {"$in": list(fingerprints)}}, by_alias=True)
+        }
+
+        changed = []
+        with self._lock:
+            for document in documents:
+                state = states.get(document.id)
+                if state is not None and state.fingerprint == fingerprints[document.id]:
+                    continue
+
+                self._fingerprints[document.id] = fingerprints[document.id]
+                if state is not None:
+                    self._previous_chunk_ids[document.id] = state.chunk_ids
+                changed.append(document)
+
+        return changed
+
+    def register_chunks(
+        self, document: CleanedDocument, chunks: list[ChunkDocument], duplicate_ids: list[UUID] | None = None
+    ) -> None:
+        """
+        Records the chunks produced for a changed document and deletes the points of the chunks it no longer has.
+
+        Args:
+            document (CleanedDocument): The cleaned document, which shares its id with the raw document.
+            chunks (list[ChunkDocument]): The chunks produced for it and written under its id.
+            duplicate_ids (list[UUID] | None): The ids of the chunks of other documents its dropped duplicates
+                share. Their points are kept as long as the document has them.
+        """
+        chunk_ids = list(dict.fromkeys([*(chunk.id for chunk in chunks), *(duplicate_ids or [])]))
+        with self._lock:
+            fingerprint = self._fingerprints.pop(document.id)
+            previous_chunk_ids = self._previous_chunk_ids.pop(document.id, None)
+
+        if previous_chunk_ids is not None:
+            stale_ids = list(set(previous_chunk_ids) - set(chunk_ids))
+            if stale_ids:
+                self._delete_points(document.get_category(), document.id, stale_ids)
+            # 链接在本批次中已经重新写入，删除文档不再有的重复chunk的链接
+            ChunkLink.bulk_delete({"document_id": document.id, "canonical_id": {"$nin": duplicate_ids or []}})
+
+        state = ProcessingState(
+            _id=document.id,
+            fingerprint=fingerprint,
+            data_category=document.get_category(),
+            chunk_ids=chunk_ids,
+            processed_at=datetime.now(timezone.utc),
+        )
+        with self._lock:
+            if chunks:
+                self._pending[document.id] = [len(chunks), state]
+            else:
+                self._completed.append(state)
+
+    def mark_written(self, embedded_documents: list[EmbedDocument]) -> None:
+        """Marks the chunks as written and saves the states of the documents that are now fully processed."""
+        with self._lock:
+            for embedded_document in embedded_documents:
+                pending = self._pending.get(embedded_document.document_id)
+                if pending is None:
+                    continue
+                pending[0] -= 1
+                if pending[0] == 0:
+                    self._completed.append(pending[1])
+                    del self._pending[embedded_document.document_id]
+
+            if len(self._completed) < self._state_batch_size:
+                return
+            completed, self._completed = self._completed, []
+
+        ProcessingState.bulk_upsert(completed)
+
+    def flush(self) -> None:
+        """
+        Saves the states of all the fully processed documents not saved yet, and the watermark of the collection
+        read through ``changed_filter`` if every document read from it was fully processed.
+        """
+        with self._lock:
+            completed, self._completed = self._completed, []
+            scan, self._scan = self._scan, None
+            num_unfinished = len(self._pending) + len(self._fingerprints)
+
+        if completed:
+            ProcessingState.bulk_upsert(completed)
+
+        if scan is None:
+            return
+        if num_unfinished:
+            # 有的文档的chunk没有全部写入，下次运行需要重新读取它们
+            logger.warning(f"{num_unfinished} documents were not fully processed, the watermark is not moved.")
+            return
+
+        document_class, config_fingerprint, started_at = scan
+        watermark = self._find_watermark(document_class)
+        ProcessingWatermark.bulk_upsert(
+            [
+                ProcessingWatermark(
+                    **({"_id": watermark.id} if watermark is not None else {}),
+                    source_collection=document_class.get_collection_name(),
+                    config_fingerprint=config_fingerprint,
+                    watermark=started_at,
+                )
+            ]
+        )
+
+    def prune_deleted(self, document_class: Type[BaseDocument], batch_size: int = 1000) -> int:
+        """
+        Deletes the points and states of the documents removed from the raw collection since they were processed.
+
+        Only the ids of the states and of the raw documents are read, but every state of the category is,
+        so this costs a pass over the states rather than over the documents.
+
+        Returns:
+            int: The number of removed documents cleaned up.
+        """
+        data_category = document_class.get_category()
+        states = ProcessingState.iter_find(
+            {"data_category": data_category}, batch_size=batch_size, projection=["_id", "chunk_ids"]
+        )
+
+        num_deleted = 0
+        for batch in batched(states, batch_size):
+            existing = {
+                document.id
+                for document in document_class.bulk_find(
+                    {"_id": {"$in": [state.id for state in batch]}}, projection=["_id"]
+                )
+            }
+            deleted = [state for state in batch if state.id not in existing]
+            deleted_ids = {state.id for state in deleted}
+            for state in deleted:
+                # 同一批中被删除的文档不能接手彼此的点
+                self._delete_points(data_category, state.id, state.chunk_ids, excluded_ids=deleted_ids)
+            if deleted:
+                ProcessingState.bulk_delete({"_id": {"$in": list(deleted_ids)}})
+                ChunkLink.bulk_delete({"document_id": {"$in": list(deleted_ids)}})
+                num_deleted += len(deleted)
+
+        if num_deleted:
+            logger.info(f"Removed the points of {num_deleted} deleted {document_class.__name__} documents.")
+        return num_deleted
+
+    def _delete_points(
+        self, data_category: str, document_id: UUID, chunk_ids: list[UUID], excluded_ids: set[UUID] = frozenset()
+    ) -> None:
+        if not chunk_ids:
+            return
+
+        from qdrant_client.http.models import FieldCondition, Filter, HasIdCondition, MatchValue
+
+        # 去重后多个文档共享同一个点，点只写在其中一个文档名下；还有其他文档拥有的点转到它名下，不删除
+        owners = self._find_owners({document_id, *excluded_ids}, chunk_ids)
+        owned_ids: dict[UUID, list[UUID]] = {}
+        for chunk_id, owner_id in owners.items():
+            owned_ids.setdefault(owner_id, []).append(chunk_id)
+        orphan_ids = [chunk_id for chunk_id in chunk_ids if chunk_id not in owners]
+
+        # 相同内容的chunk会有相同的id，只处理仍属于这个文档的点
+        document_filter = Filter(must=[FieldCondition(key="document_id", match=MatchValue(value=str(document_id)))])
+        for vector_class in self._vector_classes.get(data_category, []):
+            if not vector_class.collection_exists():
+                continue
+            for owner_id, ids in owned_ids.items():
+                vector_class.bulk_set_payload(ids, {"document_id": str(owner_id)}, update_filter=document_filter)
+            if not orphan_ids:
+                continue
+            deleted = []
+            if vector_class.use_sparse_vectors():
+                # 删除的chunk从BM25统计量中减去
+                deleted = list(
+                    vector_class.iter_find(
+                        scroll_filter=Filter(must=[HasIdCondition(has_id=[str(_id) for _id in orphan_ids]), document_filter])
+                    )
+                )
+            vector_class.bulk_delete(orphan_ids, delete_filter=document_filter)
+            if deleted:
+                get_bm25_encoder(vector_class.get_collection_name()).remove(
+                    [document.content for document in deleted], [document.id for document in deleted]
+                )
+
+    def _find_owners(self, excluded_ids: set[UUID], chunk_ids: list[UUID]) -> dict[UUID, UUID]:
+        """Returns a document not in ``excluded_ids`` still having each of the chunks, preferring the states of this run."""
+        wanted = set(chunk_ids)
+        with self._lock:
+            states = [pending[1] for pending in self._pending.values()] + list(self._completed)
+        # 本次运行登记的状态比已保存的新
+        in_memory_ids = {state.id for state in states}
+
+        owners = {}
+        for state in states:
+            if state.id not in excluded_ids:
+                owners.update((chunk_id, state.id) for chunk_id in wanted.intersection(state.chunk_ids))
+
+        remaining = list(wanted - set(owners))
+        if remaining:
+            self._ensure_chunk_index()
+            for state in ProcessingState.iter_find({"chunk_ids": {"$in": remaining}}, projection=["_id", "chunk_ids"]):
+                if state.id in excluded_ids or state.id in in_memory_ids:
+                    continue
+                owners.update((chunk_id, state.id) for chunk_id in wanted.intersection(state.chunk_ids) - set(owners))
+
+        return owners
+
+    def _ensure_chunk_index(self) -> None:
+        if self._chunk_index_created:
+            return
+        get_database()[ProcessingState.get_collection_name()].create_index("chunk_ids")
+        self._chunk_index_created = True
+
+    @staticmethod
+    def _find_watermark(document_class: Type[BaseDocument]) -> ProcessingWatermark | None:
+        watermarks = ProcessingWatermark.bulk_find({"source_collection": document_class.get_collection_name()})
+        return watermarks[0] if watermarks else None
@@ -0,0 +1,330 @@
+from itertools import batched
+import time
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import Callable, Iterable, Iterator, Literal
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from llmtwin.domain.base.nosql import BaseDocument
+from llmtwin.domain.base.vector import VectorBaseDocument
+from llmtwin.domain.chunk_link import ChunkLink
+from llmtwin.domain.document import ArticleDocument
+from llmtwin.feature_engineering.incremental import ChangeTracker
+from llmtwin.metrics import metrics
+from llmtwin.networks.sparse import save_bm25_encoders
+from llmtwin.preprocess.clean_pool import clean_in_pool, create_clean_pool
+from llmtwin.preprocess.dedup import ChunkDeduplicator
+from llmtwin.preprocess.dispatcher import ChunkDispatcher, CleanDispatcher, EmbedDispatcher
+from llmtwin.settings import settings
+
+_DONE = object()
+_POLL_INTERVAL = 0.1
+
+
+class StageConfig(BaseModel):
+    batch_size: int = Field(default=64, gt=0)
+    workers: int = Field(default=1, gt=0)
+    # 输入队列最多缓存的批次数，队列满时上游阻塞（backpressure）
+    queue_size: int = Field(default=4, gt=0)
+
+
+class PipelineConfig(BaseModel):
+    read: StageConfig = StageConfig(batch_size=256)
+    clean: StageConfig = StageConfig()
+    chunk: StageConfig = StageConfig()
+    embed: StageConfig = StageConfig(batch_size=128)
+    write: StageConfig = StageConfig(batch_size=256, workers=2)
+    # 大于1时在多个进程中清洗，clean stage的线程只负责分发
+    clean_processes: int = Field(default=1, gt=0)
+    clean_chunk_size: int = Field(default=16, gt=0)
+    store_cleaned: bool = True
+    # 只处理新增或内容变化的原始文档
+    incremental: bool = False
+    # 增量运行结束后删除已从原始集合删除的文档的点，需要遍历所有的处理状态
+    prune_deleted: bool = False
+    # embedding之前去掉重复的chunk
+    dedup: Literal["off", "skip", "link"] = settings.CHUNK_DEDUP_MODE
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class _Stage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Iterator], Iterator],
+        workers: int,
+        inbox: Queue | None,
+        outboxes: list[Queue],
+        stop: Event,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outboxes = outboxes
+        self.stop = stop
+        self.processed = 0
+        self.error: BaseException | None = None
+        self._lock = Lock()
+        self._running = workers
+        self.threads = [Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+
+    def _put(self, queue: Queue, item) -> None:
+        start = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise PipelineCancelled
+            try:
+                queue.put(item, timeout=_POLL_INTERVAL)
+                break
+            except Full:
+                continue
+        # 等待下游腾出队列空间的时间：下游是瓶颈
+        self._record_wait("output", time.perf_counter() - start)
+
+    def _drain(self) -> Iterator:
+        while True:
+            start = time.perf_counter()
+            while True:
+                if self.stop.is_set():
+                    raise PipelineCancelled
+                try:
+                    item = self.inbox.get(timeout=_POLL_INTERVAL)
+                    break
+                except Empty:
+                    continue
+            # 等待上游输入的时间：上游是瓶颈
+            self._record_wait("input", time.perf_counter() - start)
+            if item is _DONE:
+                # 放回结束标记，让同一stage的其他worker也能退出
+                self._put(self.inbox, _DONE)
+                return
+            yield item
+
+    def _record_wait(self, direction: str, seconds: float) -> None:
+        metrics.increment("pipeline_wait_seconds_total", seconds, stage=f"pipeline.{self.name}", direction=direction)
+
+    def _work(self) -> None:
+        try:
+            batches = self._drain() if self.inbox is not None else iter(())
+            for output in self.func(batches):
+                with self._lock:
+                    self.processed += len(output)
+                metrics.increment("pipeline_items_total", len(output), stage=f"pipeline.{self.name}")
+                for outbox in self.outboxes:
+                    self._put(outbox, output)
+        except PipelineCancelled:
+            return
+        except BaseException as e:
+            self.error = e
+            logger.exception(f"Pipeline stage {self.name} failed.")
+            self.stop.set()
+            return
+
+        with self._lock:
+            self._running -= 1
+            is_last = self._running == 0
+        if is_last:
+            try:
+                for outbox in self.outboxes:
+                    self._put(outbox, _DONE)
+            except PipelineCancelled:
+                pass
+
+
+class StreamingPipeline:
+    """
+    Streams raw documents through clean -> chunk -> embed -> upsert.
+
+    Every stage runs in its own worker threads and hands batches to the next one through a bounded queue,
+    so Mongo reads, cleaning, chunking, model inference and Qdrant writes overlap while the number of
+    documents in flight stays bounded by the batch and queue sizes, not by the size of the corpus.
+    """
+
+    def __init__(self, config: PipelineConfig | None = None, tracker: ChangeTracker | None = None) -> None:
+        self.config = config or PipelineConfig()
+        if tracker is None and self.config.incremental:
+            tracker = ChangeTracker()
+        self.tracker = tracker
+        self._clean_pool = None
+        self._deduplicator: ChunkDeduplicator | None = None
+
+    def run(self, raw_documents: Iterable[BaseDocument] | None = None) -> dict[str, int]:
+        """
+        Runs the pipeline until every raw document has been written.
+
+        Args:
+            raw_documents (Iterable[BaseDocument] | None): The documents to process. Defaults to streaming
+                the whole ArticleDocument collection, or only the documents updated since the last complete run
+                in incremental mode.
+
+        Returns:
+            dict[str, int]: The number of items produced by every stage.
+        """
+        config = self.config
+        read_collection = raw_documents is None
+        if read_collection:
+            filter_options = self.tracker.changed_filter(ArticleDocument) if self.tracker is not None else {}
+            raw_documents = ArticleDocument.iter_find(filter_options, batch_size=config.read.batch_size, by_alias=True)
+
+        stop = Event()
+        clean_queue = Queue(maxsize=config.clean.queue_size)
+        chunk_queue = Queue(maxsize=config.chunk.queue_size)
+        embed_queue = Queue(maxsize=config.embed.queue_size)
+        write_queue = Queue(maxsize=config.write.queue_size)
+        cleaned_write_queue = Queue(maxsize=config.write.queue_size)
+        clean_outboxes = [chunk_queue, cleaned_write_queue] if config.store_cleaned else [chunk_queue]
+
+        stages = [
+            _Stage("read", lambda _: self._read_stage(raw_documents), 1, None, [clean_queue], stop),
+            _Stage("clean", self._clean_stage, config.clean.workers, clean_queue, clean_outboxes, stop),
+            _Stage("chunk", self._chunk_stage, config.chunk.workers, chunk_queue, [embed_queue], stop),
+            _Stage("embed", self._embed_stage, config.embed.workers, embed_queue, [write_queue], stop),
+            _Stage("write", self._write_embedded_stage, config.write.workers, write_queue, [], stop),
+        ]
+        if config.store_cleaned:
+            stages.append(
+                _Stage("write_cleaned", self._write_stage, config.write.workers, cleaned_write_queue, [], stop)
+            )
+
+        self._clean_pool = create_clean_pool(config.clean_processes) if config.clean_processes > 1 else None
+        # 每次运行重新建索引：上一次运行写入的chunk不能被当成重复而跳过，否则增量运行时会被当成过期的点删除
+        self._deduplicator = ChunkDeduplicator(mode=config.dedup) if config.dedup != "off" else None
+        try:
+            for stage in stages:
+                for thread in stage.threads:
+                    thread.start()
+            for stage in stages:
+                for thread in stage.threads:
+                    thread.join()
+        finally:
+            if self._clean_pool is not None:
+                self._clean_pool.shutdown(cancel_futures=True)
+                self._clean_pool = None
+
+        for stage in stages:
+            if stage.error is not None:
+                raise RuntimeError(f"Pipeline stage {stage.name} failed.") from stage.error
+
+        if self.tracker is not None:
+            self.tracker.flush()
+            if read_collection and config.prune_deleted:
+                self.tracker.prune_deleted(ArticleDocument)
+        save_bm25_encoders()
+
+        stats = {stage.name: stage.processed for stage in stages}
+        if self._deduplicator is not None:
+            self._deduplicator.log_stats()
+            stats["duplicates"] = self._deduplicator.num_exact_duplicates + self._deduplicator.num_near_duplicates
+        logger.info("Pipeline finished.", **stats)
+        if settings.METRICS_EXPORT_PATH is not None:
+            metrics.write(settings.METRICS_EXPORT_PATH)
+            logger.info("Wrote the pipeline metrics.", path=str(settings.METRICS_EXPORT_PATH))
+
+        return stats
+
+    def _read_stage(self, raw_documents: Iterable[BaseDocument]) -> Iterator[list[BaseDocument]]:
+        for batch in batched(raw_documents, self.config.read.batch_size):
+            batch = list(batch)
+            if self.tracker is not None:
+                batch = self.tracker.filter_changed(batch)
+            if batch:
+                yield batch
+
+    def _clean_stage(self, batches: Iterator[list[BaseDocument]]) -> Iterator[list]:
+        if self._clean_pool is None:
+            for batch in self._rebatch(batches, self.config.clean.batch_size):
+                yield [CleanDispatcher.dispatch(document) for document in batch]
+            return
+
+        # 整个输入流式交给进程池，不在每个批次结束时等待最慢的worker
+        cleaned_documents = clean_in_pool(
+            self._clean_pool,
+            (document for batch in batches for document in batch),
+            chunk_size=self.config.clean_chunk_size,
+            max_pending=2 * self.config.clean_processes,
+        )
+        cleaned_batches = batched(cleaned_documents, self.config.clean.batch_size)
+        while True:
+            # 子进程中记录的指标不会回到父进程，在这里按输出批次记录，包括等待worker的时间
+            with metrics.track("clean", items=0, processes=self.config.clean_processes) as timer:
+                batch = list(next(cleaned_batches, ()))
+                timer.items = len(batch)
+                timer.nbytes = sum(len(document.content) for document in batch)
+            if not batch:
+                return
+            yield batch
+
+    def _chunk_stage(self, batches: Iterator[list]) -> Iterator[list]:
+        chunks = (
+            chunk
+            for batch in self._rebatch(batches, self.config.chunk.batch_size)
+            for document_chunks in self._chunk(batch)
+            for chunk in document_chunks
+        )
+        # 按embedding的batch size重新分批，保证模型每次推理都是满批
+        for batch in batched(chunks, self.config.embed.batch_size):
+            yield list(batch)
+
+    def _chunk(self, documents: list) -> list[list]:
+        chunks_batch = ChunkDispatcher.dispatch_batch(documents)
+        duplicate_ids_batch = [[] for _ in documents]
+        if self._deduplicator is not None:
+            chunks_batch, links, duplicate_ids_batch = self._deduplicator.deduplicate(chunks_batch)
+            if links:
+                ChunkLink.bulk_upsert(links)
+        # 只有保留下来的chunk需要等待写入，被去重的chunk共享的点也记在文档名下
+        if self.tracker is not None:
+            for document, chunks, duplicate_ids in zip(documents, chunks_batch, duplicate_ids_batch, strict=True):
+                self.tracker.register_chunks(document, chunks, duplicate_ids=duplicate_ids)
+        return chunks_batch
+
+    def _embed_stage(self, batches: Iterator[list]) -> Iterator[list]:
+        for batch in batches:
+            yield EmbedDispatcher.dispatch(batch)
+
+    def _write_stage(self, batches: Iterator[list[VectorBaseDocument]]) -> Iterator[list]:
+        for batch in self._rebatch(batches, self.config.write.batch_size):
+            # 一个批次中可能有不同类别的文档，每个类别写入各自的集合
+            documents_by_class: dict[type[VectorBaseDocument], list[VectorBaseDocument]] = {}
+            for document in batch:
+                documents_by_class.setdefault(type(document), []).append(document)
+
+            for document_class, documents in documents_by_class.items():
+                results = document_class.bulk_upsert(documents)
+                failed = [result for result in results if not result.ok]
+                if failed:
+                    # 写入失败的文档不能被标记为已处理，停止pipeline，下次增量运行时会重新处理
+                    raise RuntimeError(
+                        f"Failed to write {sum(result.num_points for result in failed)} of {len(documents)} points "
+                        f"to {document_class.get_collection_name()}: {failed[0].error}"
+                    )
+            yield batch
+
+    def _write_embedded_stage(self, batches: Iterator[list[VectorBaseDocument]]) -> Iterator[list]:
+        for batch in self._write_stage(batches):
+            if self.tracker is not None:
+                self.tracker.mark_written(batch)
+            yield batch
+
+    @staticmethod
+    def _rebatch(batches: Iterator[list], batch_size: int) -> Iterator[list]:
+        items = (item for batch in batches for item in batch)
+        for batch in batched(items, batch_size):
+            yield list(batch)
+
+
+if __name__ == "__main__":
+    from llmtwin.domain.cleaned_document import CleanedArticle
+    from llmtwin.domain.embed_document import EmbedArticle
+    from llmtwin.networks.embeddings import EmbeddingModelSingleton
+
+    CleanedArticle.get_or_create_collection(use_vector_index=False)
+    EmbedArticle.get_or_create_collection(vector_size=EmbeddingModelSingleton().embedding_size, use_vector_index=True)
+
+    stats = StreamingPipeline(PipelineConfig(incremental=True)).run()
+    print(stats)
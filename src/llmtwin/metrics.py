@@ -0,0 +1,272 @@
+import bisect
+import json
+import random
+import time
+from contextlib import contextmanager
+from enum import Enum
+from pathlib import Path
+from threading import Lock
+from typing import Iterator
+
+from loguru import logger
+
+from .settings import settings
+
+# 延迟（秒）和批大小的直方图分桶
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+_PREFIX = "llmtwin"
+
+
+class Histogram:
+    """A cumulative histogram with fixed buckets, like a Prometheus histogram."""
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        """Estimates a quantile by linear interpolation within its bucket."""
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+
+        return self.buckets[-1]
+
+
+class StageTimer:
+    """Set ``items`` and ``nbytes`` inside a ``track`` block when they are only known once the work is done."""
+
+    def __init__(self, items: int, nbytes: int) -> None:
+        self.items = items
+        self.nbytes = nbytes
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of the work done by every stage, keyed by stage name and labels.
+
+    For every stage it records the calls, errors, items and bytes processed, the latency and batch size
+    histograms, and the time the pipeline threads of the stage spent waiting on their queues. The metrics can
+    be exported in the Prometheus text format or summarized as JSON, with items per second and latency
+    percentiles.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        if not settings.METRICS_ENABLED:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels) -> None:
+        if not settings.METRICS_ENABLED:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def track(self, stage: str, items: int = 1, nbytes: int = 0, **labels) -> Iterator[StageTimer]:
+        """
+        Times a unit of work of a stage and records it on exit, also as a span when tracing is enabled.
+
+        Args:
+            stage (str): The stage name, e.g. "embed" or "mongo.bulk_find".
+            items (int): The number of items processed, also recorded as the batch size.
+            nbytes (int): The number of bytes moved.
+            **labels: Extra labels, e.g. the data category or collection.
+
+        Yields:
+            StageTimer: Its ``items`` and ``nbytes`` can be updated before the block exits.
+        """
+        if not settings.METRICS_ENABLED:
+            yield StageTimer(items, nbytes)
+            return
+
+        timer = StageTimer(items, nbytes)
+        labels = {"stage": stage, **labels}
+        start = time.perf_counter()
+        with _span(stage, labels):
+            try:
+                yield timer
+            except BaseException:
+                self.increment("stage_errors_total", **labels)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                self.increment("stage_calls_total", **labels)
+                self.increment("stage_items_total", timer.items, **labels)
+                self.increment("stage_seconds_total", elapsed, **labels)
+                if timer.nbytes:
+                    self.increment("stage_bytes_total", timer.nbytes, **labels)
+                self.observe("stage_duration_seconds", elapsed, **labels)
+                self.observe("stage_batch_size", timer.items, BATCH_SIZE_BUCKETS, **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                lines.append(f"# TYPE {_PREFIX}_{name} counter")
+                declared.add(name)
+            lines.append(f"{_PREFIX}_{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), histogram in histograms:
+            if name not in declared:
+                lines.append(f"# TYPE {_PREFIX}_{name} histogram")
+                declared.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{_PREFIX}_{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{_PREFIX}_{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{_PREFIX}_{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"{_PREFIX}_{name}_count{_format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Summarizes every stage: calls, errors, items, bytes, busy seconds, items per busy second, the mean batch
+        size, latency percentiles and the seconds its pipeline threads waited for input or for room downstream.
+        A stage that is rarely waiting for input while the others are is the bottleneck.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: histogram for key, histogram in self._histograms.items()}
+
+        stages: dict[str, dict] = {}
+        for (name, labels), value in counters.items():
+            key = _stage_key(labels)
+            metric = name.removeprefix("stage_").removeprefix("pipeline_").removesuffix("_total")
+            if name == "pipeline_wait_seconds_total":
+                metric = f"wait_{dict(labels)['direction']}_seconds"
+            stages.setdefault(key, {})[metric] = value
+
+        for (name, labels), histogram in histograms.items():
+            stage = stages.setdefault(_stage_key(labels), {})
+            if name == "stage_duration_seconds":
+                stage["latency_p50"] = histogram.quantile(0.5)
+                stage["latency_p95"] = histogram.quantile(0.95)
+                stage["latency_p99"] = histogram.quantile(0.99)
+            elif name == "stage_batch_size":
+                stage["mean_batch_size"] = histogram.sum / histogram.count if histogram.count else None
+
+        for stage in stages.values():
+            if stage.get("seconds"):
+                stage["items_per_second"] = stage.get("items", 0) / stage["seconds"]
+
+        return dict(sorted(stages.items()))
+
+    def write(self, path: Path) -> None:
+        """Writes the metrics to a file, in the Prometheus format if it ends with ".prom", else as JSON."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".prom":
+            path.write_text(self.to_prometheus())
+        else:
+            path.write_text(json.dumps(self.summary(), indent=2))
+
+
+metrics = MetricsRegistry()
+
+
+def log_sampled(message: str, rate: float | None = None, **fields) -> None:
+    """Logs a per-item info message for a random ``rate`` fraction of the calls, defaulting to LOG_SAMPLE_RATE."""
+    rate = settings.LOG_SAMPLE_RATE if rate is None else rate
+    if rate >= 1 or (rate > 0 and random.random() < rate):
+        logger.info(message, **fields)
+
+
+_tracer = None
+_tracer_lock = Lock()
+
+
+@contextmanager
+def _span(name: str, attributes: dict) -> Iterator[None]:
+    tracer = _get_tracer() if settings.METRICS_TRACING else None
+    if tracer is None:
+        yield
+        return
+
+    with tracer.start_as_current_span(name, attributes=attributes):
+        yield
+
+
+def _get_tracer():
+    global _tracer
+
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                try:
+                    from opentelemetry import trace
+                except ImportError:
+                    logger.warning("METRICS_TRACING is set but opentelemetry-api is not installed, spans are disabled.")
+                    _tracer = False
+                else:
+                    _tracer = trace.get_tracer("llmtwin")
+
+    return _tracer or None
+
+
+def _key(name: str, labels: dict) -> tuple[str, tuple]:
+    return name, tuple(sorted((key, value.value if isinstance(value, Enum) else str(value)) for key, value in labels.items()))
+
+
+def _stage_key(labels: tuple) -> str:
+    labels = dict(labels)
+    stage = labels.pop("stage", "")
+    labels.pop("direction", None)
+    if not labels:
+        return stage
+    return f"{stage}{{{','.join(f'{key}={value}' for key, value in sorted(labels.items()))}}}"
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
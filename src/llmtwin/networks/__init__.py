@@ -1,3 +1,3 @@
-from .embeddings import CrossEncoderModelSingleton, EmbeddingModelSingleton
+from .embeddings import CrossEncoderModelSingleton, EmbeddingError, EmbeddingModelSingleton
 
-__all__ = ["EmbeddingModelSingleton", "CrossEncoderModelSingleton"]
+__all__ = ["EmbeddingModelSingleton", "CrossEncoderModelSingleton", "EmbeddingError"]
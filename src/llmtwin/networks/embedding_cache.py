@@ -0,0 +1,199 @@
+import re
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Iterator
+
+import numpy as np
+from numpy.typing import NDArray
+
+_SQLITE_MAX_VARIABLES = 900
+
+
+class EmbeddingCache:
+    """
+    A persistent, content-addressed cache of embeddings for one embedding model.
+
+    Vectors are stored as rows of a memory-mapped float32 matrix and an SQLite index maps every content hash
+    to its row. When the cache is full the least recently used rows are evicted and reused. Every read and
+    write runs in one SQLite write transaction, so processes sharing the directory never hand out the same row.
+    """
+
+    def __init__(
+        self, cache_dir: Path, model_id: str, embedding_size: int, max_size_mb: int = 1024, variant: str = ""
+    ) -> None:
+        self._embedding_size = embedding_size
+        self._max_entries = max(1, max_size_mb * 1024 * 1024 // (embedding_size * 4))
+        self._lock = Lock()
+
+        # 每个模型及其运行方式（如onnx int8量化）单独一个目录，相当于以(model_id, variant, content hash)为key
+        name = f"{model_id}@{variant}" if variant else model_id
+        self._dir = Path(cache_dir) / re.sub(r"[^\w.@-]", "_", name)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self._dir / "vectors.f32"
+
+        # 事务由_transaction显式开始和提交
+        self._index = sqlite3.connect(
+            self._dir / "index.sqlite", timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._index.execute("PRAGMA journal_mode=WAL")
+        with self._transaction():
+            self._index.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used INTEGER NOT NULL)"
+            )
+            self._index.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self._index.execute("CREATE INDEX IF NOT EXISTS entries_slot ON entries (slot)")
+            self._vectors = self._open_vectors(max(self._next_slot(), min(1024, self._max_entries)))
+
+    @property
+    def max_entries(self) -> int:
+        return self._max_entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._index.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get_many(self, keys: list[str]) -> tuple[NDArray[np.float32], NDArray[np.bool_]]:
+        """
+        Looks up the embeddings of the given content hashes.
+
+        Args:
+            keys (list[str]): The content hashes to look up.
+
+        Returns:
+            tuple[NDArray[np.float32], NDArray[np.bool_]]: A (len(keys), embedding_size) matrix holding the cached
+                embeddings, and a mask telling which keys were found. Rows of missing keys are left as zeros.
+        """
+
+        embeddings = np.zeros((len(keys), self._embedding_size), dtype=np.float32)
+        found = np.zeros(len(keys), dtype=bool)
+
+        # 读取向量时持有写锁，其他进程不会同时淘汰并覆盖这些行
+        with self._lock, self._transaction():
+            slots = self._lookup(keys)
+            if not slots:
+                return embeddings, found
+
+            # 其他进程可能已经扩大了矩阵
+            self._ensure_capacity(max(slots.values()) + 1)
+            positions = [i for i, key in enumerate(keys) if key in slots]
+            embeddings[positions] = self._vectors[[slots[keys[i]] for i in positions]]
+            found[positions] = True
+
+            clock = self._next_clock()
+            self._index.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(clock, key) for key in slots])
+
+        return embeddings, found
+
+    def put_many(self, keys: list[str], embeddings: NDArray[np.float32]) -> None:
+        """
+        Stores the embeddings of the given content hashes, evicting the least recently used ones if needed.
+
+        Args:
+            keys (list[str]): The content hashes.
+            embeddings (NDArray[np.float32]): A (len(keys), embedding_size) matrix of embeddings.
+        """
+
+        if not keys:
+            return
+
+        new_entries = dict(zip(keys, np.asarray(embeddings, dtype=np.float32), strict=True))
+        # 超出容量的部分只保留最后写入的那些
+        new_entries = dict(list(new_entries.items())[-self._max_entries :])
+
+        with self._lock, self._transaction():
+            existing = self._lookup(list(new_entries))
+            missing = [key for key in new_entries if key not in existing]
+
+            # 先刷新已存在key的使用时间，避免它们在分配空位时被淘汰
+            clock = self._next_clock()
+            self._index.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?", [(clock, key) for key in existing]
+            )
+            free_slots = self._allocate(len(missing))
+
+            slots = {**existing, **dict(zip(missing, free_slots, strict=True))}
+            order = list(slots)
+            self._ensure_capacity(max(slots.values()) + 1)
+            self._vectors[[slots[key] for key in order]] = np.stack([new_entries[key] for key in order])
+            self._vectors.flush()
+
+            self._index.executemany(
+                "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                [(key, slots[key], clock) for key in order],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._vectors.flush()
+            self._index.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # BEGIN IMMEDIATE立即取得写锁，共享目录的进程依次分配和读取行
+        self._index.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._index.execute("ROLLBACK")
+            raise
+        self._index.execute("COMMIT")
+
+    def _lookup(self, keys: list[str]) -> dict[str, int]:
+        slots = {}
+        for start in range(0, len(keys), _SQLITE_MAX_VARIABLES):
+            chunk = keys[start : start + _SQLITE_MAX_VARIABLES]
+            rows = self._index.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            slots.update(rows)
+        return slots
+
+    def _next_slot(self) -> int:
+        # 行只在淘汰时被同一事务重新使用，已用的行总是从0开始连续的
+        return self._index.execute("SELECT COALESCE(MAX(slot), -1) + 1 FROM entries").fetchone()[0]
+
+    def _next_clock(self) -> int:
+        return self._index.execute("SELECT COALESCE(MAX(last_used), 0) + 1 FROM entries").fetchone()[0]
+
+    def _allocate(self, count: int) -> list[int]:
+        """Returns ``count`` free rows, growing the matrix or evicting the least recently used entries."""
+
+        next_slot = self._next_slot()
+        num_new = max(0, min(count, self._max_entries - next_slot))
+        slots = list(range(next_slot, next_slot + num_new))
+        if next_slot + num_new > self._vectors.shape[0]:
+            self._vectors = self._open_vectors(
+                max(next_slot + num_new, min(2 * self._vectors.shape[0], self._max_entries))
+            )
+
+        num_evicted = count - num_new
+        if num_evicted > 0:
+            evicted = self._index.execute(
+                "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (num_evicted,)
+            ).fetchall()
+            self._index.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+            slots.extend(slot for _, slot in evicted)
+
+        return slots
+
+    def _ensure_capacity(self, capacity: int) -> None:
+        if capacity > self._vectors.shape[0]:
+            self._vectors = self._open_vectors(capacity)
+
+    def _open_vectors(self, capacity: int) -> np.memmap:
+        """Maps the matrix with at least ``capacity`` rows, growing the file if needed. Only call it in a transaction."""
+
+        if hasattr(self, "_vectors"):
+            self._vectors.flush()
+            del self._vectors
+
+        row_size = self._embedding_size * 4
+        with open(self._vectors_path, "ab") as f:
+            # 只会变大：其他进程可能已经扩大了文件
+            capacity = max(capacity, f.tell() // row_size)
+            if f.tell() < capacity * row_size:
+                f.truncate(capacity * row_size)
+
+        return np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self._embedding_size))
@@ -0,0 +1,227 @@
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import Future
+from queue import Empty
+from threading import Event, Lock, Thread
+
+import numpy as np
+from loguru import logger
+from numpy.typing import NDArray
+
+
+def _load_worker_model(model_id: str, num_threads: int, backend: str, onnx_options: dict):
+    if backend == "onnx":
+        from .onnx_backend import load_onnx_embedding_model
+
+        # 父进程已经完成导出和一致性检查，这里只是加载
+        return load_onnx_embedding_model(model_id, num_threads=num_threads, **onnx_options)
+
+    import torch
+    from sentence_transformers.SentenceTransformer import SentenceTransformer
+
+    torch.set_num_threads(num_threads)
+    model = SentenceTransformer(model_id, device="cpu")
+    model.eval()
+
+    return model
+
+
+def _embedding_worker(
+    model_id: str, num_threads: int, tasks, results, backend: str = "torch", onnx_options: dict | None = None
+) -> None:
+    # 必须在导入torch之前设置，否则不生效
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    os.environ["MKL_NUM_THREADS"] = str(num_threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    model = _load_worker_model(model_id, num_threads, backend, onnx_options or {})
+
+    def encode(input_text: list[str]) -> NDArray[np.float32]:
+        return model.encode(
+            input_text, batch_size=len(input_text), convert_to_numpy=True, show_progress_bar=False
+        ).astype(np.float32, copy=False)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        task_id, input_text = task
+        try:
+            embeddings = encode(input_text)
+            results.put((task_id, embeddings, np.zeros(len(input_text), dtype=bool), None))
+            continue
+        except Exception as e:
+            error = repr(e)
+
+        # 整批失败时逐条重试，只丢弃单独也失败的输入
+        embeddings = np.zeros((len(input_text), model.get_sentence_embedding_dimension()), dtype=np.float32)
+        failed = np.zeros(len(input_text), dtype=bool)
+        for i, text in enumerate(input_text):
+            try:
+                embeddings[i] = encode([text])[0]
+            except Exception:
+                failed[i] = True
+        results.put((task_id, embeddings, failed, error))
+
+
+class EmbeddingProcessPool:
+    """
+    A pool of worker processes that each load the embedding model once and encode batches taken from a shared queue.
+
+    Every worker is pinned to ``threads_per_worker`` threads, so that on CPU-only hosts the pool uses all the
+    cores without the workers' thread pools competing with each other. The pool is thread-safe.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        embedding_size: int,
+        num_workers: int = 0,
+        threads_per_worker: int = 1,
+        backend: str = "torch",
+        onnx_options: dict | None = None,
+    ) -> None:
+        self._model_id = model_id
+        self._embedding_size = embedding_size
+        self._num_workers = num_workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+        self._threads_per_worker = threads_per_worker
+
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._processes = [
+            context.Process(
+                target=_embedding_worker,
+                args=(model_id, threads_per_worker, self._tasks, self._results, backend, onnx_options),
+                name=f"embedding-worker-{i}",
+                daemon=True,
+            )
+            for i in range(self._num_workers)
+        ]
+
+        self._task_ids = itertools.count()
+        self._pending: dict[int, Future] = {}
+        self._lock = Lock()
+        self._closed = Event()
+        self._broken = False
+        self._collector = Thread(target=self._collect_results, name="embedding-pool-collector", daemon=True)
+
+        for process in self._processes:
+            process.start()
+        self._collector.start()
+
+        logger.info(
+            "Embedding pool started.",
+            model_id=model_id,
+            backend=backend,
+            num_workers=self._num_workers,
+            threads_per_worker=threads_per_worker,
+        )
+
+    @property
+    def num_workers(self) -> int:
+        return self._num_workers
+
+    def encode_batched(
+        self, input_text: list[str], batch_size: int = 32
+    ) -> tuple[NDArray[np.float32], NDArray[np.bool_]]:
+        """
+        Generates embeddings by spreading batches of inputs of similar length over the worker processes.
+
+        Args:
+            input_text (list[str]): The input texts to generate embeddings for.
+            batch_size (int): The number of inputs sent to a worker at a time.
+
+        Returns:
+            tuple[NDArray[np.float32], NDArray[np.bool_]]: The embeddings, in input order, and a mask of the inputs
+                whose embedding could not be generated.
+        """
+
+        # 按字符长度排序近似token长度，父进程不需要加载tokenizer
+        order = np.argsort([len(text) for text in input_text], kind="stable")
+        batches = [order[start : start + batch_size] for start in range(0, len(order), batch_size)]
+        futures = [self._submit([input_text[i] for i in positions]) for positions in batches]
+
+        embeddings = np.zeros((len(input_text), self._embedding_size), dtype=np.float32)
+        failed = np.zeros(len(input_text), dtype=bool)
+        for positions, future in zip(batches, futures, strict=True):
+            try:
+                batch_embeddings, batch_failed, error = future.result()
+            except Exception:
+                logger.exception(f"Error generating embeddings for a batch of {len(positions)} inputs of {self._model_id=}")
+                failed[positions] = True
+                continue
+
+            if error is not None:
+                logger.error(
+                    f"Error generating embeddings for a batch of {len(positions)} inputs of {self._model_id=}, "
+                    f"{batch_failed.sum()} of them also failed one by one: {error}"
+                )
+            failed[positions] = batch_failed
+            embeddings[positions] = batch_embeddings
+
+        return embeddings, failed
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        if self._closed.is_set():
+            return
+
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=timeout)
+            if process.is_alive():
+                process.terminate()
+
+        self._closed.set()
+        self._collector.join(timeout=timeout)
+        self._fail_pending(RuntimeError("The embedding pool was shut down."))
+        self._tasks.close()
+        self._results.close()
+
+        logger.info("Embedding pool stopped.", model_id=self._model_id)
+
+    def __enter__(self) -> "EmbeddingProcessPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+
+    def _submit(self, input_text: list[str]) -> Future:
+        if self._closed.is_set() or self._broken:
+            raise RuntimeError("The embedding pool is shut down or one of its workers died.")
+
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            self._pending[task_id] = future
+        self._tasks.put((task_id, input_text))
+
+        return future
+
+    def _collect_results(self) -> None:
+        while not self._closed.is_set():
+            try:
+                task_id, embeddings, failed, error = self._results.get(timeout=1.0)
+            except Empty:
+                # worker异常退出时，它正在处理的任务永远不会返回结果
+                if not self._closed.is_set() and any(not process.is_alive() for process in self._processes):
+                    self._broken = True
+                    self._fail_pending(RuntimeError("An embedding worker process died."))
+                continue
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                future = self._pending.pop(task_id, None)
+            if future is None:
+                continue
+            future.set_result((embeddings, failed, error))
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
@@ -1,18 +1,22 @@
 from functools import cached_property
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import numpy as np
 from loguru import logger
 from numpy.typing import NDArray
-from sentence_transformers.SentenceTransformer import SentenceTransformer
-from sentence_transformers.cross_encoder import CrossEncoder
-from transformers import AutoTokenizer
 
 from llmtwin.settings import settings
 
 from .base import SingletonMeta
 
+if TYPE_CHECKING:
+    from transformers import AutoTokenizer
+
+
+class EmbeddingError(RuntimeError):
+    pass
+
 
 class EmbeddingModelSingleton(metaclass=SingletonMeta):
     """
@@ -24,16 +28,33 @@ class EmbeddingModelSingleton(metaclass=SingletonMeta):
         model_id: str = settings.TEXT_EMBEDDING_MODEL_ID,
         device: str = settings.RAG_MODEL_DEVICE,
         cache_dir: Optional[Path] = None,
+        backend: str = settings.RAG_MODEL_BACKEND,
     ) -> None:
         self._model_id = model_id
         self._device = device
-
-        self._model = SentenceTransformer(
-            self._model_id,
-            device=self._device,
-            cache_folder=str(cache_dir) if cache_dir else None,
-        )
-        self._model.eval()
+        self._backend = backend
+
+        if backend == "onnx":
+            # onnx后端不导入torch，导出和一致性检查只在第一次使用时进行
+            from .onnx_backend import load_onnx_embedding_model
+
+            self._model = load_onnx_embedding_model(
+                self._model_id,
+                cache_dir=settings.RAG_ONNX_CACHE_DIR,
+                quantize=settings.RAG_ONNX_QUANTIZE,
+                tolerance=settings.RAG_ONNX_PARITY_TOLERANCE,
+            )
+        elif backend == "torch":
+            from sentence_transformers.SentenceTransformer import SentenceTransformer
+
+            self._model = SentenceTransformer(
+                self._model_id,
+                device=self._device,
+                cache_folder=str(cache_dir) if cache_dir else None,
+            )
+            self._model.eval()
+        else:
+            raise ValueError(f"Unsupported model backend: {backend}")
 
     @property
     def model_id(self) -> str:
@@ -46,6 +67,17 @@ class EmbeddingModelSingleton(metaclass=SingletonMeta):
 
         return self._model_id
 
+    @property
+    def backend(self) -> str:
+        """
+        Returns the backend running the model, either "torch" or "onnx".
+
+        Returns:
+            str: The backend running the model.
+        """
+
+        return self._backend
+
     @cached_property
     def embedding_size(self) -> int:
         """
@@ -71,7 +103,7 @@ class EmbeddingModelSingleton(metaclass=SingletonMeta):
         return self._model.max_seq_length
 
     @property
-    def tokenizer(self) -> AutoTokenizer:
+    def tokenizer(self) -> "AutoTokenizer":
         """
         Returns the tokenizer used to tokenize input text.
 
@@ -93,26 +125,86 @@ class EmbeddingModelSingleton(metaclass=SingletonMeta):
 
         Returns:
             Union[np.ndarray, list]: The embeddings generated for the input text.
+
+        Raises:
+            EmbeddingError: If the embeddings of some of the inputs could not be generated.
         """
 
-        try:
+        if isinstance(input_text, str):
             embeddings = self._model.encode(input_text)
-        except Exception:
-            logger.error(f"Error generating embeddings for {self._model_id=} and {input_text=}")
-
-            return [] if to_list else np.array([])
+        else:
+            embeddings, failed = self.encode_batched(input_text)
+            if failed.any():
+                raise EmbeddingError(
+                    f"Failed to generate embeddings for {self._model_id=} at positions {np.flatnonzero(failed).tolist()}"
+                )
 
         if to_list:
             embeddings = embeddings.tolist()
 
         return embeddings
 
+    def encode_batched(
+        self, input_text: list[str], batch_size: int = settings.EMBEDDING_BATCH_SIZE
+    ) -> tuple[NDArray[np.float32], NDArray[np.bool_]]:
+        """
+        Generates embeddings in batches of inputs of similar token length, to minimize padding.
+
+        The inputs are sorted by token length, encoded ``batch_size`` at a time and returned in their original
+        order. When a batch fails it is logged and its inputs are retried one by one, so only the inputs that
+        fail on their own are lost.
+
+        Args:
+            input_text (list[str]): The input texts to generate embeddings for.
+            batch_size (int): The number of inputs encoded per forward pass.
+
+        Returns:
+            tuple[NDArray[np.float32], NDArray[np.bool_]]: A (len(input_text), embedding_size) matrix of embeddings,
+                and a mask of the inputs whose embedding could not be generated. Their rows are left as zeros.
+        """
+
+        embeddings = np.zeros((len(input_text), self.embedding_size), dtype=np.float32)
+        failed = np.zeros(len(input_text), dtype=bool)
+        if len(input_text) == 0:
+            return embeddings, failed
+
+        lengths = self.tokenizer(
+            input_text, truncation=True, max_length=self.max_input_length, return_length=True, verbose=False
+        )["length"]
+        order = np.argsort(lengths, kind="stable")
+
+        for start in range(0, len(order), batch_size):
+            positions = order[start : start + batch_size]
+            try:
+                embeddings[positions] = self._encode([input_text[i] for i in positions])
+                continue
+            except Exception:
+                logger.exception(
+                    f"Error generating embeddings for a batch of {len(positions)} inputs of {self._model_id=}, "
+                    "retrying them one by one."
+                )
+
+            for i in positions:
+                try:
+                    embeddings[i] = self._encode([input_text[i]])[0]
+                except Exception:
+                    logger.error(f"Error generating embeddings for {self._model_id=} and {input_text[i]=}")
+                    failed[i] = True
+
+        return embeddings, failed
+
+    def _encode(self, input_text: list[str]) -> NDArray[np.float32]:
+        return self._model.encode(
+            input_text, batch_size=len(input_text), convert_to_numpy=True, show_progress_bar=False
+        ).astype(np.float32, copy=False)
+
 
 class CrossEncoderModelSingleton(metaclass=SingletonMeta):
     def __init__(
         self,
         model_id: str = settings.RERANKING_CROSS_ENCODER_MODEL_ID,
         device: str = settings.RAG_MODEL_DEVICE,
+        backend: str = settings.RAG_MODEL_BACKEND,
     ) -> None:
         """
         A singleton class that provides a pre-trained cross-encoder model for scoring pairs of input text.
@@ -120,15 +212,32 @@ class CrossEncoderModelSingleton(metaclass=SingletonMeta):
 
         self._model_id = model_id
         self._device = device
+        self._backend = backend
+
+        if backend == "onnx":
+            from .onnx_backend import load_onnx_cross_encoder
+
+            self._model = load_onnx_cross_encoder(
+                self._model_id,
+                cache_dir=settings.RAG_ONNX_CACHE_DIR,
+                quantize=settings.RAG_ONNX_QUANTIZE,
+                tolerance=settings.RAG_ONNX_PARITY_TOLERANCE,
+            )
+        elif backend == "torch":
+            from sentence_transformers.cross_encoder import CrossEncoder
+
+            self._model = CrossEncoder(
+                model_name=self._model_id,
+                device=self._device,
+            )
+            self._model.model.eval()
+        else:
+            raise ValueError(f"Unsupported model backend: {backend}")
 
-        self._model = CrossEncoder(
-            model_name=self._model_id,
-            device=self._device,
-        )
-        self._model.model.eval()
-
-    def __call__(self, pairs: list[tuple[str, str]], to_list: bool = True) -> NDArray[np.float32] | list[float]:
-        scores = self._model.predict(pairs)
+    def __call__(
+        self, pairs: list[tuple[str, str]], to_list: bool = True, batch_size: int = 32
+    ) -> NDArray[np.float32] | list[float]:
+        scores = self._model.predict(pairs, batch_size=batch_size, show_progress_bar=False)
 
         if to_list:
             scores = scores.tolist()
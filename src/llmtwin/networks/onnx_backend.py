@@ -0,0 +1,357 @@
+import json
+import re
+import shutil
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+from loguru import logger
+from numpy.typing import NDArray
+
+_METADATA_FILE = "llmtwin_onnx.json"
+_REFERENCE_FILE = "reference.npy"
+_EXPORT_LOCK = Lock()
+
+# 用于导出和一致性检查的样例输入
+_PROBE_SENTENCES = [
+    "",
+    "Hello world.",
+    "Retrieval augmented generation combines a retriever with a language model.",
+    "MongoDB stores the raw documents while Qdrant stores their embeddings for similarity search.",
+    " ".join(["A long input that is truncated to the maximum sequence length of the model."] * 60),
+]
+_PROBE_QUERY = "How are documents stored?"
+
+
+class OnnxParityError(RuntimeError):
+    pass
+
+
+class OnnxSentenceEncoder:
+    """
+    Runs an exported sentence-transformers embedding model with onnxruntime, without importing torch.
+
+    It exposes the subset of the SentenceTransformer interface EmbeddingModelSingleton relies on.
+    """
+
+    def __init__(self, export_dir: Path, model_file: str = "model.onnx", num_threads: int | None = None) -> None:
+        self._export_dir = Path(export_dir)
+        self._metadata = json.loads((self._export_dir / _METADATA_FILE).read_text())
+        self._session, self._input_names = _create_session(self._export_dir / model_file, num_threads)
+        self._fast_tokenizer = _load_fast_tokenizer(self._export_dir, self._metadata)
+        self._hf_tokenizer = None
+        self._tokenizer_lock = Lock()
+
+    @property
+    def max_seq_length(self) -> int:
+        return self._metadata["max_seq_length"]
+
+    @property
+    def tokenizer(self):
+        # 只有chunk和按长度排序时用到，延迟加载transformers
+        with self._tokenizer_lock:
+            if self._hf_tokenizer is None:
+                from transformers import AutoTokenizer
+
+                self._hf_tokenizer = AutoTokenizer.from_pretrained(self._export_dir)
+        return self._hf_tokenizer
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._metadata["embedding_size"]
+
+    def encode(self, sentences: str | list[str], batch_size: int = 32, **kwargs) -> NDArray[np.float32]:
+        is_single = isinstance(sentences, str)
+        if is_single:
+            sentences = [sentences]
+
+        embeddings = np.zeros((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            encodings = self._fast_tokenizer.encode_batch(sentences[start : start + batch_size])
+            inputs = _to_inputs(encodings, self._input_names)
+            hidden_states = self._session.run(None, inputs)[0]
+            embeddings[start : start + len(encodings)] = self._pool(hidden_states, inputs["attention_mask"])
+
+        return embeddings[0] if is_single else embeddings
+
+    def _pool(self, hidden_states: NDArray[np.float32], attention_mask: NDArray[np.int64]) -> NDArray[np.float32]:
+        if self._metadata["pooling"] == "cls":
+            embeddings = hidden_states[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(np.float32)
+            embeddings = (hidden_states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        if self._metadata["normalize"]:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+
+        return embeddings.astype(np.float32, copy=False)
+
+
+class OnnxCrossEncoder:
+    """
+    Runs an exported single-label cross-encoder with onnxruntime, without importing torch.
+    """
+
+    def __init__(self, export_dir: Path, model_file: str = "model.onnx", num_threads: int | None = None) -> None:
+        self._export_dir = Path(export_dir)
+        self._metadata = json.loads((self._export_dir / _METADATA_FILE).read_text())
+        self._session, self._input_names = _create_session(self._export_dir / model_file, num_threads)
+        self._fast_tokenizer = _load_fast_tokenizer(self._export_dir, self._metadata)
+
+    def predict(self, pairs: list[tuple[str, str]], batch_size: int = 32, **kwargs) -> NDArray[np.float32]:
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        for start in range(0, len(pairs), batch_size):
+            encodings = self._fast_tokenizer.encode_batch([tuple(pair) for pair in pairs[start : start + batch_size]])
+            logits = self._session.run(None, _to_inputs(encodings, self._input_names))[0]
+            scores[start : start + len(encodings)] = logits[:, 0]
+
+        if self._metadata["activation"] == "sigmoid":
+            scores = 1 / (1 + np.exp(-scores))
+
+        return scores
+
+
+def load_onnx_embedding_model(
+    model_id: str, cache_dir: Path, quantize: bool = False, tolerance: float = 0.02, num_threads: int | None = None
+) -> OnnxSentenceEncoder:
+    """
+    Returns the ONNX version of a sentence-transformers embedding model, exporting it on first use.
+
+    Args:
+        model_id (str): The identifier of the sentence-transformers model.
+        cache_dir (Path): The directory the exported models are cached in.
+        quantize (bool): Whether to use a dynamically int8-quantized version of the model.
+        tolerance (float): The largest cosine distance allowed between the ONNX and PyTorch embeddings.
+        num_threads (int | None): The number of intra-op threads of onnxruntime. Defaults to all cores.
+
+    Raises:
+        OnnxParityError: If the ONNX model does not match the PyTorch model within the tolerance.
+    """
+
+    export_dir = _get_export_dir(cache_dir, model_id, "embedding")
+    model_file = _prepare(export_dir, model_id, _export_embedding_model, _embedding_error, quantize, tolerance)
+
+    return OnnxSentenceEncoder(export_dir, model_file=model_file, num_threads=num_threads)
+
+
+def load_onnx_cross_encoder(
+    model_id: str, cache_dir: Path, quantize: bool = False, tolerance: float = 0.02, num_threads: int | None = None
+) -> OnnxCrossEncoder:
+    """
+    Returns the ONNX version of a cross-encoder model, exporting it on first use.
+
+    Args:
+        model_id (str): The identifier of the cross-encoder model.
+        cache_dir (Path): The directory the exported models are cached in.
+        quantize (bool): Whether to use a dynamically int8-quantized version of the model.
+        tolerance (float): The largest score difference allowed between the ONNX and PyTorch models, relative to
+            the largest absolute score of the PyTorch model when it is above 1.
+        num_threads (int | None): The number of intra-op threads of onnxruntime. Defaults to all cores.
+
+    Raises:
+        OnnxParityError: If the ONNX model does not match the PyTorch model within the tolerance.
+    """
+
+    export_dir = _get_export_dir(cache_dir, model_id, "cross_encoder")
+    model_file = _prepare(export_dir, model_id, _export_cross_encoder, _cross_encoder_error, quantize, tolerance)
+
+    return OnnxCrossEncoder(export_dir, model_file=model_file, num_threads=num_threads)
+
+
+def _get_export_dir(cache_dir: Path, model_id: str, kind: str) -> Path:
+    return Path(cache_dir) / re.sub(r"[^\w.-]", "_", model_id) / kind
+
+
+def _prepare(export_dir: Path, model_id: str, export, compute_error, quantize: bool, tolerance: float) -> str:
+    """Exports and quantizes the model if needed, checks its parity once and returns the model file to load."""
+
+    with _EXPORT_LOCK:
+        metadata_path = export_dir / _METADATA_FILE
+        if not metadata_path.exists():
+            logger.info(f"Exporting {model_id} to ONNX.", export_dir=str(export_dir))
+            shutil.rmtree(export_dir, ignore_errors=True)
+            export_dir.mkdir(parents=True)
+            # 元数据文件最后写入，作为导出完成的标记
+            metadata, reference = export(model_id, export_dir)
+            np.save(export_dir / _REFERENCE_FILE, reference)
+            metadata["verified"] = {}
+            metadata_path.write_text(json.dumps(metadata, indent=2))
+
+        metadata = json.loads(metadata_path.read_text())
+        model_file = "model.onnx"
+        if quantize:
+            model_file = "model_int8.onnx"
+            if not (export_dir / model_file).exists():
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+
+                quantize_dynamic(export_dir / "model.onnx", export_dir / model_file, weight_type=QuantType.QInt8)
+
+        verified = metadata["verified"].get(model_file)
+        if verified is None or verified["tolerance"] != tolerance:
+            reference = np.load(export_dir / _REFERENCE_FILE)
+            error = compute_error(export_dir, model_file, reference)
+            if error > tolerance:
+                raise OnnxParityError(
+                    f"The ONNX model {export_dir / model_file} differs from the PyTorch model by {error:.4g}, "
+                    f"more than the tolerance of {tolerance}."
+                )
+
+            metadata["verified"][model_file] = {"error": error, "tolerance": tolerance}
+            metadata_path.write_text(json.dumps(metadata, indent=2))
+            logger.info(f"ONNX parity check passed for {model_id}.", model_file=model_file, error=error)
+
+    return model_file
+
+
+def _embedding_error(export_dir: Path, model_file: str, reference: NDArray[np.float32]) -> float:
+    embeddings = OnnxSentenceEncoder(export_dir, model_file=model_file).encode(_PROBE_SENTENCES)
+    norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1)
+    cosine = (embeddings * reference).sum(axis=1) / np.clip(norms, 1e-12, None)
+
+    return float(np.max(1 - cosine))
+
+
+def _cross_encoder_error(export_dir: Path, model_file: str, reference: NDArray[np.float32]) -> float:
+    scores = OnnxCrossEncoder(export_dir, model_file=model_file).predict(_probe_pairs())
+
+    return float(np.max(np.abs(scores - reference)) / max(1.0, float(np.max(np.abs(reference)))))
+
+
+def _probe_pairs() -> list[tuple[str, str]]:
+    return [(_PROBE_QUERY, sentence) for sentence in _PROBE_SENTENCES]
+
+
+def _export_embedding_model(model_id: str, export_dir: Path) -> tuple[dict, NDArray[np.float32]]:
+    from sentence_transformers.models import Normalize, Pooling
+    from sentence_transformers.SentenceTransformer import SentenceTransformer
+
+    model = SentenceTransformer(model_id, device="cpu")
+    model.eval()
+
+    pooling = next(module for module in model if isinstance(module, Pooling))
+    if pooling.pooling_mode_cls_token:
+        pooling_mode = "cls"
+    elif pooling.pooling_mode_mean_tokens:
+        pooling_mode = "mean"
+    else:
+        raise ValueError(f"Unsupported pooling of {model_id} for the ONNX backend: {pooling.get_pooling_mode_str()}")
+
+    _export_transformer(model[0].auto_model, model.tokenizer, export_dir / "model.onnx", "last_hidden_state")
+    model.tokenizer.save_pretrained(export_dir)
+
+    metadata = {
+        "model_id": model_id,
+        "pooling": pooling_mode,
+        "normalize": any(isinstance(module, Normalize) for module in model),
+        "max_seq_length": model.max_seq_length,
+        "embedding_size": model.get_sentence_embedding_dimension(),
+        **_padding_metadata(model.tokenizer),
+    }
+    reference = model.encode(_PROBE_SENTENCES, convert_to_numpy=True).astype(np.float32)
+
+    return metadata, reference
+
+
+def _export_cross_encoder(model_id: str, export_dir: Path) -> tuple[dict, NDArray[np.float32]]:
+    import torch
+    from sentence_transformers.cross_encoder import CrossEncoder
+
+    model = CrossEncoder(model_id, device="cpu")
+    model.model.eval()
+    if model.model.config.num_labels != 1:
+        raise ValueError(f"Only single-label cross-encoders are supported by the ONNX backend, got {model_id}.")
+
+    max_length = getattr(model, "max_length", None) or min(model.tokenizer.model_max_length, 512)
+    _export_transformer(model.model, model.tokenizer, export_dir / "model.onnx", "logits")
+    model.tokenizer.save_pretrained(export_dir)
+
+    pairs = _probe_pairs()
+    reference = np.asarray(model.predict(pairs, convert_to_numpy=True), dtype=np.float32).reshape(-1)
+    with torch.no_grad():
+        inputs = model.tokenizer(
+            [query for query, _ in pairs],
+            [document for _, document in pairs],
+            padding=True,
+            truncation=True,
+            max_length=max_length,
+            return_tensors="pt",
+        )
+        logits = model.model(**inputs).logits[:, 0].numpy()
+
+    # CrossEncoder.predict对单标签模型的输出可能经过了sigmoid，这里根据实际输出判断
+    activation = "sigmoid" if np.allclose(reference, 1 / (1 + np.exp(-logits)), atol=1e-4) else "identity"
+    metadata = {
+        "model_id": model_id,
+        "activation": activation,
+        "max_seq_length": max_length,
+        **_padding_metadata(model.tokenizer),
+    }
+
+    return metadata, reference
+
+
+def _export_transformer(model, tokenizer, path: Path, output_name: str) -> None:
+    import torch
+
+    inputs = tokenizer(["An export probe.", "A somewhat longer export probe sentence."], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in inputs]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes[output_name] = {0: "batch", 1: "sequence"} if output_name == "last_hidden_state" else {0: "batch"}
+
+    class _Wrapper(torch.nn.Module):
+        def __init__(self) -> None:
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(input_names, args, strict=True)))[0]
+
+    export_kwargs = dict(
+        input_names=input_names,
+        output_names=[output_name],
+        dynamic_axes=dynamic_axes,
+        opset_version=17,
+    )
+    with torch.no_grad():
+        try:
+            torch.onnx.export(
+                _Wrapper().eval(), tuple(inputs[name] for name in input_names), str(path), dynamo=False, **export_kwargs
+            )
+        except TypeError:
+            # 旧版本的torch没有dynamo参数
+            torch.onnx.export(_Wrapper().eval(), tuple(inputs[name] for name in input_names), str(path), **export_kwargs)
+
+
+def _padding_metadata(tokenizer) -> dict:
+    return {"pad_token": tokenizer.pad_token, "pad_token_id": tokenizer.pad_token_id}
+
+
+def _load_fast_tokenizer(export_dir: Path, metadata: dict):
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_file(str(export_dir / "tokenizer.json"))
+    tokenizer.enable_truncation(max_length=metadata["max_seq_length"])
+    tokenizer.enable_padding(pad_id=metadata["pad_token_id"], pad_token=metadata["pad_token"])
+
+    return tokenizer
+
+
+def _create_session(path: Path, num_threads: int | None):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    session = ort.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+
+    return session, {model_input.name for model_input in session.get_inputs()}
+
+
+def _to_inputs(encodings, input_names: set[str]) -> dict[str, NDArray[np.int64]]:
+    inputs = {
+        "input_ids": np.asarray([encoding.ids for encoding in encodings], dtype=np.int64),
+        "attention_mask": np.asarray([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+        "token_type_ids": np.asarray([encoding.type_ids for encoding in encodings], dtype=np.int64),
+    }
+
+    return {name: value for name, value in inputs.items() if name in input_names}
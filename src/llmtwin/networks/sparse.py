@@ -0,0 +1,238 @@
+import json
+import math
+import re
+import zlib
+from collections import Counter
+from pathlib import Path
+from threading import Lock
+from uuid import UUID
+
+from loguru import logger
+from pydantic import BaseModel
+
+from llmtwin.settings import settings
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class SparseEmbedding(BaseModel):
+    indices: list[int]
+    values: list[float]
+
+
+class BM25Encoder:
+    """
+    Encodes texts as sparse BM25 vectors whose dot product is the BM25 score of a query against a document.
+
+    Documents carry the term-frequency part of BM25, which depends on the average document length, and queries
+    carry the inverse document frequencies. Terms are hashed to 32-bit ids, so the vocabulary never has to be
+    shared with Qdrant, only the document frequencies are kept. They are fitted locally on the indexed chunks
+    and can be updated incrementally; documents encoded early use the statistics known at that time.
+
+    Texts fitted with their chunk ids are counted once however often they are re-embedded, and ``remove``
+    subtracts the chunks deleted from the collection, so the statistics follow the indexed chunks. The fitted
+    ids are kept as their low 63 bits, about 60 bytes per chunk, and saved with the statistics.
+    """
+
+    def __init__(self, k1: float = settings.BM25_K1, b: float = settings.BM25_B) -> None:
+        self.k1 = k1
+        self.b = b
+        self._document_frequencies: Counter[int] = Counter()
+        self._num_documents = 0
+        self._total_length = 0
+        self._fitted_ids: set[int] = set()
+        self._lock = Lock()
+
+    @property
+    def num_documents(self) -> int:
+        return self._num_documents
+
+    @property
+    def average_length(self) -> float:
+        return self._total_length / self._num_documents if self._num_documents else 1.0
+
+    @staticmethod
+    def tokenize(text: str) -> list[str]:
+        return _TOKEN_PATTERN.findall(text.lower())
+
+    @staticmethod
+    def term_id(term: str) -> int:
+        return zlib.crc32(term.encode())
+
+    def fit(self, texts: list[str], ids: list[UUID] | None = None) -> "BM25Encoder":
+        with self._lock:
+            self._document_frequencies.clear()
+            self._num_documents = 0
+            self._total_length = 0
+            self._fitted_ids.clear()
+
+        return self.partial_fit(texts, ids)
+
+    def partial_fit(self, texts: list[str], ids: list[UUID] | None = None) -> "BM25Encoder":
+        """
+        Adds the texts to the document frequencies and the average document length.
+
+        Args:
+            texts (list[str]): The texts of the indexed chunks.
+            ids (list[UUID] | None): The ids of the chunks. The texts of the chunks already fitted are skipped.
+        """
+
+        if ids is not None:
+            unseen = []
+            with self._lock:
+                # 先登记id，并发的批次或同一批次中相同的chunk只统计一次
+                for text, _id in zip(texts, ids, strict=True):
+                    key = _id_key(_id)
+                    if key not in self._fitted_ids:
+                        self._fitted_ids.add(key)
+                        unseen.append(text)
+            texts = unseen
+
+        frequencies, total_length = self._count(texts)
+        with self._lock:
+            self._document_frequencies.update(frequencies)
+            self._num_documents += len(texts)
+            self._total_length += total_length
+
+        return self
+
+    def remove(self, texts: list[str], ids: list[UUID]) -> "BM25Encoder":
+        """Subtracts the texts of the fitted chunks removed from the collection; the other texts are ignored."""
+
+        fitted = []
+        with self._lock:
+            for text, _id in zip(texts, ids, strict=True):
+                key = _id_key(_id)
+                if key in self._fitted_ids:
+                    self._fitted_ids.discard(key)
+                    fitted.append(text)
+
+        frequencies, total_length = self._count(fitted)
+        with self._lock:
+            for term_id, frequency in frequencies.items():
+                document_frequency = self._document_frequencies[term_id] - frequency
+                if document_frequency > 0:
+                    self._document_frequencies[term_id] = document_frequency
+                else:
+                    del self._document_frequencies[term_id]
+            self._num_documents -= len(fitted)
+            self._total_length -= total_length
+
+        return self
+
+    def _count(self, texts: list[str]) -> tuple[Counter, int]:
+        frequencies = Counter()
+        total_length = 0
+        for text in texts:
+            tokens = self.tokenize(text)
+            total_length += len(tokens)
+            frequencies.update({self.term_id(term) for term in tokens})
+
+        return frequencies, total_length
+
+    def encode_documents(self, texts: list[str]) -> list[SparseEmbedding]:
+        average_length = self.average_length
+        embeddings = []
+        for text in texts:
+            tokens = self.tokenize(text)
+            length_norm = self.k1 * (1 - self.b + self.b * len(tokens) / average_length)
+            counts = Counter(self.term_id(term) for term in tokens)
+            embeddings.append(
+                SparseEmbedding(
+                    indices=list(counts),
+                    values=[tf * (self.k1 + 1) / (tf + length_norm) for tf in counts.values()],
+                )
+            )
+
+        return embeddings
+
+    def encode_query(self, text: str) -> SparseEmbedding:
+        term_ids = list(dict.fromkeys(self.term_id(term) for term in self.tokenize(text)))
+        num_documents = self._num_documents
+
+        values = []
+        for term_id in term_ids:
+            document_frequency = self._document_frequencies.get(term_id, 0)
+            values.append(math.log(1 + (num_documents - document_frequency + 0.5) / (document_frequency + 0.5)))
+
+        return SparseEmbedding(indices=term_ids, values=values)
+
+    def save(self, path: Path) -> None:
+        with self._lock:
+            state = {
+                "k1": self.k1,
+                "b": self.b,
+                "num_documents": self._num_documents,
+                "total_length": self._total_length,
+                "document_frequencies": {str(term_id): df for term_id, df in self._document_frequencies.items()},
+                "fitted_ids": sorted(self._fitted_ids),
+            }
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Encoder":
+        state = json.loads(Path(path).read_text())
+        encoder = cls(k1=state["k1"], b=state["b"])
+        encoder._num_documents = state["num_documents"]
+        encoder._total_length = state["total_length"]
+        encoder._document_frequencies = Counter(
+            {int(term_id): df for term_id, df in state["document_frequencies"].items()}
+        )
+        # 旧版本保存的统计量没有chunk id，可以用fit_bm25_encoder从集合重新统计
+        encoder._fitted_ids = set(state.get("fitted_ids", []))
+
+        return encoder
+
+
+def _id_key(_id: UUID) -> int:
+    return _id.int & 0x7FFFFFFFFFFFFFFF
+
+
+_encoders: dict[str, BM25Encoder] = {}
+_encoders_lock = Lock()
+
+
+def get_bm25_encoder(collection_name: str) -> BM25Encoder:
+    """Returns the BM25 encoder of a collection, loading its statistics from BM25_VOCABULARY_DIR if saved."""
+
+    with _encoders_lock:
+        if collection_name not in _encoders:
+            path = settings.BM25_VOCABULARY_DIR / f"{collection_name}.json"
+            _encoders[collection_name] = BM25Encoder.load(path) if path.exists() else BM25Encoder()
+        return _encoders[collection_name]
+
+
+def fit_bm25_encoder(document_class) -> BM25Encoder:
+    """
+    Refits the BM25 encoder of a collection on every chunk indexed in it, e.g. for statistics saved before the
+    fitted chunk ids were, and saves it.
+
+    Args:
+        document_class (Type[VectorBaseDocument]): The embedded document class of the collection.
+    """
+
+    encoder = get_bm25_encoder(document_class.get_collection_name())
+    texts, ids = [], []
+    for document in document_class.iter_find():
+        texts.append(document.content)
+        ids.append(document.id)
+    encoder.fit(texts, ids)
+    encoder.save(settings.BM25_VOCABULARY_DIR / f"{document_class.get_collection_name()}.json")
+
+    return encoder
+
+
+def save_bm25_encoders() -> None:
+    """Saves the statistics of every BM25 encoder used by this process, so queries can use them."""
+
+    with _encoders_lock:
+        encoders = dict(_encoders)
+
+    for collection_name, encoder in encoders.items():
+        encoder.save(settings.BM25_VOCABULARY_DIR / f"{collection_name}.json")
+        logger.info("Saved BM25 statistics.", collection_name=collection_name, num_documents=encoder.num_documents)
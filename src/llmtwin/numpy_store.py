@@ -0,0 +1,797 @@
+import bisect
+import json
+import shutil
+import sqlite3
+from collections import defaultdict
+from pathlib import Path
+from threading import RLock
+from uuid import UUID
+
+import numpy as np
+from loguru import logger
+from numpy.typing import NDArray
+from qdrant_client.http import models
+
+_MEMORY = ":memory:"
+_SEARCH_CHUNK_ROWS = 65536
+_IVF_MIN_POINTS_PER_LIST = 39
+_IVF_TRAINING_POINTS_PER_LIST = 256
+_IVF_ITERATIONS = 10
+
+
+class _VectorMatrix:
+    """A growable float32 matrix, memory-mapped from a file or held in memory."""
+
+    def __init__(self, path: Path | None, size: int, num_rows: int = 0) -> None:
+        self._path = path
+        self.size = size
+        self.data = self._open(max(num_rows, 1024))
+
+    def ensure_capacity(self, num_rows: int) -> None:
+        if num_rows > self.data.shape[0]:
+            self.data = self._open(max(num_rows, 2 * self.data.shape[0]))
+
+    def flush(self) -> None:
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+    def _open(self, capacity: int) -> NDArray[np.float32]:
+        if self._path is None:
+            data = np.zeros((capacity, self.size), dtype=np.float32)
+            if hasattr(self, "data"):
+                data[: self.data.shape[0]] = self.data
+            return data
+
+        if hasattr(self, "data"):
+            self.data.flush()
+            del self.data
+        nbytes = capacity * self.size * 4
+        with open(self._path, "ab") as f:
+            if f.tell() < nbytes:
+                f.truncate(nbytes)
+
+        return np.memmap(self._path, dtype=np.float32, mode="r+", shape=(capacity, self.size))
+
+
+class _IvfIndex:
+    """An inverted file index: the vectors are partitioned by their nearest k-means centroid."""
+
+    def __init__(self, centroids: NDArray[np.float32], assignments: NDArray[np.int64], num_indexed: int) -> None:
+        self.centroids = centroids
+        self.assignments = assignments
+        self.num_indexed = num_indexed
+        self._lists: list[NDArray[np.int64]] | None = None
+
+    @classmethod
+    def build(cls, vectors: NDArray[np.float32], slots: NDArray[np.int64], num_lists: int) -> "_IvfIndex":
+        rng = np.random.default_rng(0)
+        sample_size = min(len(slots), num_lists * _IVF_TRAINING_POINTS_PER_LIST)
+        sample = vectors[np.sort(rng.choice(slots, size=sample_size, replace=False))]
+
+        # 向量已归一化，用球面k-means：按内积分配，中心重新归一化
+        centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)].copy()
+        for _ in range(_IVF_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for list_id in range(num_lists):
+                members = sample[labels == list_id]
+                if len(members):
+                    centroids[list_id] = members.mean(axis=0)
+            centroids /= np.clip(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12, None)
+
+        assignments = np.full(vectors.shape[0], -1, dtype=np.int64)
+        index = cls(centroids, assignments, num_indexed=len(slots))
+        index.assign(vectors, slots)
+
+        return index
+
+    def assign(self, vectors: NDArray[np.float32], slots: NDArray[np.int64]) -> None:
+        if len(slots) and slots.max() >= len(self.assignments):
+            grown = np.full(max(slots.max() + 1, 2 * len(self.assignments)), -1, dtype=np.int64)
+            grown[: len(self.assignments)] = self.assignments
+            self.assignments = grown
+        for start in range(0, len(slots), _SEARCH_CHUNK_ROWS):
+            chunk = slots[start : start + _SEARCH_CHUNK_ROWS]
+            self.assignments[chunk] = np.argmax(vectors[chunk] @ self.centroids.T, axis=1)
+        self._lists = None
+
+    def unassign(self, slots: list[int]) -> None:
+        slots = [slot for slot in slots if slot < len(self.assignments)]
+        self.assignments[slots] = -1
+        self._lists = None
+
+    def candidates(self, query: NDArray[np.float32], num_probes: int) -> NDArray[np.int64]:
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind="stable")
+            bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[bounds[i] : bounds[i + 1]] for i in range(len(self.centroids))]
+
+        probes = np.argsort(-(self.centroids @ query))[:num_probes]
+        return np.concatenate([self._lists[list_id] for list_id in probes])
+
+
+class _Collection:
+    def __init__(self, name: str, path: Path | None, config: dict) -> None:
+        self.name = name
+        self.config = config
+        self._path = path
+
+        if path is not None:
+            path.mkdir(parents=True, exist_ok=True)
+            (path / "config.json").write_text(json.dumps(config))
+        self._db = sqlite3.connect(str(path / "points.sqlite") if path else _MEMORY, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS points (id TEXT PRIMARY KEY, slot INTEGER NOT NULL, payload TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sparse (slot INTEGER NOT NULL, name TEXT NOT NULL, term INTEGER NOT NULL, value REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sparse_term ON sparse (name, term)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS sparse_slot ON sparse (slot)")
+        self._db.commit()
+
+        # payload全部保存在内存中，SQLite只用于持久化
+        self.ids: dict[str, int] = {}
+        self.slot_ids: list[str | None] = []
+        self.payloads: list[dict | None] = []
+        # 每个查询都要用到的掩码，随写入和删除更新；容量按倍数增长，只有前len(slot_ids)个有效
+        self.alive = np.zeros(1024, dtype=bool)
+        self.has_vector: dict[str, NDArray[np.bool_]] = {}
+        for _id, slot, payload in self._db.execute("SELECT id, slot, payload FROM points"):
+            self._set_slot(slot, _id, json.loads(payload))
+        self.free_slots = [slot for slot, _id in enumerate(self.slot_ids) if _id is None]
+
+        self.vectors = {
+            name: _VectorMatrix(path / f"vectors-{name or 'default'}.f32" if path else None, size, len(self.slot_ids))
+            for name, size in config["vectors"].items()
+        }
+        for name, matrix in self.vectors.items():
+            # 没有写入向量的行保持全零
+            has_vector = np.zeros(len(self.alive), dtype=bool)
+            for start in range(0, len(self.slot_ids), _SEARCH_CHUNK_ROWS):
+                end = min(len(self.slot_ids), start + _SEARCH_CHUNK_ROWS)
+                has_vector[start:end] = self.alive[start:end] & np.any(matrix.data[start:end] != 0, axis=1)
+            self.has_vector[name] = has_vector
+        self.payload_indexes: dict[str, dict] = {}
+        for field_name in config["payload_indexes"]:
+            self._build_payload_index(field_name)
+        self.ivf: dict[str, _IvfIndex] = {}
+        self._sorted_ids: list[str] | None = None
+
+    @property
+    def num_points(self) -> int:
+        return len(self.ids)
+
+    def alive_mask(self) -> NDArray[np.bool_]:
+        """The slots holding a point. A view of the maintained mask, not to be modified."""
+        return self.alive[: len(self.slot_ids)]
+
+    def vector_mask(self, name: str) -> NDArray[np.bool_]:
+        """The slots holding a point with a dense vector named ``name``. A view, not to be modified."""
+        return self.has_vector[name][: len(self.slot_ids)]
+
+    def sorted_ids(self) -> list[str]:
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.ids)
+        return self._sorted_ids
+
+    def upsert(self, points: list) -> None:
+        rows, sparse_rows, new_slots, cleared = [], [], defaultdict(list), set()
+        for point in points:
+            _id = str(point.id)
+            slot = self.ids.get(_id)
+            if slot is None:
+                slot = self.free_slots.pop() if self.free_slots else len(self.slot_ids)
+            else:
+                self._unindex(slot)
+
+            # 与qdrant一致：payload按JSON保存，读出时UUID等类型都变为字符串
+            payload = json.loads(json.dumps(point.payload or {}, default=str))
+            self._set_slot(slot, _id, payload)
+            self._index(slot)
+            rows.append((_id, slot, json.dumps(payload)))
+
+            vectors = point.vector if isinstance(point.vector, dict) else {"": point.vector}
+            written = set()
+            for name, vector in vectors.items():
+                if isinstance(vector, models.SparseVector):
+                    sparse_rows.extend((slot, name, term, value) for term, value in zip(vector.indices, vector.values))
+                elif name in self.vectors and vector is not None and len(vector) > 0:
+                    matrix = self.vectors[name]
+                    matrix.ensure_capacity(slot + 1)
+                    vector = np.asarray(vector, dtype=np.float32)
+                    # 余弦距离：写入时归一化，检索时只需内积
+                    matrix.data[slot] = vector / max(float(np.linalg.norm(vector)), 1e-12)
+                    self.has_vector[name][slot] = True
+                    new_slots[name].append(slot)
+                    written.add(name)
+            for name, matrix in self.vectors.items():
+                if name not in written and self.has_vector[name][slot]:
+                    # 与qdrant一致，upsert替换整个点：这次没有给出的向量被删除，行清零以便重新打开时识别
+                    self.has_vector[name][slot] = False
+                    matrix.data[slot] = 0
+                    cleared.add(name)
+
+        self._db.executemany("DELETE FROM sparse WHERE slot = ?", [(slot,) for _, slot, _ in rows])
+        self._db.executemany("INSERT OR REPLACE INTO points (id, slot, payload) VALUES (?, ?, ?)", rows)
+        self._db.executemany("INSERT INTO sparse (slot, name, term, value) VALUES (?, ?, ?, ?)", sparse_rows)
+        self._db.commit()
+        for name in cleared - set(new_slots):
+            self.vectors[name].flush()
+        for name, slots in new_slots.items():
+            self.vectors[name].flush()
+            if name in self.ivf:
+                self.ivf[name].assign(self.vectors[name].data, np.asarray(slots, dtype=np.int64))
+        self._sorted_ids = None
+
+    def delete(self, ids: list[str]) -> None:
+        ids = [_id for _id in dict.fromkeys(ids) if _id in self.ids]
+        slots = [self.ids[_id] for _id in ids]
+        for slot in slots:
+            self._unindex(slot)
+            del self.ids[self.slot_ids[slot]]
+            self.slot_ids[slot] = None
+            self.payloads[slot] = None
+            self.free_slots.append(slot)
+        self.alive[slots] = False
+        for has_vector in self.has_vector.values():
+            has_vector[slots] = False
+        for index in self.ivf.values():
+            index.unassign(slots)
+
+        # 按主键删除，slot列上没有索引
+        self._db.executemany("DELETE FROM points WHERE id = ?", [(_id,) for _id in ids])
+        self._db.executemany("DELETE FROM sparse WHERE slot = ?", [(slot,) for slot in slots])
+        self._db.commit()
+        self._sorted_ids = None
+
+    def set_payload(self, ids: list[str], payload: dict) -> None:
+        payload = json.loads(json.dumps(payload, default=str))
+        rows = []
+        for _id in ids:
+            slot = self.ids.get(_id)
+            if slot is None:
+                continue
+            self._unindex(slot)
+            self.payloads[slot] = {**self.payloads[slot], **payload}
+            self._index(slot)
+            rows.append((json.dumps(self.payloads[slot]), _id))
+
+        self._db.executemany("UPDATE points SET payload = ? WHERE id = ?", rows)
+        self._db.commit()
+
+    def sparse_scores(self, name: str, vector: models.SparseVector) -> NDArray[np.float32]:
+        scores = np.zeros(len(self.slot_ids), dtype=np.float32)
+        weights = dict(zip(vector.indices, vector.values))
+        terms = list(weights)
+        for start in range(0, len(terms), 900):
+            chunk = terms[start : start + 900]
+            rows = self._db.execute(
+                f"SELECT slot, term, value FROM sparse WHERE name = ? AND term IN ({','.join('?' * len(chunk))})",
+                [name, *chunk],
+            ).fetchall()
+            if rows:
+                slots, row_terms, values = map(np.asarray, zip(*rows))
+                np.add.at(scores, slots, values * np.array([weights[term] for term in row_terms], dtype=np.float32))
+
+        return scores
+
+    def sparse_vector(self, name: str, slot: int) -> models.SparseVector:
+        rows = self._db.execute("SELECT term, value FROM sparse WHERE name = ? AND slot = ?", (name, slot)).fetchall()
+        return models.SparseVector(indices=[term for term, _ in rows], values=[value for _, value in rows])
+
+    def add_payload_index(self, field_name: str, field_type: str) -> None:
+        self.config["payload_indexes"][field_name] = field_type
+        self._build_payload_index(field_name)
+        self.save_config()
+
+    def save_config(self) -> None:
+        if self._path is not None:
+            (self._path / "config.json").write_text(json.dumps(self.config))
+
+    def close(self) -> None:
+        for matrix in self.vectors.values():
+            matrix.flush()
+        self._db.close()
+
+    def _set_slot(self, slot: int, _id: str, payload: dict) -> None:
+        while len(self.slot_ids) <= slot:
+            self.slot_ids.append(None)
+            self.payloads.append(None)
+        if slot >= len(self.alive):
+            capacity = max(slot + 1, 2 * len(self.alive))
+            self.alive = _grown(self.alive, capacity)
+            self.has_vector = {name: _grown(mask, capacity) for name, mask in self.has_vector.items()}
+        self.slot_ids[slot] = _id
+        self.payloads[slot] = payload
+        self.ids[_id] = slot
+        self.alive[slot] = True
+
+    def _build_payload_index(self, field_name: str) -> None:
+        self.payload_indexes[field_name] = defaultdict(set)
+        for slot, payload in enumerate(self.payloads):
+            if payload is not None:
+                self._index_value(field_name, slot, payload)
+
+    def _index(self, slot: int) -> None:
+        for field_name in self.payload_indexes:
+            self._index_value(field_name, slot, self.payloads[slot])
+
+    def _unindex(self, slot: int) -> None:
+        for field_name, index in self.payload_indexes.items():
+            for value in _as_list(_get_value(self.payloads[slot], field_name)):
+                index[_hashable(value)].discard(slot)
+
+    def _index_value(self, field_name: str, slot: int, payload: dict) -> None:
+        for value in _as_list(_get_value(payload, field_name)):
+            self.payload_indexes[field_name][_hashable(value)].add(slot)
+
+
+class NumpyVectorStore:
+    """
+    An in-process vector store implementing the part of the QdrantClient interface used by VectorBaseDocument.
+
+    Every collection keeps its vectors in a memory-mapped float32 matrix and its payloads in SQLite, with the
+    payloads also held in memory for filtering. Dense search is an exact vectorized dot product over all the
+    points (vectors are normalized, so it is the cosine similarity), or, when ``ivf_lists`` is set and the
+    collection is large enough, an IVF search over the ``ivf_probes`` partitions closest to the query. Sparse
+    vectors are scored through an SQLite inverted index, and fusion queries use reciprocal rank fusion.
+
+    Args:
+        path (str): The directory the collections are stored in, or ":memory:" to keep them in memory.
+        ivf_lists (int): The number of IVF partitions, 0 to always search exactly.
+        ivf_probes (int): The number of partitions searched per query.
+    """
+
+    def __init__(self, path: str = _MEMORY, ivf_lists: int = 0, ivf_probes: int = 8) -> None:
+        self._path = None if path == _MEMORY else Path(path).expanduser()
+        self._ivf_lists = ivf_lists
+        self._ivf_probes = ivf_probes
+        self._collections: dict[str, _Collection] = {}
+        self._lock = RLock()
+
+        if self._path is not None:
+            self._path.mkdir(parents=True, exist_ok=True)
+            for config_path in self._path.glob("*/config.json"):
+                name = config_path.parent.name
+                self._collections[name] = _Collection(name, config_path.parent, json.loads(config_path.read_text()))
+
+    def get_collections(self) -> models.CollectionsResponse:
+        with self._lock:
+            return models.CollectionsResponse(
+                collections=[models.CollectionDescription(name=name) for name in self._collections]
+            )
+
+    def collection_exists(self, collection_name: str) -> bool:
+        with self._lock:
+            return collection_name in self._collections
+
+    def create_collection(
+        self, collection_name: str, vectors_config=None, sparse_vectors_config=None, **kwargs
+    ) -> bool:
+        with self._lock:
+            if collection_name in self._collections:
+                raise ValueError(f"Collection {collection_name} already exists")
+
+            if isinstance(vectors_config, models.VectorParams):
+                vectors = {"": vectors_config.size}
+            else:
+                vectors = {name: params.size for name, params in (vectors_config or {}).items()}
+            for params in [vectors_config] if isinstance(vectors_config, models.VectorParams) else (vectors_config or {}).values():
+                if params.distance != models.Distance.COSINE:
+                    raise ValueError(f"Only cosine distance is supported, got {params.distance}")
+
+            config = {
+                "vectors": vectors,
+                "named": not isinstance(vectors_config, models.VectorParams),
+                "sparse_vectors": list(sparse_vectors_config or {}),
+                "payload_indexes": {},
+            }
+            path = self._path / collection_name if self._path is not None else None
+            self._collections[collection_name] = _Collection(collection_name, path, config)
+
+        return True
+
+    def delete_collection(self, collection_name: str, **kwargs) -> bool:
+        with self._lock:
+            collection = self._collections.pop(collection_name, None)
+            if collection is None:
+                return False
+            collection.close()
+            if self._path is not None:
+                shutil.rmtree(self._path / collection_name)
+
+        return True
+
+    def get_collection(self, collection_name: str) -> models.CollectionInfo:
+        with self._lock:
+            collection = self._get(collection_name)
+            config = collection.config
+            if config["named"]:
+                vectors = {
+                    name: models.VectorParams(size=size, distance=models.Distance.COSINE)
+                    for name, size in config["vectors"].items()
+                }
+            else:
+                vectors = models.VectorParams(size=config["vectors"][""], distance=models.Distance.COSINE)
+
+            params = models.CollectionParams.model_construct(
+                vectors=vectors,
+                sparse_vectors={name: models.SparseVectorParams() for name in config["sparse_vectors"]} or None,
+            )
+            payload_schema = {
+                field_name: models.PayloadIndexInfo(
+                    data_type=models.PayloadSchemaType(field_type), points=collection.num_points
+                )
+                for field_name, field_type in config["payload_indexes"].items()
+            }
+
+            return models.CollectionInfo.model_construct(
+                status=models.CollectionStatus.GREEN,
+                points_count=collection.num_points,
+                indexed_vectors_count=collection.num_points,
+                segments_count=1,
+                config=models.CollectionConfig.model_construct(params=params),
+                payload_schema=payload_schema,
+            )
+
+    def update_collection(self, collection_name: str, **kwargs) -> bool:
+        # HNSW、量化和on-disk参数对精确检索没有意义
+        with self._lock:
+            self._get(collection_name)
+        return True
+
+    def create_payload_index(self, collection_name: str, field_name: str, field_schema=None, **kwargs):
+        with self._lock:
+            field_type = field_schema.value if isinstance(field_schema, models.PayloadSchemaType) else str(field_schema)
+            self._get(collection_name).add_payload_index(field_name, field_type)
+        return self._completed()
+
+    def upsert(self, collection_name: str, points, wait: bool = True, **kwargs) -> models.UpdateResult:
+        if isinstance(points, models.Batch):
+            points = [
+                models.PointStruct.model_construct(id=_id, vector=vector, payload=payload)
+                for _id, vector, payload in zip(
+                    points.ids, points.vectors, points.payloads or [None] * len(points.ids), strict=True
+                )
+            ]
+        with self._lock:
+            self._get(collection_name).upsert(list(points))
+        return self._completed()
+
+    def delete(self, collection_name: str, points_selector, wait: bool = True, **kwargs) -> models.UpdateResult:
+        with self._lock:
+            collection = self._get(collection_name)
+            collection.delete(self._selected_ids(collection, points_selector))
+        return self._completed()
+
+    def set_payload(self, collection_name: str, payload: dict, points, wait: bool = True, **kwargs) -> models.UpdateResult:
+        with self._lock:
+            collection = self._get(collection_name)
+            collection.set_payload(self._selected_ids(collection, points), payload)
+        return self._completed()
+
+    def retrieve(
+        self, collection_name: str, ids: list, with_payload=True, with_vectors=False, **kwargs
+    ) -> list[models.Record]:
+        with self._lock:
+            collection = self._get(collection_name)
+            slots = [collection.ids[str(_id)] for _id in ids if str(_id) in collection.ids]
+            return [self._record(collection, slot, with_payload, with_vectors) for slot in slots]
+
+    def scroll(
+        self,
+        collection_name: str,
+        scroll_filter: models.Filter | None = None,
+        limit: int = 10,
+        offset=None,
+        with_payload=True,
+        with_vectors=False,
+        **kwargs,
+    ) -> tuple[list[models.Record], str | None]:
+        with self._lock:
+            collection = self._get(collection_name)
+            mask = self._filter_mask(collection, scroll_filter)
+            # 与qdrant一致按id排序，offset是本页第一个点的id
+            ids = collection.sorted_ids()
+            start = 0 if offset is None else bisect.bisect_left(ids, str(offset))
+
+            records, next_offset = [], None
+            for position in range(start, len(ids)):
+                _id = ids[position]
+                slot = collection.ids[_id]
+                if not mask[slot]:
+                    continue
+                if len(records) == limit:
+                    next_offset = _id
+                    break
+                records.append(self._record(collection, slot, with_payload, with_vectors))
+
+            return records, next_offset
+
+    def count(self, collection_name: str, count_filter: models.Filter | None = None, **kwargs) -> models.CountResult:
+        with self._lock:
+            collection = self._get(collection_name)
+            return models.CountResult(count=int(self._filter_mask(collection, count_filter).sum()))
+
+    def query_points(
+        self,
+        collection_name: str,
+        query=None,
+        using: str | None = None,
+        prefetch=None,
+        query_filter: models.Filter | None = None,
+        search_params: models.SearchParams | None = None,
+        limit: int = 10,
+        with_payload=True,
+        with_vectors=False,
+        **kwargs,
+    ) -> models.QueryResponse:
+        with self._lock:
+            collection = self._get(collection_name)
+            mask = self._filter_mask(collection, query_filter)
+
+            if isinstance(query, models.FusionQuery):
+                if query.fusion != models.Fusion.RRF:
+                    raise NotImplementedError(f"Unsupported fusion: {query.fusion}")
+                prefetch = prefetch if isinstance(prefetch, list) else [prefetch]
+                rankings = [
+                    self._search(
+                        collection,
+                        p.query,
+                        p.using,
+                        mask & self._filter_mask(collection, p.filter),
+                        p.limit,
+                        p.params,
+                    )
+                    for p in prefetch
+                ]
+                slots, scores = _reciprocal_rank_fusion(rankings, limit)
+            else:
+                slots, scores = self._search(collection, query, using, mask, limit, search_params)
+
+            points = [
+                models.ScoredPoint(
+                    id=collection.slot_ids[slot],
+                    version=0,
+                    score=float(score),
+                    payload=self._payload(collection, slot, with_payload),
+                    vector=self._vector(collection, slot, with_vectors),
+                )
+                for slot, score in zip(slots, scores)
+            ]
+
+            return models.QueryResponse(points=points)
+
+    def close(self) -> None:
+        with self._lock:
+            for collection in self._collections.values():
+                collection.close()
+
+    def _get(self, collection_name: str) -> _Collection:
+        if collection_name not in self._collections:
+            raise ValueError(f"Collection {collection_name} not found")
+        return self._collections[collection_name]
+
+    def _search(
+        self,
+        collection: _Collection,
+        query,
+        using: str | None,
+        mask: NDArray[np.bool_],
+        limit: int,
+        search_params: models.SearchParams | None,
+    ) -> tuple[NDArray[np.int64], NDArray[np.float32]]:
+        if isinstance(query, models.SparseVector):
+            scores = collection.sparse_scores(using or "", query)
+            # 与qdrant一致，只返回至少有一个词匹配的点
+            return _top_k(scores, mask & (scores > 0), limit)
+
+        name = using or ""
+        if name not in collection.vectors:
+            raise ValueError(f"Collection {collection.name} has no dense vector named {name!r}")
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        vectors = collection.vectors[name].data
+        # 没有这个向量的点不参与检索，而不是以0分返回
+        mask = mask & collection.vector_mask(name)
+
+        exact = search_params is not None and search_params.exact
+        index = None if exact else self._get_ivf_index(collection, name)
+        if index is not None:
+            candidates = index.candidates(query, self._ivf_probes)
+            candidates = candidates[mask[candidates]]
+            if len(candidates) >= limit:
+                slots, scores = _top_k(vectors[candidates] @ query, None, limit)
+                return candidates[slots], scores
+
+        num_rows = len(collection.slot_ids)
+        scores = np.empty(num_rows, dtype=np.float32)
+        for start in range(0, num_rows, _SEARCH_CHUNK_ROWS):
+            scores[start : start + _SEARCH_CHUNK_ROWS] = vectors[start : min(num_rows, start + _SEARCH_CHUNK_ROWS)] @ query
+
+        return _top_k(scores, mask, limit)
+
+    def _get_ivf_index(self, collection: _Collection, name: str) -> _IvfIndex | None:
+        if self._ivf_lists <= 0 or collection.num_points < self._ivf_lists * _IVF_MIN_POINTS_PER_LIST:
+            return None
+
+        # 点数比建立索引时翻倍后重新训练中心
+        index = collection.ivf.get(name)
+        if index is None or collection.num_points > 2 * index.num_indexed:
+            slots = np.flatnonzero(collection.vector_mask(name))
+            index = _IvfIndex.build(collection.vectors[name].data, slots, self._ivf_lists)
+            collection.ivf[name] = index
+            logger.info(f"Built an IVF index of {collection.name} with {self._ivf_lists} lists over {len(slots)} points.")
+
+        return index
+
+    def _selected_ids(self, collection: _Collection, points_selector) -> list[str]:
+        if isinstance(points_selector, models.Filter):
+            points_selector = models.FilterSelector(filter=points_selector)
+        if isinstance(points_selector, models.FilterSelector):
+            mask = self._filter_mask(collection, points_selector.filter)
+            return [collection.slot_ids[slot] for slot in np.flatnonzero(mask)]
+        if isinstance(points_selector, models.PointIdsList):
+            return [str(_id) for _id in points_selector.points]
+        return [str(_id) for _id in points_selector]
+
+    def _filter_mask(self, collection: _Collection, query_filter: models.Filter | None) -> NDArray[np.bool_]:
+        alive = collection.alive_mask()
+        if query_filter is None:
+            return alive.copy()
+        return alive & self._evaluate_filter(collection, query_filter)
+
+    def _evaluate_filter(self, collection: _Collection, query_filter: models.Filter) -> NDArray[np.bool_]:
+        num_rows = len(collection.slot_ids)
+        mask = np.ones(num_rows, dtype=bool)
+        for condition in _as_list(query_filter.must):
+            mask &= self._evaluate_condition(collection, condition)
+        if query_filter.should:
+            should = np.zeros(num_rows, dtype=bool)
+            for condition in _as_list(query_filter.should):
+                should |= self._evaluate_condition(collection, condition)
+            mask &= should
+        for condition in _as_list(query_filter.must_not):
+            mask &= ~self._evaluate_condition(collection, condition)
+
+        return mask
+
+    def _evaluate_condition(self, collection: _Collection, condition) -> NDArray[np.bool_]:
+        num_rows = len(collection.slot_ids)
+        if isinstance(condition, models.Filter):
+            return self._evaluate_filter(collection, condition)
+
+        if isinstance(condition, models.HasIdCondition):
+            mask = np.zeros(num_rows, dtype=bool)
+            slots = [collection.ids[str(_id)] for _id in condition.has_id if str(_id) in collection.ids]
+            mask[slots] = True
+            return mask
+
+        if not isinstance(condition, models.FieldCondition):
+            raise NotImplementedError(f"Unsupported filter condition: {type(condition).__name__}")
+
+        match = condition.match
+        index = collection.payload_indexes.get(condition.key)
+        if isinstance(match, (models.MatchValue, models.MatchAny)) and index is not None:
+            # 有payload索引时直接查倒排表
+            values = [match.value] if isinstance(match, models.MatchValue) else match.any
+            mask = np.zeros(num_rows, dtype=bool)
+            for value in values:
+                mask[list(index.get(_hashable(value), ()))] = True
+            return mask
+
+        mask = np.zeros(num_rows, dtype=bool)
+        for slot, payload in enumerate(collection.payloads):
+            if payload is not None:
+                mask[slot] = _matches(_as_list(_get_value(payload, condition.key)), condition)
+        return mask
+
+    def _record(self, collection: _Collection, slot: int, with_payload, with_vectors) -> models.Record:
+        return models.Record(
+            id=collection.slot_ids[slot],
+            payload=self._payload(collection, slot, with_payload),
+            vector=self._vector(collection, slot, with_vectors),
+        )
+
+    @staticmethod
+    def _payload(collection: _Collection, slot: int, with_payload) -> dict | None:
+        if with_payload is False or with_payload is None:
+            return None
+        payload = collection.payloads[slot]
+        if isinstance(with_payload, list):
+            return {key: payload[key] for key in with_payload if key in payload}
+        return dict(payload)
+
+    @staticmethod
+    def _vector(collection: _Collection, slot: int, with_vectors):
+        if not with_vectors:
+            return None
+        vectors = {name: matrix.data[slot].tolist() for name, matrix in collection.vectors.items()}
+        if not collection.config["named"]:
+            return vectors.get("")
+        for name in collection.config["sparse_vectors"]:
+            vectors[name] = collection.sparse_vector(name, slot)
+        return vectors
+
+    @staticmethod
+    def _completed() -> models.UpdateResult:
+        return models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+
+
+def _top_k(
+    scores: NDArray[np.float32], mask: NDArray[np.bool_] | None, limit: int
+) -> tuple[NDArray[np.int64], NDArray[np.float32]]:
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+    limit = min(limit, len(scores))
+    if limit == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    top = np.argpartition(-scores, limit - 1)[:limit]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    top = top[np.isfinite(scores[top])]
+
+    return top, scores[top]
+
+
+def _reciprocal_rank_fusion(
+    rankings: list[tuple[NDArray[np.int64], NDArray[np.float32]]], limit: int
+) -> tuple[list[int], list[float]]:
+    fused = defaultdict(float)
+    for slots, _ in rankings:
+        for rank, slot in enumerate(slots):
+            # 与qdrant相同：score = sum(1 / (rank + 2))，rank从0开始
+            fused[int(slot)] += 1 / (rank + 2)
+
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [slot for slot, _ in ranked], [score for _, score in ranked]
+
+
+def _grown(mask: NDArray[np.bool_], capacity: int) -> NDArray[np.bool_]:
+    grown = np.zeros(capacity, dtype=bool)
+    grown[: len(mask)] = mask
+    return grown
+
+
+def _get_value(payload: dict, key: str):
+    value = payload
+    for part in key.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _hashable(value):
+    return str(value) if isinstance(value, UUID) else value
+
+
+def _matches(values: list, condition: models.FieldCondition) -> bool:
+    match = condition.match
+    if isinstance(match, models.MatchValue):
+        return _hashable(match.value) in values
+    if isinstance(match, models.MatchAny):
+        return any(_hashable(value) in values for value in match.any)
+    if isinstance(match, models.MatchExcept):
+        return not any(_hashable(value) in values for value in match.except_)
+    if isinstance(match, models.MatchText):
+        return any(isinstance(value, str) and match.text in value for value in values)
+    if condition.range is not None:
+        bounds = condition.range
+        return any(
+            isinstance(value, (int, float))
+            and (bounds.gt is None or value > bounds.gt)
+            and (bounds.gte is None or value >= bounds.gte)
+            and (bounds.lt is None or value < bounds.lt)
+            and (bounds.lte is None or value <= bounds.lte)
+            for value in values
+        )
+    if condition.is_empty is not None or condition.is_null is not None:
+        raise NotImplementedError("is_empty and is_null conditions are not supported")
+
+    raise NotImplementedError(f"Unsupported field condition on {condition.key}")
@@ -1,23 +1,83 @@
 import re
 
-def chunk_article(text: str, min_length: int, max_length: int) -> list[str]:
-    sentences = re.split(r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s", text)
-
-    extracts = []
-    current_chunk = ""
-    for sentence in sentences:
-        sentence = sentence.strip()
-        if not sentence:
-            continue
-
-        if len(current_chunk) + len(sentence) <= max_length:
-            current_chunk += sentence + " "
-        else:
-            if len(current_chunk) >= min_length:
-                extracts.append(current_chunk.strip())
-            current_chunk = sentence + " "
-
-    if len(current_chunk) >= min_length:
-        extracts.append(current_chunk.strip())
-
-    return extracts
+_SENTENCE_END_PATTERN = re.compile(r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s")
+
+
+def chunk_by_tokens(texts: list[str], tokenizer, max_tokens: int, overlap_tokens: int = 0) -> list[list[str]]:
+    """
+    Splits every text into chunks of at most ``max_tokens`` tokens of the given fast tokenizer.
+
+    All the texts are tokenized in one batch and every text is then chunked in a single linear pass over its
+    token offsets. A chunk preferably ends at a sentence end in the second half of its window, otherwise at
+    the last word boundary, and consecutive chunks share about ``overlap_tokens`` tokens. The trailing chunk
+    is always kept, however short.
+
+    Args:
+        texts (list[str]): The texts to chunk.
+        tokenizer: A Hugging Face fast tokenizer, which must support ``return_offsets_mapping``.
+        max_tokens (int): The maximum number of tokens per chunk, not counting special tokens.
+        overlap_tokens (int): The number of tokens shared by consecutive chunks.
+
+    Returns:
+        list[list[str]]: The chunks of every text.
+    """
+    assert 0 <= overlap_tokens < max_tokens, "overlap_tokens must be smaller than max_tokens."
+
+    encodings = tokenizer(
+        texts,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        return_attention_mask=False,
+        return_token_type_ids=False,
+        verbose=False,
+    )
+
+    return [
+        _chunk_offsets(text, offsets, encodings.word_ids(i), max_tokens, overlap_tokens)
+        for i, (text, offsets) in enumerate(zip(texts, encodings["offset_mapping"], strict=True))
+    ]
+
+
+def _chunk_offsets(
+    text: str, offsets: list[tuple[int, int]], word_ids: list[int | None], max_tokens: int, overlap_tokens: int
+) -> list[str]:
+    num_tokens = len(offsets)
+    if num_tokens == 0:
+        return []
+
+    sentence_ends = {match.start() for match in _SENTENCE_END_PATTERN.finditer(text)}
+
+    # last_sentence_end[i] / last_word_end[i]: 不超过i且可以在其后切分的最后一个token，-1表示没有
+    # next_word_start[i]: 不小于i的第一个单词开头的token
+    last_sentence_end = [-1] * num_tokens
+    last_word_end = [-1] * num_tokens
+    next_word_start = [num_tokens] * (num_tokens + 1)
+    for i in range(num_tokens):
+        is_word_end = i + 1 == num_tokens or word_ids[i + 1] != word_ids[i]
+        is_sentence_end = is_word_end and offsets[i][1] in sentence_ends
+        last_word_end[i] = i if is_word_end else last_word_end[i - 1] if i > 0 else -1
+        last_sentence_end[i] = i if is_sentence_end else last_sentence_end[i - 1] if i > 0 else -1
+    for i in range(num_tokens - 1, -1, -1):
+        is_word_start = i == 0 or word_ids[i - 1] != word_ids[i]
+        next_word_start[i] = i if is_word_start else next_word_start[i + 1]
+
+    chunks = []
+    start = 0
+    while start < num_tokens:
+        end = min(start + max_tokens, num_tokens)
+        if end < num_tokens:
+            if last_sentence_end[end - 1] >= start + max_tokens // 2:
+                end = last_sentence_end[end - 1] + 1
+            elif last_word_end[end - 1] >= start:
+                end = last_word_end[end - 1] + 1
+
+        chunks.append(text[offsets[start][0] : offsets[end - 1][1]])
+        if end == num_tokens:
+            break
+
+        # 重叠部分从单词开头开始，并且保证每次至少前进一个token
+        start = max(next_word_start[max(end - overlap_tokens, 0)], start + 1)
+        if start > end:
+            start = end
+
+    return chunks
@@ -6,7 +6,10 @@ from llmtwin.domain.chunk_document import ChunkArticle
 from typing import Generic, TypeVar
 import hashlib
 from uuid import UUID
-from llmtwin.preprocess.chunk_func import chunk_article
+from llmtwin.networks.embeddings import EmbeddingModelSingleton
+from llmtwin.domain.data_category import DataCategory
+from llmtwin.preprocess.chunk_func import chunk_by_tokens
+from llmtwin.preprocess.registry import HandlerRegistry
 
 
 CleanedDocumentT = TypeVar("CleanedDocumentT", bound=CleanedDocument)
@@ -18,26 +21,47 @@ class ChunkHandler(ABC, Generic[CleanedDocumentT, ChunkDocumentT]):
     def metadata(self) -> dict:
         pass
 
-    @abstractmethod
     def chunk(self, data_model: CleanedDocumentT) -> list[ChunkDocumentT]:
+        return self.chunk_batch([data_model])[0]
+
+    @abstractmethod
+    def chunk_batch(self, data_models: list[CleanedDocumentT]) -> list[list[ChunkDocumentT]]:
         pass
 
+chunk_handlers: HandlerRegistry[ChunkHandler] = HandlerRegistry("chunk")
+
+@chunk_handlers.register(DataCategory.Article)
 class ArticleChunkHandler(ChunkHandler):
+    # chunk之间重叠的token数
+    chunk_overlap: int = 32
+
     @property
     def metadata(self) -> dict:
+        # chunk的长度以embedding模型的token计，保证每个token都能被模型用到而不被截断
+        embedding_model = EmbeddingModelSingleton()
+        num_special_tokens = embedding_model.tokenizer.num_special_tokens_to_add(pair=False)
         return {
-            "min_length": 1000,
-            "max_length": 2000,
+            "embedding_model_id": embedding_model.model_id,
+            "chunk_size": embedding_model.max_input_length - num_special_tokens,
+            "chunk_overlap": self.chunk_overlap,
         }
 
-    def chunk(self, data_model: CleanedArticle) -> list[ChunkArticle]:
-        data_models_list = []
-
-        cleaned_content = data_model.content
-        chunks = chunk_article(
-            cleaned_content, min_length=self.metadata["min_length"], max_length=self.metadata["max_length"]
+    def chunk_batch(self, data_models: list[CleanedArticle]) -> list[list[ChunkArticle]]:
+        metadata = self.metadata
+        chunks_batch = chunk_by_tokens(
+            [data_model.content for data_model in data_models],
+            tokenizer=EmbeddingModelSingleton().tokenizer,
+            max_tokens=metadata["chunk_size"],
+            overlap_tokens=metadata["chunk_overlap"],
         )
 
+        return [
+            self._to_models(data_model, chunks, metadata)
+            for data_model, chunks in zip(data_models, chunks_batch, strict=True)
+        ]
+
+    def _to_models(self, data_model: CleanedArticle, chunks: list[str], metadata: dict) -> list[ChunkArticle]:
+        data_models_list = []
         for chunk in chunks:
             chunk_id = hashlib.md5(chunk.encode()).hexdigest()
             model = ChunkArticle(
@@ -48,7 +72,7 @@ class ArticleChunkHandler(ChunkHandler):
                 document_id=data_model.id,
                 author_id=data_model.author_id,
                 author_full_name=data_model.author_full_name,
-                metadata=self.metadata,
+                metadata=metadata,
             )
             data_models_list.append(model)
 
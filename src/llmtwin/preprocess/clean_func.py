@@ -1,8 +1,10 @@
 import re
 
+# 把不允许的字符替换为空格再合并连续空白，等价于把这两类字符组成的连续片段一次替换为单个空格
+_DISALLOWED_OR_SPACE_PATTERN = re.compile(r"[^\w.,!?]+")
+
 
 def clean_text(text: str) -> str:
-    text = re.sub(r"[^\w\s.,!?]", " ", text)
-    text = re.sub(r"\s+", " ", text)
+    text = _DISALLOWED_OR_SPACE_PATTERN.sub(" ", text)
 
     return text.strip()
@@ -2,8 +2,10 @@ from abc import ABC, abstractmethod
 
 from llmtwin.domain.base.nosql import BaseDocument
 from llmtwin.domain.cleaned_document import CleanedArticle, CleanedDocument
+from llmtwin.domain.data_category import DataCategory
 from llmtwin.domain.document import ArticleDocument
 from llmtwin.preprocess.clean_func import clean_text
+from llmtwin.preprocess.registry import HandlerRegistry
 
 class CleanHandler(ABC):
 
@@ -11,6 +13,9 @@ class CleanHandler(ABC):
     def clean(self, data_model: BaseDocument) -> CleanedDocument:
         pass
 
+clean_handlers: HandlerRegistry[CleanHandler] = HandlerRegistry("clean")
+
+@clean_handlers.register(DataCategory.Article)
 class ArticleCleanHandler(CleanHandler):
     def clean(self, data_model: ArticleDocument) -> CleanedArticle:
         # Implement the cleaning logic for ArticleDocument here
@@ -22,4 +27,10 @@ class ArticleCleanHandler(CleanHandler):
             author_id=data_model.author_id,
             author_full_name=data_model.author_full_name,
             link=data_model.link
-        )
\ No newline at end of file
+        )
+
+class CleanHandlerFactory:
+    @staticmethod
+    def create_handler(data_category: DataCategory) -> CleanHandler:
+        # 每个类别的handler只创建一次，之后复用
+        return clean_handlers.get(data_category)
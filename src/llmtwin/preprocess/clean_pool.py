@@ -0,0 +1,51 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import batched
+from typing import Iterable, Iterator
+
+from llmtwin.domain.base.nosql import BaseDocument
+from llmtwin.domain.cleaned_document import CleanedDocument
+from llmtwin.preprocess.clean_handler import CleanHandlerFactory
+
+
+def clean_batch(raw_documents: list[BaseDocument]) -> list[CleanedDocument]:
+    """
+    Cleans a batch of documents, reusing one handler per data category for the lifetime of the process.
+
+    This is the unit of work sent to the worker processes, and gives exactly the same output as
+    CleanDispatcher.dispatch without logging every document.
+    """
+    cleaned_documents = []
+    for document in raw_documents:
+        # handler由注册表在每个进程内缓存
+        handler = CleanHandlerFactory.create_handler(document.get_category())
+        cleaned_documents.append(handler.clean(document))
+    return cleaned_documents
+
+
+def clean_in_pool(
+    executor: Executor, raw_documents: Iterable[BaseDocument], chunk_size: int = 64, max_pending: int = 8
+) -> Iterator[CleanedDocument]:
+    """
+    Cleans the documents in the executor's worker processes, yielding them in input order.
+
+    Args:
+        executor (Executor): The process pool to clean in.
+        raw_documents (Iterable[BaseDocument]): The documents to clean.
+        chunk_size (int): The number of documents sent to a worker at a time.
+        max_pending (int): The maximum number of chunks submitted but not yet yielded, which bounds memory use.
+    """
+    pending = deque()
+    for chunk in batched(raw_documents, chunk_size):
+        pending.append(executor.submit(clean_batch, list(chunk)))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().result()
+
+    while pending:
+        yield from pending.popleft().result()
+
+
+def create_clean_pool(workers: int) -> ProcessPoolExecutor:
+    # 使用spawn而不是fork，避免复制父进程中已经打开的数据库连接
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
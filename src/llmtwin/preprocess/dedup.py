@@ -0,0 +1,350 @@
+import hashlib
+import re
+from itertools import combinations
+from math import comb
+from threading import Lock
+from typing import Literal
+from uuid import UUID
+
+import numpy as np
+from loguru import logger
+
+from llmtwin.domain.chunk_document import ChunkDocument
+from llmtwin.domain.chunk_link import ChunkLink
+from llmtwin.settings import settings
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+_SHINGLE_SIZE = 3
+_FINGERPRINT_BITS = 64
+_MAX_DISTANCE = 7
+# 每个最大距离下fingerprint分成的块数：块数越多，表的key越宽、候选越少，但表也越多
+_NUM_BLOCKS = {0: 1, 1: 2, 2: 3, 3: 4, 4: 6, 5: 7, 6: 8, 7: 9}
+# 最近加入的chunk先放在dict中，达到这个数量时合并进较小的有序表
+_MAX_RECENT = 1024
+# 较小的有序表达到窗口的这个比例时，合并进主有序表
+_RECENT_FRACTION = 32
+
+
+def simhash(text: str) -> int:
+    """
+    Returns the 64-bit SimHash of the word 3-gram shingles of a text.
+
+    Texts sharing most of their shingles get fingerprints differing in a few bits only, so near-duplicates
+    are found by the Hamming distance of their fingerprints.
+    """
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    if not tokens:
+        return 0
+
+    shingles = [" ".join(tokens[i : i + _SHINGLE_SIZE]) for i in range(max(1, len(tokens) - _SHINGLE_SIZE + 1))]
+    digests = b"".join(hashlib.blake2b(shingle.encode(), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    # 每一位取多数票
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+class _SortedTables:
+    """The keys of some slots of the ring in every table of a ChunkDeduplicator, sorted, with their slots."""
+
+    def __init__(self, num_tables: int, key_dtype: type) -> None:
+        self.keys = [np.zeros(0, dtype=key_dtype) for _ in range(num_tables)]
+        self.slots = [np.zeros(0, dtype=np.uint32) for _ in range(num_tables)]
+
+    def __len__(self) -> int:
+        return len(self.slots[0])
+
+    def candidates(self, table_keys: list[np.ndarray], queries: list[np.ndarray], slots: list[np.ndarray]) -> None:
+        """Appends the (query, slot) pairs of the slots sharing the key of a query in some table."""
+        for query_keys, keys, sorted_slots in zip(table_keys, self.keys, self.slots):
+            starts, ends = keys.searchsorted(query_keys, "left"), keys.searchsorted(query_keys, "right")
+            counts = ends - starts
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            # 每个查询的候选是有序数组中的一段，展开成(查询, 位置)对
+            group_starts = np.cumsum(counts) - counts
+            positions = np.arange(total) - np.repeat(group_starts - starts, counts)
+            queries.append(np.repeat(np.arange(len(query_keys)), counts))
+            slots.append(sorted_slots[positions])
+
+    def insert(self, table_keys: list[np.ndarray], table_slots: list[np.ndarray], replaced: np.ndarray | None) -> None:
+        """Inserts slots with their key in every table, after dropping the entries of the ``replaced`` slots."""
+        for index, (new_keys, new_slots) in enumerate(zip(table_keys, table_slots)):
+            keys, slots = self.keys[index], self.slots[index]
+            if replaced is not None:
+                keep = ~replaced[slots]
+                keys, slots = keys[keep], slots[keep]
+            order = new_keys.argsort(kind="stable")
+            new_keys = new_keys[order]
+            # 有序数组只需要插入，不需要重新排序
+            positions = keys.searchsorted(new_keys)
+            self.keys[index] = np.insert(keys, positions, new_keys)
+            self.slots[index] = np.insert(slots, positions, new_slots[order])
+
+
+class ChunkDeduplicator:
+    """
+    Drops the chunks that are exact or near duplicates of a chunk seen before, so they are not embedded again.
+
+    Exact duplicates share their id, the md5 of their content, and near duplicates are found by the Hamming
+    distance of their SimHash fingerprints. Only the last ``max_entries`` kept chunks are indexed.
+
+    Args:
+        mode (Literal["skip", "link"]): "skip" drops the duplicates, "link" also returns a ChunkLink from
+            every duplicate to its canonical chunk.
+        max_distance (int): The largest Hamming distance between the fingerprints of near duplicates.
+        max_entries (int): The number of chunks kept in the index.
+    """
+
+    def __init__(
+        self,
+        mode: Literal["skip", "link"] = "skip",
+        max_distance: int = settings.CHUNK_DEDUP_MAX_DISTANCE,
+        max_entries: int = settings.CHUNK_DEDUP_MAX_ENTRIES,
+    ) -> None:
+        if not 0 <= max_distance <= _MAX_DISTANCE:
+            raise ValueError(f"max_distance must be between 0 and {_MAX_DISTANCE}, got {max_distance}")
+        if max_entries <= 0:
+            raise ValueError(f"max_entries must be positive, got {max_entries}")
+
+        self.mode = mode
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.num_exact_duplicates = 0
+        self.num_near_duplicates = 0
+
+        num_blocks = _NUM_BLOCKS[max_distance]
+        bounds = [round(i * _FINGERPRINT_BITS / num_blocks) for i in range(num_blocks + 1)]
+        blocks = [(start, end - start) for start, end in zip(bounds, bounds[1:])]
+        # 置换表：指纹分成num_blocks块，距离不超过max_distance的两个指纹至少有num_blocks - max_distance块相同。
+        # 每种块的组合拼成一个表的key，只比较key相同的chunk，每个chunk约与num_tables * max_entries / 2 ** key_bits
+        # 个chunk比较。每个表是环中key的有序数组，新加入的chunk先放在dict中，再分两级合并进有序表
+        self._tables = [list(table) for table in combinations(blocks, num_blocks - max_distance)]
+        assert len(self._tables) == comb(num_blocks, max_distance)
+        key_bits = max(sum(width for _, width in table) for table in self._tables)
+        self._key_dtype = np.uint32 if key_bits <= 32 else np.uint64
+
+        # 环形缓冲区，满了以后覆盖最早的chunk
+        self._fingerprints = np.zeros(max_entries, dtype=np.uint64)
+        self._ids = np.zeros((max_entries, 2), dtype=np.uint64)
+        self._document_ids = np.zeros((max_entries, 2), dtype=np.uint64)
+        self._size = 0
+        self._next_slot = 0
+        # 被覆盖的slot在合并之前仍以旧的key留在有序表中
+        self._sorted = _SortedTables(len(self._tables), self._key_dtype)
+        self._sorted_recent = _SortedTables(len(self._tables), self._key_dtype)
+        # 还没有合并的chunk：每个表一个dict，key -> slot，或多个slot时的list
+        self._recent_buckets: list[dict[int, int | list[int]]] = [{} for _ in self._tables]
+        self._recent_slots: list[int] = []
+        self._lock = Lock()
+
+    def fingerprint(self, chunk: ChunkDocument) -> int:
+        if self.max_distance == 0:
+            return chunk.id.int & ((1 << _FINGERPRINT_BITS) - 1)
+        return simhash(chunk.content)
+
+    def deduplicate(
+        self, chunks_batch: list[list[ChunkDocument]]
+    ) -> tuple[list[list[ChunkDocument]], list[ChunkLink], list[list[UUID]]]:
+        """
+        Removes the duplicates from the chunks of a batch of documents.
+
+        Args:
+            chunks_batch (list[list[ChunkDocument]]): The chunks of every document.
+
+        Returns:
+            tuple[list[list[ChunkDocument]], list[ChunkLink], list[list[UUID]]]: The kept chunks of every
+                document, in "link" mode the links from the dropped chunks to their canonical chunks, and the
+                ids of the canonical chunks of every document's dropped chunks, whose points it shares.
+        """
+        fingerprints = [[self.fingerprint(chunk) for chunk in chunks] for chunks in chunks_batch]
+
+        flat_fingerprints = np.array(
+            [fingerprint for chunk_fingerprints in fingerprints for fingerprint in chunk_fingerprints], dtype=np.uint64
+        )
+        # 每个chunk在每个表中的key，批次一起计算
+        table_keys = [self._table_keys(table, flat_fingerprints) for table in self._tables]
+        chunk_keys = iter(np.stack(table_keys, axis=1).tolist())
+
+        kept_batch, links, duplicate_ids_batch = [], [], []
+        with self._lock:
+            indexed_duplicates = iter(
+                self._find_indexed(
+                    [chunk.id for chunks in chunks_batch for chunk in chunks], flat_fingerprints, table_keys
+                )
+            )
+            for chunks, chunk_fingerprints in zip(chunks_batch, fingerprints, strict=True):
+                kept, duplicate_ids = [], []
+                for chunk, fingerprint in zip(chunks, chunk_fingerprints, strict=True):
+                    keys = next(chunk_keys)
+                    duplicate = self._closest(
+                        chunk.id, next(indexed_duplicates), self._find_recent(chunk.id, fingerprint, keys)
+                    )
+                    if duplicate is None:
+                        self._add(chunk, fingerprint, keys)
+                        kept.append(chunk)
+                        continue
+
+                    canonical_id, canonical_document_id, distance = duplicate
+                    if distance == 0 and canonical_id == chunk.id:
+                        self.num_exact_duplicates += 1
+                        # 同一文档中重复的段落与原chunk是同一个点，不需要链接
+                        if canonical_document_id == chunk.document_id:
+                            continue
+                    else:
+                        self.num_near_duplicates += 1
+                    duplicate_ids.append(canonical_id)
+                    if self.mode == "link":
+                        links.append(self._link(chunk, canonical_id, distance))
+                kept_batch.append(kept)
+                duplicate_ids_batch.append(list(dict.fromkeys(duplicate_ids)))
+
+            # 批次中的查找都基于批次开始时的有序表，批次结束后才合并
+            if len(self._recent_slots) >= min(self.max_entries, _MAX_RECENT):
+                self._merge_recent()
+
+        return kept_batch, links, duplicate_ids_batch
+
+    def log_stats(self) -> None:
+        logger.info(
+            "Deduplicated chunks.",
+            exact_duplicates=self.num_exact_duplicates,
+            near_duplicates=self.num_near_duplicates,
+            indexed_chunks=self._size,
+        )
+
+    def _find_indexed(
+        self, chunk_ids: list[UUID], query_fingerprints: np.ndarray, table_keys: list[np.ndarray]
+    ) -> list[tuple[UUID, UUID, int] | None]:
+        """Looks up a batch of chunks in the sorted tables, returning the closest indexed chunk of each."""
+        duplicates = [None] * len(chunk_ids)
+        queries, slots = [], []
+        for sorted_tables in (self._sorted, self._sorted_recent):
+            if chunk_ids and len(sorted_tables):
+                sorted_tables.candidates(table_keys, queries, slots)
+        if not queries:
+            return duplicates
+
+        # 同一个slot可能出现在多个表中，重复比较不影响结果
+        query, slot = np.concatenate(queries), np.concatenate(slots)
+        distances = np.bitwise_count(self._fingerprints[slot] ^ query_fingerprints[query])
+        same_id = distances == 0
+        if same_id.any():
+            query_ids = np.array([(_id.int >> 64, _id.int & 0xFFFFFFFFFFFFFFFF) for _id in chunk_ids], dtype=np.uint64)
+            candidates = np.flatnonzero(same_id)
+            same_id[candidates] = (self._ids[slot[candidates]] == query_ids[query[candidates]]).all(axis=1)
+
+        matches = same_id if self.max_distance == 0 else distances <= self.max_distance
+        query, slot, distances, same_id = query[matches], slot[matches], distances[matches], same_id[matches]
+        # 每个查询取相同的chunk，否则取距离最近的
+        order = np.lexsort((distances, ~same_id, query))
+        query, slot, distances = query[order], slot[order], distances[order]
+        first = np.flatnonzero(np.r_[True, query[1:] != query[:-1]]) if len(query) else query
+        for index in first:
+            slot_index = slot[index]
+            duplicates[query[index]] = (
+                self._uuid(self._ids[slot_index]),
+                self._uuid(self._document_ids[slot_index]),
+                int(distances[index]),
+            )
+
+        return duplicates
+
+    def _find_recent(self, chunk_id: UUID, fingerprint: int, keys: list[int]) -> tuple[UUID, UUID, int] | None:
+        id_high, id_low = chunk_id.int >> 64, chunk_id.int & 0xFFFFFFFFFFFFFFFF
+        best = None
+        for key, buckets in zip(keys, self._recent_buckets):
+            slots = buckets.get(key)
+            if slots is None:
+                continue
+            for slot in [slots] if isinstance(slots, int) else slots:
+                if self._ids[slot, 0] == id_high and self._ids[slot, 1] == id_low:
+                    return chunk_id, self._uuid(self._document_ids[slot]), 0
+                if self.max_distance == 0:
+                    continue
+                # 被覆盖的slot里是另一个仍在窗口内的chunk，照样比较距离即可
+                distance = (int(self._fingerprints[slot]) ^ fingerprint).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[2]):
+                    best = (self._uuid(self._ids[slot]), self._uuid(self._document_ids[slot]), distance)
+
+        return best
+
+    @staticmethod
+    def _closest(
+        chunk_id: UUID, indexed: tuple[UUID, UUID, int] | None, recent: tuple[UUID, UUID, int] | None
+    ) -> tuple[UUID, UUID, int] | None:
+        if indexed is None or recent is None:
+            return indexed or recent
+        # id相同的是完全相同的chunk，优先于其他距离为0的候选
+        return min(indexed, recent, key=lambda duplicate: (duplicate[2], duplicate[0] != chunk_id))
+
+    def _add(self, chunk: ChunkDocument, fingerprint: int, keys: list[int]) -> None:
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.max_entries
+        self._size = min(self._size + 1, self.max_entries)
+
+        self._fingerprints[slot] = fingerprint
+        self._ids[slot] = (chunk.id.int >> 64, chunk.id.int & 0xFFFFFFFFFFFFFFFF)
+        self._document_ids[slot] = (chunk.document_id.int >> 64, chunk.document_id.int & 0xFFFFFFFFFFFFFFFF)
+
+        for key, buckets in zip(keys, self._recent_buckets):
+            slots = buckets.get(key)
+            if slots is None:
+                buckets[key] = slot
+            elif isinstance(slots, int):
+                buckets[key] = [slots, slot]
+            else:
+                slots.append(slot)
+        self._recent_slots.append(slot)
+
+    def _merge_recent(self) -> None:
+        """Moves the chunks of the dicts into the smaller sorted tables, and these into the main ones when full."""
+        recent = np.unique(np.array(self._recent_slots, dtype=np.uint32))
+        # slot是按环的顺序分配的，两部分的slot只有在加起来超过整个环时才会重叠
+        overlaps = len(self._sorted_recent) + len(self._recent_slots) > self.max_entries
+        recent_fingerprints = self._fingerprints[recent]
+        self._sorted_recent.insert(
+            [self._table_keys(table, recent_fingerprints) for table in self._tables],
+            [recent] * len(self._tables),
+            self._slot_mask(recent) if overlaps else None,
+        )
+        self._recent_buckets = [{} for _ in self._tables]
+        self._recent_slots = []
+
+        if len(self._sorted_recent) >= min(self.max_entries, max(_MAX_RECENT, self._size // _RECENT_FRACTION)):
+            # 较小的有序表中的slot覆盖了主有序表中的同一个slot
+            self._sorted.insert(
+                self._sorted_recent.keys, self._sorted_recent.slots, self._slot_mask(self._sorted_recent.slots[0])
+            )
+            self._sorted_recent = _SortedTables(len(self._tables), self._key_dtype)
+
+    def _slot_mask(self, slots: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.max_entries, dtype=bool)
+        mask[slots] = True
+        return mask
+
+    def _table_keys(self, table: list[tuple[int, int]], fingerprints: np.ndarray) -> np.ndarray:
+        keys = np.zeros(len(fingerprints), dtype=np.uint64)
+        for shift, width in table:
+            block = (fingerprints >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            keys = (keys << np.uint64(width)) | block
+        return keys.astype(self._key_dtype)
+
+    def _link(self, chunk: ChunkDocument, canonical_id: UUID, distance: int) -> ChunkLink:
+        link_id = hashlib.md5(f"{chunk.document_id}:{chunk.id}".encode()).hexdigest()
+        return ChunkLink(
+            _id=UUID(link_id, version=4),
+            chunk_id=chunk.id,
+            canonical_id=canonical_id,
+            document_id=chunk.document_id,
+            author_id=chunk.author_id,
+            platform=chunk.platform,
+            link=getattr(chunk, "link", None),
+            distance=distance,
+        )
+
+    @staticmethod
+    def _uuid(halves: np.ndarray) -> UUID:
+        return UUID(int=(int(halves[0]) << 64) | int(halves[1]))
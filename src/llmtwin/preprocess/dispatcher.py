@@ -3,9 +3,11 @@ from llmtwin.domain.cleaned_document import CleanedDocument
 from llmtwin.domain.chunk_document import ChunkDocument
 from llmtwin.domain.embed_document import EmbedDocument
 from llmtwin.domain.data_category import DataCategory
-from llmtwin.preprocess.clean_handler import ArticleCleanHandler, CleanHandler
-from llmtwin.preprocess.chunk_handler import ArticleChunkHandler, ChunkHandler, CleanedDocumentT
-from llmtwin.preprocess.embed_handler import ArticleEmbedHandler, EmbedHandler
+from llmtwin.metrics import log_sampled, metrics
+from llmtwin.networks.embeddings import EmbeddingError
+from llmtwin.preprocess.clean_handler import CleanHandlerFactory
+from llmtwin.preprocess.chunk_handler import ChunkHandler, CleanedDocumentT, chunk_handlers
+from llmtwin.preprocess.embed_handler import EmbedHandler, embed_handlers, embed_texts, shutdown_embedding_pool
 from typing import Generic, TypeVar
 from loguru import logger
 
@@ -14,14 +16,6 @@ CleanedDocumentT = TypeVar("CleanedDocumentT", bound=CleanedDocument)
 ChunkDocumentT = TypeVar("ChunkDocumentT", bound=ChunkDocument)
 EmbedDocumentT = TypeVar("EmbedDocumentT", bound=EmbedDocument)
 
-class CleanHandlerFactory:
-    @staticmethod
-    def create_handler(data_category: DataCategory) -> CleanHandler:
-        if data_category == DataCategory.Article:
-            return ArticleCleanHandler()
-        else:
-            raise ValueError("Unsupported data type")
-
 class CleanDispatcher(Generic[DocumentT, CleanedDocumentT]):
     factory = CleanHandlerFactory()
 
@@ -29,9 +23,12 @@ class CleanDispatcher(Generic[DocumentT, CleanedDocumentT]):
     def dispatch(cls, data_model: DocumentT) -> CleanedDocumentT:
         data_category = data_model.get_category()
         handler = cls.factory.create_handler(data_category)
-        clean_model = handler.clean(data_model)
+        with metrics.track("clean", data_category=data_category) as timer:
+            clean_model = handler.clean(data_model)
+            timer.nbytes = len(clean_model.content)
 
-        logger.info(
+        # 每个文档都写日志会拖慢清洗，只按比例抽样
+        log_sampled(
             "Document cleaned successfully.",
             data_category=data_category,
             cleaned_content_len=len(clean_model.content),
@@ -42,8 +39,7 @@ class CleanDispatcher(Generic[DocumentT, CleanedDocumentT]):
 class ChunkHandlerFactory:
     @staticmethod
     def create_handler(data_category: DataCategory) -> ChunkHandler:
-        if data_category == DataCategory.Article:
-            return ArticleChunkHandler()
+        return chunk_handlers.get(data_category)
     
 class ChunkDispatcher(Generic[CleanedDocumentT, ChunkDocumentT]):
     factory = ChunkHandlerFactory()
@@ -52,7 +48,9 @@ class ChunkDispatcher(Generic[CleanedDocumentT, ChunkDocumentT]):
     def dispatch(cls, cleaned_document: CleanedDocumentT) -> list[ChunkDocumentT]:
         data_category = cleaned_document.get_category()
         handler = cls.factory.create_handler(data_category)
-        chunked_documents = handler.chunk(cleaned_document)
+        with metrics.track("chunk", nbytes=len(cleaned_document.content), data_category=data_category):
+            chunked_documents = handler.chunk(cleaned_document)
+        metrics.increment("chunks_total", len(chunked_documents), stage="chunk", data_category=data_category)
         # logger.info(
         #     "Document chunked successfully.",
         #     num=len(chunked_documents),
@@ -60,18 +58,50 @@ class ChunkDispatcher(Generic[CleanedDocumentT, ChunkDocumentT]):
         # )
 
         return chunked_documents
+
+    @classmethod
+    def dispatch_batch(cls, cleaned_documents: list[CleanedDocumentT]) -> list[list[ChunkDocumentT]]:
+        """Chunks the documents, tokenizing all the documents of a category in one batch."""
+        positions_by_category: dict[DataCategory, list[int]] = {}
+        for i, cleaned_document in enumerate(cleaned_documents):
+            positions_by_category.setdefault(cleaned_document.get_category(), []).append(i)
+
+        chunked_documents = [[] for _ in cleaned_documents]
+        for data_category, positions in positions_by_category.items():
+            handler = cls.factory.create_handler(data_category)
+            documents = [cleaned_documents[i] for i in positions]
+            with metrics.track(
+                "chunk",
+                items=len(documents),
+                nbytes=sum(len(document.content) for document in documents),
+                data_category=data_category,
+            ):
+                chunks_batch = handler.chunk_batch(documents)
+            metrics.increment(
+                "chunks_total", sum(len(chunks) for chunks in chunks_batch), stage="chunk", data_category=data_category
+            )
+            for i, chunks in zip(positions, chunks_batch, strict=True):
+                chunked_documents[i] = chunks
+
+        return chunked_documents
     
 class EmbedHandlerFactory:
     @staticmethod
     def create_handler(data_category: DataCategory) -> EmbedHandler:
-        if data_category == DataCategory.Article:
-            return ArticleEmbedHandler()
+        return embed_handlers.get(data_category)
     
 class EmbedDispatcher(Generic[ChunkDocumentT, EmbedDocumentT]):
     factory = EmbedHandlerFactory()
 
     @ classmethod
     def dispatch(cls, chunked_document: list[ChunkDocumentT]) -> list[EmbedDocumentT]:
+        """
+        Embeds the chunks, which may be of different categories, returning them in input order without the
+        chunks whose embedding failed.
+
+        Raises:
+            EmbeddingError: If a single chunk is passed and its embedding could not be generated.
+        """
         is_list = isinstance(chunked_document, list)
         if not is_list:
             chunked_document = [chunked_document]
@@ -79,20 +109,88 @@ class EmbedDispatcher(Generic[ChunkDocumentT, EmbedDocumentT]):
         if len(chunked_document) == 0:
             return []
 
-        data_category = chunked_document[0].get_category()
-        assert all(
-            data_model.get_category() == data_category for data_model in chunked_document
-        ), "Data models must be of the same category."
-        handler = cls.factory.create_handler(data_category)
+        positions_by_category: dict[DataCategory, list[int]] = {}
+        for i, data_model in enumerate(chunked_document):
+            positions_by_category.setdefault(data_model.get_category(), []).append(i)
+        # 在调用模型之前取handler，不支持的类别不会白白做一次嵌入
+        handlers = {data_category: cls.factory.create_handler(data_category) for data_category in positions_by_category}
 
-        embedded_chunk_model = handler.embed_batch(chunked_document)
+        if len(positions_by_category) == 1:
+            data_category, handler = next(iter(handlers.items()))
+            embedded_chunk_model = cls._embed(handler, data_category, chunked_document)
+        else:
+            embedded_chunk_model = cls._embed_mixed(handlers, positions_by_category, chunked_document)
 
         if not is_list:
+            if not embedded_chunk_model:
+                raise EmbeddingError(f"Could not generate the embedding of chunk {chunked_document[0].id}.")
             embedded_chunk_model = embedded_chunk_model[0]
 
         logger.info(
             "Data embedded successfully.",
-            data_category=data_category,
+            data_categories=list(positions_by_category),
         )
 
         return embedded_chunk_model
+
+    @staticmethod
+    def _embed(handler: EmbedHandler, data_category: DataCategory, chunks: list[ChunkDocumentT]) -> list[EmbedDocumentT]:
+        with metrics.track(
+            "embed",
+            items=len(chunks),
+            nbytes=sum(len(data_model.content) for data_model in chunks),
+            data_category=data_category,
+        ):
+            embedded_chunks = handler.embed_batch(chunks)
+            # 嵌入失败的chunk会被丢弃
+            metrics.increment(
+                "embed_failures_total",
+                len(chunks) - len(embedded_chunks),
+                stage="embed",
+                data_category=data_category,
+            )
+
+        return embedded_chunks
+
+    @staticmethod
+    def _embed_mixed(
+        handlers: dict[DataCategory, EmbedHandler],
+        positions_by_category: dict[DataCategory, list[int]],
+        chunks: list[ChunkDocumentT],
+    ) -> list[EmbedDocumentT]:
+        """
+        Embeds the chunks of all the categories in one model call, so the model batches stay full, then builds
+        the embedded chunks of every category with its handler and puts them back in input order.
+        """
+        with metrics.track(
+            "embed",
+            items=len(chunks),
+            nbytes=sum(len(data_model.content) for data_model in chunks),
+            data_category="mixed",
+        ):
+            embeddings, failed = embed_texts([data_model.content for data_model in chunks])
+
+        embedded_by_category = {}
+        for data_category, positions in positions_by_category.items():
+            category_failed = failed[positions]
+            with metrics.track("embed.map", items=len(positions), data_category=data_category):
+                embedded_by_category[data_category] = iter(
+                    handlers[data_category].from_embeddings(
+                        [chunks[i] for i in positions], embeddings[positions], category_failed
+                    )
+                )
+            metrics.increment(
+                "embed_failures_total", int(category_failed.sum()), stage="embed", data_category=data_category
+            )
+
+        # 每个类别的结果保持输入中的相对顺序，且只丢弃了失败的chunk，按输入顺序依次取回即可
+        return [
+            next(embedded_by_category[data_model.get_category()])
+            for data_model, is_failed in zip(chunks, failed, strict=True)
+            if not is_failed
+        ]
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Stops the embedding process pool, if one was started. It is also stopped at interpreter exit."""
+        shutdown_embedding_pool()
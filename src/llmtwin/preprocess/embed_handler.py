@@ -1,16 +1,140 @@
+import atexit
+import hashlib
 from abc import ABC, abstractmethod
+from threading import Lock
 
 from llmtwin.domain.chunk_document import ChunkArticle, ChunkDocument
+from llmtwin.domain.data_category import DataCategory
 from llmtwin.domain.embed_document import EmbedDocument, EmbedArticle
 
-from typing import Generic, TypeVar, cast
+from typing import Generic, TypeVar
 
-from llmtwin.networks.embeddings import EmbeddingModelSingleton
+import numpy as np
+from loguru import logger
+from numpy.typing import NDArray
+
+from llmtwin.networks.embedding_cache import EmbeddingCache
+from llmtwin.networks.embedding_pool import EmbeddingProcessPool
+from llmtwin.networks.embeddings import EmbeddingError, EmbeddingModelSingleton
+from llmtwin.networks.sparse import get_bm25_encoder
+from llmtwin.preprocess.registry import HandlerRegistry
+from llmtwin.settings import settings
 
 ChunkT = TypeVar("ChunkT", bound=ChunkDocument)
 EmbeddedChunkT = TypeVar("EmbeddedChunkT", bound=EmbedDocument)
 
-embedding_model = EmbeddingModelSingleton()
+_embedding_cache: EmbeddingCache | None = None
+_embedding_cache_lock = Lock()
+
+_embedding_pool: EmbeddingProcessPool | None = None
+_embedding_pool_lock = Lock()
+
+
+def get_embedding_model() -> EmbeddingModelSingleton:
+    """Returns the embedding model, loading it on first use rather than when this module is imported."""
+
+    return EmbeddingModelSingleton()
+
+
+def get_embedding_cache() -> EmbeddingCache | None:
+    """Returns the embedding cache, opening it on first use, or None if it is disabled in the settings."""
+
+    global _embedding_cache
+
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return None
+
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            embedding_model = get_embedding_model()
+            # 不同后端和量化方式生成的向量不同，不能互相复用
+            variant = embedding_model.backend
+            if variant == "onnx" and settings.RAG_ONNX_QUANTIZE:
+                variant = "onnx-int8"
+            _embedding_cache = EmbeddingCache(
+                cache_dir=settings.EMBEDDING_CACHE_DIR,
+                model_id=embedding_model.model_id,
+                embedding_size=embedding_model.embedding_size,
+                max_size_mb=settings.EMBEDDING_CACHE_MAX_SIZE_MB,
+                variant=variant,
+            )
+        return _embedding_cache
+
+
+def get_embedding_pool() -> EmbeddingProcessPool | None:
+    """Returns the embedding process pool, starting it on first use, or None if it is disabled in the settings."""
+
+    global _embedding_pool
+
+    if not settings.EMBEDDING_POOL_ENABLED:
+        return None
+
+    with _embedding_pool_lock:
+        if _embedding_pool is None:
+            embedding_model = get_embedding_model()
+            _embedding_pool = EmbeddingProcessPool(
+                model_id=embedding_model.model_id,
+                embedding_size=embedding_model.embedding_size,
+                num_workers=settings.EMBEDDING_POOL_WORKERS,
+                threads_per_worker=settings.EMBEDDING_POOL_THREADS_PER_WORKER,
+                backend=embedding_model.backend,
+                onnx_options={
+                    "cache_dir": settings.RAG_ONNX_CACHE_DIR,
+                    "quantize": settings.RAG_ONNX_QUANTIZE,
+                    "tolerance": settings.RAG_ONNX_PARITY_TOLERANCE,
+                },
+            )
+        return _embedding_pool
+
+
+@atexit.register
+def shutdown_embedding_pool() -> None:
+    global _embedding_pool
+
+    with _embedding_pool_lock:
+        if _embedding_pool is not None:
+            _embedding_pool.shutdown()
+            _embedding_pool = None
+
+
+def _encode(texts: list[str]) -> tuple[NDArray[np.float32], NDArray[np.bool_]]:
+    pool = get_embedding_pool()
+    encoder = pool if pool is not None else get_embedding_model()
+
+    return encoder.encode_batched(texts, batch_size=settings.EMBEDDING_BATCH_SIZE)
+
+
+def embed_texts(texts: list[str]) -> tuple[NDArray[np.float32], NDArray[np.bool_]]:
+    """
+    Embeds the texts, only running the model on the ones missing from the embedding cache.
+
+    Args:
+        texts (list[str]): The texts to embed.
+
+    Returns:
+        tuple[NDArray[np.float32], NDArray[np.bool_]]: A (len(texts), embedding_size) matrix of embeddings,
+            and a mask of the texts that could not be embedded.
+    """
+
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is None:
+        return _encode(texts)
+
+    keys = [hashlib.md5(text.encode()).hexdigest() for text in texts]
+    embeddings, found = embedding_cache.get_many(keys)
+    failed = np.zeros(len(texts), dtype=bool)
+
+    missing = np.flatnonzero(~found)
+    if len(missing) > 0:
+        new_embeddings, new_failed = _encode([texts[i] for i in missing])
+        embeddings[missing] = new_embeddings
+        failed[missing] = new_failed
+
+        succeeded = ~new_failed
+        embedding_cache.put_many([keys[i] for i in missing[succeeded]], new_embeddings[succeeded])
+
+    return embeddings, failed
+
 
 class EmbedHandler(ABC, Generic[ChunkT, EmbeddedChunkT]):
     """
@@ -19,27 +143,67 @@ class EmbedHandler(ABC, Generic[ChunkT, EmbeddedChunkT]):
     """
 
     def embed(self, data_model: ChunkT) -> EmbeddedChunkT:
-        return self.embed_batch([data_model])[0]
+        """
+        Raises:
+            EmbeddingError: If the embedding of the chunk could not be generated.
+        """
+        embedded_chunk = self.embed_batch([data_model])
+        if not embedded_chunk:
+            raise EmbeddingError(f"Could not generate the embedding of chunk {data_model.id}.")
+
+        return embedded_chunk[0]
 
     def embed_batch(self, data_model: list[ChunkT]) -> list[EmbeddedChunkT]:
         embedding_model_input = [data_model.content for data_model in data_model]
-        embeddings = embedding_model(embedding_model_input, to_list=True)
+        embeddings, failed = embed_texts(embedding_model_input)
+
+        return self.from_embeddings(data_model, embeddings, failed)
 
+    def from_embeddings(
+        self, data_model: list[ChunkT], embeddings: NDArray[np.float32], failed: NDArray[np.bool_]
+    ) -> list[EmbeddedChunkT]:
+        """
+        Builds the embedded chunks from embeddings computed beforehand, e.g. in one model call for the chunks of
+        several categories. The chunks whose embedding failed are dropped, the others keep their order.
+        """
+        if failed.any():
+            logger.error(f"Dropping {failed.sum()} of {len(data_model)} chunks whose embedding could not be generated.")
+            data_model = [data_model for data_model, is_failed in zip(data_model, failed, strict=True) if not is_failed]
+            embeddings = embeddings[~failed]
+
+        # 所有文档共享同一个连续的float32矩阵，每个文档只持有其中一行的视图
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
         embedded_chunk = [
-            self.map_model(data_model, cast(list[float], embedding))
-            for data_model, embedding in zip(data_model, embeddings, strict=False)
+            self.map_model(data_model, embedding) for data_model, embedding in zip(data_model, embeddings, strict=True)
         ]
+        if embedded_chunk and embedded_chunk[0].use_sparse_vectors():
+            self._add_sparse_embeddings(embedded_chunk)
 
         return embedded_chunk
 
+    @staticmethod
+    def _add_sparse_embeddings(embedded_chunk: list[EmbeddedChunkT]) -> None:
+        # BM25统计量随着索引的chunk增量更新，查询时使用保存下来的统计量；重新embedding的chunk不重复统计
+        encoder = get_bm25_encoder(embedded_chunk[0].get_collection_name())
+        texts = [chunk.content for chunk in embedded_chunk]
+        encoder.partial_fit(texts, ids=[chunk.id for chunk in embedded_chunk])
+        for chunk, sparse_embedding in zip(embedded_chunk, encoder.encode_documents(texts), strict=True):
+            chunk.sparse_embedding = sparse_embedding
+
     @abstractmethod
-    def map_model(self, data_model: ChunkT, embedding: list[float]) -> EmbeddedChunkT:
+    def map_model(self, data_model: ChunkT, embedding: NDArray[np.float32]) -> EmbeddedChunkT:
         pass
 
 
+embed_handlers: HandlerRegistry[EmbedHandler] = HandlerRegistry("embed")
+
+
+@embed_handlers.register(DataCategory.Article)
 class ArticleEmbedHandler(EmbedHandler):
-    def map_model(self, data_model: ChunkArticle, embedding: list[float]) -> EmbedArticle:
-        return EmbedArticle(
+    def map_model(self, data_model: ChunkArticle, embedding: NDArray[np.float32]) -> EmbedArticle:
+        embedding_model = get_embedding_model()
+        # chunk的字段已经校验过，这里跳过校验，embedding也不会被复制
+        return EmbedArticle.model_construct(
             id=data_model.id,
             content=data_model.content,
             embedding=embedding,
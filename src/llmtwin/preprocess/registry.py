@@ -0,0 +1,56 @@
+from threading import Lock
+from typing import Callable, Generic, TypeVar
+
+from llmtwin.domain.data_category import DataCategory
+
+HandlerT = TypeVar("HandlerT")
+
+
+class HandlerRegistry(Generic[HandlerT]):
+    """
+    The handlers of a preprocessing step keyed by data category.
+
+    Every handler is created once, on first use, and the same instance is reused for every document of its
+    category, so handlers must not keep per-document state.
+    """
+
+    def __init__(self, step: str) -> None:
+        self.step = step
+        self._handler_classes: dict[DataCategory, type[HandlerT]] = {}
+        self._handlers: dict[DataCategory, HandlerT] = {}
+        self._lock = Lock()
+
+    def register(self, data_category: DataCategory) -> Callable[[type[HandlerT]], type[HandlerT]]:
+        """Registers the decorated handler class for a data category, replacing any previous one."""
+
+        def decorator(handler_class: type[HandlerT]) -> type[HandlerT]:
+            with self._lock:
+                self._handler_classes[data_category] = handler_class
+                self._handlers.pop(data_category, None)
+            return handler_class
+
+        return decorator
+
+    def get(self, data_category: DataCategory | str) -> HandlerT:
+        """
+        Returns the handler of a data category.
+
+        Raises:
+            ValueError: If no handler is registered for the data category.
+        """
+        handler = self._handlers.get(data_category)
+        if handler is not None:
+            return handler
+
+        with self._lock:
+            handler_class = self._handler_classes.get(data_category)
+            if handler_class is None:
+                raise ValueError(f"Unsupported data category for the {self.step} step: {data_category}")
+            # DataCategory是str枚举，用枚举值或其字符串都能查到同一个handler
+            handler = self._handlers.get(data_category)
+            if handler is None:
+                handler = self._handlers[data_category] = handler_class()
+            return handler
+
+    def categories(self) -> list[DataCategory]:
+        return list(self._handler_classes)
@@ -0,0 +1,3 @@
+from .retriever import ContextRetriever, QueryEmbeddingCache, RetrievalResult, RetrievedChunk
+
+__all__ = ["ContextRetriever", "QueryEmbeddingCache", "RetrievalResult", "RetrievedChunk"]
@@ -0,0 +1,227 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Generic, Type, TypeVar
+
+import numpy as np
+from loguru import logger
+from numpy.typing import NDArray
+from pydantic import BaseModel, Field
+
+from llmtwin.domain.embed_document import EmbedArticle, EmbedDocument
+from llmtwin.networks.embeddings import CrossEncoderModelSingleton, EmbeddingModelSingleton
+from llmtwin.networks.sparse import get_bm25_encoder
+from llmtwin.settings import settings
+
+EmbedDocumentT = TypeVar("EmbedDocumentT", bound=EmbedDocument)
+
+
+class RetrievedChunk(BaseModel, Generic[EmbedDocumentT]):
+    document: EmbedDocumentT
+    # 重排后为cross-encoder的分数，否则为向量检索的相似度（混合检索时为RRF分数）
+    score: float
+    search_score: float
+
+
+class RetrievalResult(BaseModel, Generic[EmbedDocumentT]):
+    query: str
+    chunks: list[RetrievedChunk[EmbedDocumentT]]
+    num_candidates: int
+    num_reranked: int
+    query_embedding_cached: bool
+    # 各阶段耗时（毫秒）：embed, search, hydrate, rerank, total
+    latencies_ms: dict[str, float] = Field(default_factory=dict)
+
+    @property
+    def documents(self) -> list[EmbedDocumentT]:
+        return [chunk.document for chunk in self.chunks]
+
+
+class QueryEmbeddingCache:
+    """A thread-safe LRU cache of query embeddings."""
+
+    def __init__(self, max_size: int = 1024) -> None:
+        self._max_size = max_size
+        self._entries: OrderedDict[str, NDArray[np.float32]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, query: str) -> NDArray[np.float32] | None:
+        with self._lock:
+            embedding = self._entries.get(query)
+            if embedding is not None:
+                self._entries.move_to_end(query)
+            return embedding
+
+    def put(self, query: str, embedding: NDArray[np.float32]) -> None:
+        if self._max_size <= 0:
+            return
+
+        # 缓存的数组被多个请求共享，设为只读防止被修改
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        with self._lock:
+            self._entries[query] = embedding
+            self._entries.move_to_end(query)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ContextRetriever(Generic[EmbedDocumentT]):
+    """
+    Retrieves the chunks most relevant to a query: embeds the query, over-fetches candidates from the vector
+    store with approximate nearest neighbour search and reranks them with the cross-encoder.
+
+    The over-fetch and rerank budgets trade recall against latency: more candidates give the cross-encoder
+    more chances to surface a relevant chunk the embedding ranked low, but every reranked candidate costs a
+    cross-encoder forward pass.
+    """
+
+    def __init__(
+        self,
+        document_class: Type[EmbedDocumentT] = EmbedArticle,
+        overfetch_factor: int = settings.RETRIEVAL_OVERFETCH_FACTOR,
+        max_candidates: int = settings.RETRIEVAL_MAX_CANDIDATES,
+        rerank: bool = settings.RERANK_ENABLED,
+        rerank_max_candidates: int = settings.RERANK_MAX_CANDIDATES,
+        rerank_batch_size: int = settings.RERANK_BATCH_SIZE,
+        query_cache_size: int = settings.QUERY_EMBEDDING_CACHE_SIZE,
+    ) -> None:
+        self._document_class = document_class
+        self._overfetch_factor = overfetch_factor
+        self._max_candidates = max_candidates
+        self._rerank = rerank
+        self._rerank_max_candidates = rerank_max_candidates
+        self._rerank_batch_size = rerank_batch_size
+        self._query_cache = QueryEmbeddingCache(max_size=query_cache_size)
+
+    def embed_query(self, query: str) -> tuple[NDArray[np.float32], bool]:
+        """
+        Embeds the query, reusing the embedding of a recently seen identical query.
+
+        Returns:
+            tuple[NDArray[np.float32], bool]: The query embedding and whether it came from the cache.
+        """
+
+        embedding = self._query_cache.get(query)
+        if embedding is not None:
+            return embedding, True
+
+        embedding = EmbeddingModelSingleton()(query, to_list=False)
+        self._query_cache.put(query, embedding)
+
+        return embedding, False
+
+    def search(
+        self,
+        query: str,
+        k: int = settings.RETRIEVAL_TOP_K,
+        filters: dict[str, Any] | None = None,
+        rerank: bool | None = None,
+    ) -> RetrievalResult[EmbedDocumentT]:
+        """
+        Retrieves the ``k`` chunks most relevant to the query.
+
+        Args:
+            query (str): The query.
+            k (int): The number of chunks to return.
+            filters (dict[str, Any] | None): Only retrieve chunks whose payload matches these values, e.g.
+                ``{"author_id": "...", "platform": ["medium", "substack"]}``. A list matches any of its values.
+            rerank (bool | None): Whether to rerank the candidates with the cross-encoder. Defaults to the
+                retriever setting.
+
+        Returns:
+            RetrievalResult[EmbedDocumentT]: The chunks, best first, and the latency of every stage.
+        """
+
+        rerank = self._rerank if rerank is None else rerank
+        latencies = {}
+        start = time.perf_counter()
+
+        embedding, cached = self.embed_query(query)
+        latencies["embed"] = (time.perf_counter() - start) * 1000
+
+        num_candidates = min(max(k, k * self._overfetch_factor), max(k, self._max_candidates)) if rerank else k
+        stage_start = time.perf_counter()
+        if self._document_class.use_sparse_vectors():
+            # 混合检索的召回更高，同样的候选数下重排需要的over-fetch更少
+            sparse_embedding = get_bm25_encoder(self._document_class.get_collection_name()).encode_query(query)
+            candidates = self._document_class.hybrid_search(
+                embedding.tolist(),
+                sparse_embedding,
+                limit=num_candidates,
+                query_filter=build_filter(filters),
+                hydrate=False,
+            )
+        else:
+            candidates = self._document_class.search(
+                embedding.tolist(), limit=num_candidates, query_filter=build_filter(filters), hydrate=False
+            )
+        latencies["search"] = (time.perf_counter() - stage_start) * 1000
+
+        # 精简payload时只取回真正用到的候选的内容：重排的候选，或者不重排时的top-k
+        stage_start = time.perf_counter()
+        used = candidates[: max(k, self._rerank_max_candidates)] if rerank else candidates[:k]
+        self._document_class.hydrate([document for document, _ in used])
+        latencies["hydrate"] = (time.perf_counter() - stage_start) * 1000
+
+        stage_start = time.perf_counter()
+        if rerank and candidates:
+            # 只对向量检索排名靠前的候选重排，控制cross-encoder的开销
+            reranked = used
+            scores = CrossEncoderModelSingleton()(
+                [(query, document.content) for document, _ in reranked],
+                to_list=False,
+                batch_size=self._rerank_batch_size,
+            )
+            order = np.argsort(-np.asarray(scores), kind="stable")[:k]
+            chunks = [
+                RetrievedChunk(document=reranked[i][0], score=float(scores[i]), search_score=reranked[i][1])
+                for i in order
+            ]
+            num_reranked = len(reranked)
+        else:
+            chunks = [
+                RetrievedChunk(document=document, score=score, search_score=score) for document, score in candidates[:k]
+            ]
+            num_reranked = 0
+        latencies["rerank"] = (time.perf_counter() - stage_start) * 1000
+        latencies["total"] = (time.perf_counter() - start) * 1000
+
+        logger.debug(
+            "Retrieved context.",
+            num_candidates=len(candidates),
+            num_reranked=num_reranked,
+            query_embedding_cached=cached,
+            **{f"{stage}_ms": round(latency, 2) for stage, latency in latencies.items()},
+        )
+
+        return RetrievalResult(
+            query=query,
+            chunks=chunks,
+            num_candidates=len(candidates),
+            num_reranked=num_reranked,
+            query_embedding_cached=cached,
+            latencies_ms=latencies,
+        )
+
+
+def build_filter(filters: dict[str, Any] | None):
+    """Builds a Qdrant filter matching every key to its value, or to any of its values for lists."""
+
+    if not filters:
+        return None
+
+    from qdrant_client.http.models import FieldCondition, Filter, MatchAny, MatchValue
+
+    conditions = []
+    for key, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            match = MatchAny(any=[str(item) if not isinstance(item, (int, bool)) else item for item in value])
+        else:
+            match = MatchValue(value=str(value) if not isinstance(value, (int, bool)) else value)
+        conditions.append(FieldCondition(key=key, match=match))
+
+    return Filter(must=conditions)
@@ -1,14 +1,108 @@
+from pathlib import Path
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8')
 
     # MongoDB
+    MONGO_DATABASE_HOST: str = "mongodb://localhost:27017/"
     DATABASE_NAME: str = 'LLMTwinDB'
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_CONNECT_TIMEOUT_MS: int = 5000
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    MONGO_SOCKET_TIMEOUT_MS: int | None = None
+    MONGO_COMPRESSORS: str = ""  # e.g. "zstd,snappy,zlib"; zstd and snappy need the zstandard / python-snappy packages
+    MONGO_READ_PREFERENCE: Literal[
+        "primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"
+    ] = "primary"
+
+    # Qdrant
+    QDRANT_DATABASE_URL: str = "http://localhost:6333"
+    QDRANT_PREFER_GRPC: bool = False
+    QDRANT_GRPC_PORT: int = 6334
+    QDRANT_TIMEOUT: int = 30  # seconds
+    QDRANT_API_KEY: str | None = None
+    QDRANT_GRPC_KEEPALIVE_MS: int = 30000
+    QDRANT_GRPC_KEEPALIVE_TIMEOUT_MS: int = 10000
+    # Collection tuning of the embedded chunk collections, see CollectionConfig
+    QDRANT_QUANTIZATION: Literal["none", "scalar", "binary"] = "none"
+    QDRANT_HNSW_M: int | None = None
+    QDRANT_HNSW_EF_CONSTRUCT: int | None = None
+    QDRANT_ON_DISK_VECTORS: bool | None = None
+    QDRANT_ON_DISK_PAYLOAD: bool | None = None
+    QDRANT_SEARCH_HNSW_EF: int | None = None
+    QDRANT_SEARCH_RESCORE: bool | None = None
+    QDRANT_SEARCH_OVERSAMPLING: float | None = None
+    # Keep only ids and filter fields in the payloads of the embedded chunks, the rest goes to MongoDB
+    QDRANT_SLIM_PAYLOADS: bool = False
+    QDRANT_WRITE_BATCH_SIZE: int = 256
+    QDRANT_WRITE_CONCURRENCY: int = 4
+    QDRANT_WRITE_WAIT: bool = True
+    QDRANT_WRITE_MAX_RETRIES: int = 3
+    QDRANT_WRITE_BACKOFF: float = 0.5  # seconds before the first retry, doubled after every retry
+
+    # Vector backend: "numpy" replaces Qdrant with the in-process NumpyVectorStore, for tests and small corpora
+    VECTOR_BACKEND: Literal["qdrant", "numpy"] = "qdrant"
+    NUMPY_VECTOR_STORE_PATH: str = str(Path.home() / ".cache" / "llmtwin" / "vectors")  # or ":memory:"
+    NUMPY_VECTOR_STORE_IVF_LISTS: int = 0  # 0 searches exactly
+    NUMPY_VECTOR_STORE_IVF_PROBES: int = 8
+
+    # Trusted reads: build the documents read back with model_construct, validating a sample and old documents
+    TRUSTED_READS: bool = False
+    TRUSTED_READS_SAMPLE_RATE: float = 0.01
+
+    # Ping the databases when connecting, so that a wrong host fails at once instead of on the first query
+    DATABASE_HEALTH_CHECK: bool = True
 
     # RAG
     TEXT_EMBEDDING_MODEL_ID: str = "sentence-transformers/all-MiniLM-L6-v2"
     RERANKING_CROSS_ENCODER_MODEL_ID: str = "cross-encoder/ms-marco-MiniLM-L-4-v2"
     RAG_MODEL_DEVICE: str = "cpu"
+    EMBEDDING_BATCH_SIZE: int = 32
+
+    # Retrieval
+    RETRIEVAL_TOP_K: int = 5
+    RETRIEVAL_OVERFETCH_FACTOR: int = 4  # candidates fetched from the vector store per returned chunk
+    RETRIEVAL_MAX_CANDIDATES: int = 100
+    RERANK_ENABLED: bool = True
+    RERANK_MAX_CANDIDATES: int = 50
+    RERANK_BATCH_SIZE: int = 32
+    QUERY_EMBEDDING_CACHE_SIZE: int = 1024
+
+    # Hybrid search: a BM25 sparse vector is indexed next to the dense one and both rankings are fused with RRF
+    HYBRID_SEARCH_ENABLED: bool = False
+    BM25_VOCABULARY_DIR: Path = Path.home() / ".cache" / "llmtwin" / "bm25"
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+
+    # Model backend: "torch" runs the PyTorch models, "onnx" exports them once and runs them with onnxruntime
+    RAG_MODEL_BACKEND: Literal["torch", "onnx"] = "torch"
+    RAG_ONNX_QUANTIZE: bool = False
+    RAG_ONNX_CACHE_DIR: Path = Path.home() / ".cache" / "llmtwin" / "onnx"
+    RAG_ONNX_PARITY_TOLERANCE: float = 0.02
+
+    # Chunk deduplication before embedding: "skip" drops duplicates, "link" also records them in chunk_links
+    CHUNK_DEDUP_MODE: Literal["off", "skip", "link"] = "skip"
+    CHUNK_DEDUP_MAX_DISTANCE: int = 0  # SimHash bits, 0 only drops exact duplicates
+    CHUNK_DEDUP_MAX_ENTRIES: int = 1_000_000
+
+    # Metrics and logging
+    METRICS_ENABLED: bool = True
+    METRICS_TRACING: bool = False  # also open an OpenTelemetry span per tracked call, needs opentelemetry-api
+    METRICS_EXPORT_PATH: Path | None = None  # written after every pipeline run, ".prom" for Prometheus else JSON
+    LOG_SAMPLE_RATE: float = 0.01  # fraction of the per-document log lines written
+
+    # Embedding process pool, for CPU-only hosts
+    EMBEDDING_POOL_ENABLED: bool = False
+    EMBEDDING_POOL_WORKERS: int = 0  # 0 means one worker per EMBEDDING_POOL_THREADS_PER_WORKER cores
+    EMBEDDING_POOL_THREADS_PER_WORKER: int = 1
+
+    # Embedding cache
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_DIR: Path = Path.home() / ".cache" / "llmtwin" / "embeddings"
+    EMBEDDING_CACHE_MAX_SIZE_MB: int = 1024
 
 settings = Settings()
\ No newline at end of file
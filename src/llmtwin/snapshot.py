@@ -0,0 +1,456 @@
+import argparse
+import importlib
+import json
+import shutil
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Type
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from pydantic import BaseModel
+
+from .domain.base.trusted import schema_version
+from .domain.base.vector import (
+    DENSE_VECTOR_NAME,
+    SPARSE_VECTOR_NAME,
+    UpsertBatchResult,
+    VectorBaseDocument,
+    get_database,
+)
+from .metrics import metrics
+from .settings import settings
+
+MANIFEST_FILE = "manifest.json"
+_DATA_DIR_PREFIX = "data-"
+
+# 快照中的保留列，其余的列都是payload字段
+ID_COLUMN = "id"
+EMBEDDING_COLUMN = "embedding"
+SPARSE_INDICES_COLUMN = "sparse_indices"
+SPARSE_VALUES_COLUMN = "sparse_values"
+_VECTOR_COLUMNS = {ID_COLUMN, EMBEDDING_COLUMN, SPARSE_INDICES_COLUMN, SPARSE_VALUES_COLUMN}
+
+# 导入这些模块后，所有集合的文档类才会注册为VectorBaseDocument的子类
+_DOCUMENT_MODULES = [
+    "llmtwin.domain.cleaned_document",
+    "llmtwin.domain.chunk_document",
+    "llmtwin.domain.embed_document",
+]
+
+
+class SnapshotFile(BaseModel):
+    path: str
+    num_points: int
+    # 以JSON字符串保存的payload字段（dict和list）
+    json_columns: list[str] = []
+
+
+class SnapshotManifest(BaseModel):
+    collection_name: str
+    document_class: str
+    schema_version: str
+    vector_size: int | None
+    sparse_vectors: bool
+    num_points: int = 0
+    files: list[SnapshotFile] = []
+    created_at: datetime
+
+
+def export_collection(
+    document_class: Type[VectorBaseDocument],
+    directory: Path,
+    partition_size: int = 1_000_000,
+    page_size: int = 1024,
+    compression: str = "zstd",
+) -> SnapshotManifest:
+    """
+    Streams a vector collection to Parquet files, without building the documents.
+
+    Every point becomes a row: its id, its dense embedding as a fixed size list of float32, its BM25 sparse
+    vector if it has one, and one column per payload field. A new file is started every ``partition_size``
+    points, or when a page has payload fields that do not fit the columns of the current file. The fields
+    offloaded to the MongoDB side store are not in the payload and are not exported, they stay in MongoDB.
+
+    Args:
+        document_class (Type[VectorBaseDocument]): The document class of the collection.
+        directory (Path): The snapshot directory, created if needed. An existing snapshot is replaced once the
+            export completes, and kept if it fails.
+        partition_size (int): The largest number of points per file.
+        page_size (int): The number of points scrolled per request, also the size of the row groups.
+        compression (str): The Parquet compression codec.
+
+    Returns:
+        SnapshotManifest: The manifest, also written to ``manifest.json`` in the directory.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    # 文件先写到新的子目录，全部写完后再替换manifest，导出失败时原来的快照仍然完整
+    data_dir = Path(f"{_DATA_DIR_PREFIX}{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}")
+    (directory / data_dir).mkdir()
+
+    collection_name = document_class.get_collection_name()
+    manifest = SnapshotManifest(
+        collection_name=collection_name,
+        document_class=f"{document_class.__module__}.{document_class.__qualname__}",
+        schema_version=schema_version(document_class),
+        vector_size=_collection_vector_size(collection_name),
+        sparse_vectors=False,
+        created_at=datetime.now(timezone.utc),
+    )
+
+    writer: pq.ParquetWriter | None = None
+    current: SnapshotFile | None = None
+
+    def close_partition() -> None:
+        nonlocal writer, current
+        if writer is not None:
+            writer.close()
+            manifest.files.append(current)
+        writer, current = None, None
+
+    offset = None
+    completed = False
+    try:
+        while True:
+            with metrics.track("snapshot.scroll", collection=collection_name) as timer:
+                records, offset = get_database().scroll(
+                    collection_name=collection_name,
+                    limit=page_size,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True,
+                )
+                timer.items = len(records)
+            if records:
+                json_columns = set(current.json_columns) if current is not None else set()
+                table = _records_to_table(records, manifest.vector_size, json_columns)
+                manifest.sparse_vectors |= SPARSE_INDICES_COLUMN in table.column_names
+
+                if writer is not None:
+                    table = _fit_schema(table, writer.schema)
+                    if table is None or current.num_points + len(records) > partition_size:
+                        # payload字段变了，或者文件已满：换一个新文件
+                        close_partition()
+                        table = _records_to_table(records, manifest.vector_size, set())
+
+                if writer is None:
+                    path = (data_dir / f"part-{len(manifest.files):05d}.parquet").as_posix()
+                    writer = pq.ParquetWriter(directory / path, table.schema, compression=compression)
+                    current = SnapshotFile(
+                        path=path, num_points=0, json_columns=json.loads(table.schema.metadata[b"json_columns"])
+                    )
+
+                with metrics.track("snapshot.write", items=table.num_rows, nbytes=table.nbytes, collection=collection_name):
+                    writer.write_table(table)
+                current.num_points += table.num_rows
+                manifest.num_points += table.num_rows
+
+            if offset is None:
+                break
+        completed = True
+    finally:
+        close_partition()
+        if not completed:
+            shutil.rmtree(directory / data_dir, ignore_errors=True)
+
+    manifest_path = directory / MANIFEST_FILE
+    tmp_path = manifest_path.with_suffix(".tmp")
+    tmp_path.write_text(manifest.model_dump_json(indent=2))
+    tmp_path.replace(manifest_path)
+    _remove_stale_files(directory, data_dir)
+    logger.info(
+        f"Exported {manifest.num_points} points of {collection_name}.", files=len(manifest.files), directory=str(directory)
+    )
+
+    return manifest
+
+
+def _remove_stale_files(directory: Path, data_dir: Path) -> None:
+    # 旧版本的快照文件直接放在目录中
+    for old_file in directory.glob("part-*.parquet"):
+        old_file.unlink()
+    for old_dir in directory.glob(f"{_DATA_DIR_PREFIX}*"):
+        if old_dir.name != data_dir.name:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def import_collection(
+    document_class: Type[VectorBaseDocument],
+    directory: Path,
+    recreate: bool = False,
+    batch_size: int = settings.QDRANT_WRITE_BATCH_SIZE,
+    concurrency: int = settings.QDRANT_WRITE_CONCURRENCY,
+) -> list[UpsertBatchResult]:
+    """
+    Loads a snapshot back into the collection of ``document_class``, without running any model.
+
+    The files are memory-mapped and read one batch at a time, so memory stays bounded by the batch size and
+    the write concurrency. A missing collection is created with the current collection config, so restoring
+    into a deleted collection applies a new index or quantization configuration. The vector layout follows
+    the target collection as read from the vector store: sparse vectors are dropped if it has none. Restoring into the numpy
+    backend works the same way, see VECTOR_BACKEND.
+
+    Args:
+        document_class (Type[VectorBaseDocument]): The document class of the target collection.
+        directory (Path): The snapshot directory written by ``export_collection``.
+        recreate (bool): Whether to delete the collection first, e.g. to change its vector layout.
+        batch_size (int): The number of points per upsert request.
+        concurrency (int): The largest number of upsert requests in flight.
+
+    Returns:
+        list[UpsertBatchResult]: The result of every batch written.
+    """
+    directory = Path(directory)
+    manifest = read_manifest(directory)
+    collection_name = document_class.get_collection_name()
+    if manifest.collection_name != collection_name:
+        logger.warning(f"Restoring the snapshot of {manifest.collection_name} into {collection_name}.")
+    if manifest.schema_version != schema_version(document_class):
+        # 点会原样写入，读取时按旧版本的文档校验
+        logger.warning(f"The snapshot was written by another version of {document_class.__name__}.")
+
+    if recreate and document_class.collection_exists():
+        get_database().delete_collection(collection_name=collection_name)
+    if not document_class.collection_exists():
+        created = document_class._create_collection(
+            collection_name=collection_name,
+            vector_size=manifest.vector_size,
+            use_vector_index=manifest.vector_size is not None,
+        )
+        if created is False:
+            raise RuntimeError(f"Couldn't create collection {collection_name}")
+
+    # 按目标集合实际的向量结构写入，它可能是在另一个HYBRID_SEARCH_ENABLED设置下创建的
+    dense_vector_name, sparse_vectors = _collection_vector_layout(collection_name)
+    if manifest.sparse_vectors and not sparse_vectors:
+        logger.warning(f"{collection_name} has no sparse vectors, the sparse vectors of the snapshot are dropped.")
+    point_batches = (
+        _batch_to_points(batch, set(snapshot_file.json_columns), dense_vector_name, sparse_vectors)
+        for snapshot_file, batch in _iter_batches(directory, manifest, batch_size)
+    )
+    results = document_class.upsert_points(point_batches, concurrency=concurrency)
+
+    num_failed = sum(result.num_points for result in results if not result.ok)
+    logger.info(
+        f"Imported {manifest.num_points - num_failed} of {manifest.num_points} points into {collection_name}.",
+        directory=str(directory),
+    )
+
+    return results
+
+
+def read_manifest(directory: Path) -> SnapshotManifest:
+    return SnapshotManifest.model_validate_json((Path(directory) / MANIFEST_FILE).read_text())
+
+
+def read_table(directory: Path, columns: list[str] | None = None) -> pa.Table:
+    """Reads a snapshot as one memory-mapped Arrow table, e.g. for offline analytics with pandas or DuckDB."""
+    directory = Path(directory)
+    manifest = read_manifest(directory)
+    tables = [
+        pq.read_table(directory / snapshot_file.path, columns=columns, memory_map=True)
+        for snapshot_file in manifest.files
+    ]
+    return pa.concat_tables(tables, promote_options="default") if tables else pa.table({})
+
+
+def get_document_class(collection_name: str) -> Type[VectorBaseDocument]:
+    """Returns the document class of a collection, e.g. EmbedArticle for "embed_articles"."""
+    for module in _DOCUMENT_MODULES:
+        importlib.import_module(module)
+
+    classes = [VectorBaseDocument]
+    while classes:
+        document_class = classes.pop()
+        classes.extend(document_class.__subclasses__())
+        if document_class.__abstractmethods__:
+            continue
+        if document_class.get_collection_name() == collection_name:
+            return document_class
+
+    raise ValueError(f"No document class for the collection {collection_name}.")
+
+
+def _collection_vector_size(collection_name: str) -> int | None:
+    vectors = get_database().get_collection(collection_name=collection_name).config.params.vectors
+    if isinstance(vectors, dict):
+        vectors = vectors.get(DENSE_VECTOR_NAME)
+    return vectors.size if vectors else None
+
+
+def _collection_vector_layout(collection_name: str) -> tuple[str | None, bool]:
+    """Returns the name of the dense vector of a collection ("" if unnamed, None if it has none) and whether it has the sparse one."""
+    params = get_database().get_collection(collection_name=collection_name).config.params
+    vectors = params.vectors
+    if isinstance(vectors, dict):
+        dense_vector_name = DENSE_VECTOR_NAME if DENSE_VECTOR_NAME in vectors else None
+    else:
+        dense_vector_name = "" if vectors is not None else None
+    return dense_vector_name, SPARSE_VECTOR_NAME in (params.sparse_vectors or {})
+
+
+def _records_to_table(records: list, vector_size: int | None, json_columns: set[str]) -> pa.Table:
+    columns = {ID_COLUMN: pa.array([str(record.id) for record in records], type=pa.string())}
+
+    if vector_size is not None:
+        embeddings = np.zeros((len(records), vector_size), dtype=np.float32)
+        has_embedding = np.zeros(len(records), dtype=bool)
+        for i, record in enumerate(records):
+            vector = record.vector.get(DENSE_VECTOR_NAME) if isinstance(record.vector, dict) else record.vector
+            if vector:
+                embeddings[i] = vector
+                has_embedding[i] = True
+        values = pa.array(embeddings.reshape(-1), type=pa.float32())
+        columns[EMBEDDING_COLUMN] = pa.FixedSizeListArray.from_arrays(
+            values, vector_size, mask=pa.array(~has_embedding)
+        )
+
+    sparse = [record.vector.get(SPARSE_VECTOR_NAME) if isinstance(record.vector, dict) else None for record in records]
+    if any(vector is not None for vector in sparse):
+        columns[SPARSE_INDICES_COLUMN] = pa.array(
+            [vector.indices if vector is not None else None for vector in sparse], type=pa.list_(pa.uint32())
+        )
+        columns[SPARSE_VALUES_COLUMN] = pa.array(
+            [vector.values if vector is not None else None for vector in sparse], type=pa.list_(pa.float32())
+        )
+
+    payloads = [record.payload or {} for record in records]
+    keys = sorted({key for payload in payloads for key in payload} - _VECTOR_COLUMNS)
+    json_columns = set(json_columns)
+    for key in keys:
+        values = [payload.get(key) for payload in payloads]
+        if key in json_columns or any(isinstance(value, (dict, list)) for value in values):
+            json_columns.add(key)
+            values = [json.dumps(value) if value is not None else None for value in values]
+        array = pa.array(values)
+        # 全为null的列没有类型，按字符串保存
+        columns[key] = array.cast(pa.string()) if pa.types.is_null(array.type) else array
+
+    table = pa.table(columns)
+    return table.replace_schema_metadata({"json_columns": json.dumps(sorted(json_columns & set(keys)))})
+
+
+def _fit_schema(table: pa.Table, schema: pa.Schema) -> pa.Table | None:
+    """Casts the table to the schema of the current file, or returns None if it does not fit."""
+    if not set(table.column_names) <= set(schema.names):
+        return None
+    if json.loads(table.schema.metadata[b"json_columns"]) != [
+        name for name in json.loads(schema.metadata[b"json_columns"]) if name in table.column_names
+    ]:
+        return None
+
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            column = table.column(field.name)
+        else:
+            column = pa.nulls(table.num_rows, type=field.type)
+        try:
+            columns.append(column.cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            return None
+
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _iter_batches(directory: Path, manifest: SnapshotManifest, batch_size: int) -> Iterator[tuple[SnapshotFile, pa.RecordBatch]]:
+    for snapshot_file in manifest.files:
+        parquet_file = pq.ParquetFile(directory / snapshot_file.path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield snapshot_file, batch
+
+
+def _batch_to_points(
+    batch: pa.RecordBatch, json_columns: set[str], dense_vector_name: str | None, sparse_vectors: bool
+) -> list:
+    from qdrant_client.models import PointStruct, SparseVector
+
+    with metrics.track("snapshot.read", items=batch.num_rows, nbytes=batch.nbytes):
+        ids = batch.column(ID_COLUMN).to_pylist()
+        names = batch.schema.names
+
+        embeddings = [None] * batch.num_rows
+        if EMBEDDING_COLUMN in names:
+            column = batch.column(EMBEDDING_COLUMN)
+            # 列是定长list，展开后直接reshape成矩阵，不逐行转换
+            matrix = column.values.to_numpy(zero_copy_only=False).reshape(-1, column.type.list_size)
+            matrix = matrix[column.offset:column.offset + len(column)]
+            is_valid = column.is_valid().to_numpy(zero_copy_only=False)
+            embeddings = [row if valid else None for row, valid in zip(matrix.tolist(), is_valid, strict=True)]
+
+        sparse = [None] * batch.num_rows
+        if sparse_vectors and SPARSE_INDICES_COLUMN in names:
+            sparse = [
+                SparseVector.model_construct(indices=indices, values=values) if indices else None
+                for indices, values in zip(
+                    batch.column(SPARSE_INDICES_COLUMN).to_pylist(),
+                    batch.column(SPARSE_VALUES_COLUMN).to_pylist(),
+                    strict=True,
+                )
+            ]
+
+        payload_names = [name for name in names if name not in _VECTOR_COLUMNS]
+        payloads = batch.select(payload_names).to_pylist()
+
+        points = []
+        for _id, embedding, sparse_vector, payload in zip(ids, embeddings, sparse, payloads, strict=True):
+            # 缺失的字段在快照中是null，不写回payload
+            payload = {
+                key: json.loads(value) if key in json_columns else value
+                for key, value in payload.items()
+                if value is not None
+            }
+            if dense_vector_name == "" and not sparse_vectors:
+                vector = embedding if embedding is not None else {}
+            else:
+                vector = {}
+                if dense_vector_name is not None and embedding is not None:
+                    vector[dense_vector_name] = embedding
+                if sparse_vector is not None:
+                    vector[SPARSE_VECTOR_NAME] = sparse_vector
+            points.append(PointStruct.model_construct(id=_id, vector=vector, payload=payload))
+
+    return points
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m llmtwin.snapshot", description="Exports or restores a vector collection as Parquet files."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Streams a collection to a snapshot directory.")
+    export_parser.add_argument("collection", help='The collection name, e.g. "embed_articles".')
+    export_parser.add_argument("directory", type=Path)
+    export_parser.add_argument("--partition-size", type=int, default=1_000_000, help="Points per Parquet file.")
+    export_parser.add_argument("--page-size", type=int, default=1024, help="Points per scroll request.")
+
+    import_parser = subparsers.add_parser("import", help="Loads a snapshot directory into a collection.")
+    import_parser.add_argument("collection", help='The collection name, e.g. "embed_articles".')
+    import_parser.add_argument("directory", type=Path)
+    import_parser.add_argument("--recreate", action="store_true", help="Delete the collection first.")
+    import_parser.add_argument("--batch-size", type=int, default=settings.QDRANT_WRITE_BATCH_SIZE)
+    import_parser.add_argument("--concurrency", type=int, default=settings.QDRANT_WRITE_CONCURRENCY)
+
+    args = parser.parse_args()
+    document_class = get_document_class(args.collection)
+    if args.command == "export":
+        export_collection(document_class, args.directory, partition_size=args.partition_size, page_size=args.page_size)
+    else:
+        results = import_collection(
+            document_class,
+            args.directory,
+            recreate=args.recreate,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+        )
+        if not all(result.ok for result in results):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
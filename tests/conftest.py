@@ -0,0 +1,37 @@
+from typing import Iterator
+
+import pytest
+
+from llmtwin.domain.base import nosql, vector
+
+
+def _ignore_unset_sort(add):
+    def wrapper(*args, sort=None, **kwargs):
+        if sort is not None:
+            raise NotImplementedError("mongomock does not support sorted bulk writes.")
+        return add(*args, **kwargs)
+
+    return wrapper
+
+
+@pytest.fixture
+def databases(monkeypatch) -> Iterator[None]:
+    """Points the domain models at mongomock and an in-memory Qdrant, restoring the connections after."""
+    mongomock = pytest.importorskip("mongomock")
+    import mongomock.collection
+    from qdrant_client import QdrantClient
+
+    previous = nosql._database, vector._database
+    nosql._database = mongomock.MongoClient()["tests"]
+    vector._database = QdrantClient(":memory:")
+    # mongomock用BSON.encode校验写入的文档时不带codec options，无法编码UUID；跳过这一步校验
+    monkeypatch.setattr(mongomock.collection, "BSON", None)
+    # pymongo>=4.11的ReplaceOne/UpdateOne总是传入sort参数，mongomock 4.3还不接受
+    builder = mongomock.collection.BulkOperationBuilder
+    monkeypatch.setattr(builder, "add_replace", _ignore_unset_sort(builder.add_replace))
+    monkeypatch.setattr(builder, "add_update", _ignore_unset_sort(builder.add_update))
+    try:
+        yield
+    finally:
+        vector._database.close()
+        nosql._database, vector._database = previous
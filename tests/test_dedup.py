@@ -0,0 +1,113 @@
+import hashlib
+import uuid
+
+import pytest
+
+from llmtwin.domain.chunk_document import ChunkArticle
+from llmtwin.preprocess.dedup import ChunkDeduplicator, simhash
+
+AUTHOR_ID = uuid.uuid4()
+
+TEXT = (
+    "The pipeline reads the raw articles from MongoDB, cleans them, splits them into chunks of a few hundred "
+    "tokens, embeds every chunk with the sentence transformer and writes the vectors to Qdrant in batches, "
+    "so that the retrieval step can search them by similarity to the question asked by the user."
+)
+
+
+def make_chunk(content: str, document_id: uuid.UUID) -> ChunkArticle:
+    # 与chunk handler一致，chunk的id是内容的md5
+    return ChunkArticle(
+        id=uuid.UUID(hashlib.md5(content.encode()).hexdigest(), version=4),
+        content=content,
+        platform="blog",
+        author_id=AUTHOR_ID,
+        document_id=document_id,
+        author_full_name="Author",
+        link=f"https://blog/{document_id}",
+    )
+
+
+def ids(chunks_batch: list[list[ChunkArticle]]) -> list[list[uuid.UUID]]:
+    return [[chunk.id for chunk in chunks] for chunks in chunks_batch]
+
+
+def test_simhash_of_near_duplicates_differs_in_few_bits():
+    edited = TEXT.replace("in batches", "in large batches")
+    unrelated = "A completely different paragraph about cooking pasta with tomatoes, garlic and fresh basil leaves."
+
+    assert simhash(TEXT) == simhash(TEXT.upper())
+    assert (simhash(TEXT) ^ simhash(edited)).bit_count() <= 7
+    assert (simhash(TEXT) ^ simhash(unrelated)).bit_count() > 7
+    assert simhash("") == 0
+
+
+def test_exact_duplicates_are_dropped():
+    deduplicator = ChunkDeduplicator(max_distance=0)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    batch = [
+        [make_chunk("a", first), make_chunk("b", first), make_chunk("a", first)],
+        [make_chunk("b", second), make_chunk("c", second)],
+    ]
+
+    kept, links, duplicate_ids = deduplicator.deduplicate(batch)
+
+    assert ids(kept) == [[batch[0][0].id, batch[0][1].id], [batch[1][1].id]]
+    assert links == []
+    # 同一文档中重复的段落不算共享其他文档的点
+    assert duplicate_ids == [[], [batch[0][1].id]]
+    assert deduplicator.num_exact_duplicates == 2
+
+    kept, _, duplicate_ids = deduplicator.deduplicate([[make_chunk("c", uuid.uuid4())]])
+    assert kept == [[]]
+    assert duplicate_ids == [[batch[1][1].id]]
+
+
+def test_near_duplicates_are_dropped_within_the_distance():
+    edited = TEXT.replace("in batches", "in large batches")
+    assert 0 < (simhash(TEXT) ^ simhash(edited)).bit_count() <= 7
+    original = make_chunk(TEXT, uuid.uuid4())
+
+    exact_only = ChunkDeduplicator(max_distance=0)
+    kept, _, _ = exact_only.deduplicate([[original], [make_chunk(edited, uuid.uuid4())]])
+    assert [len(chunks) for chunks in kept] == [1, 1]
+
+    deduplicator = ChunkDeduplicator(mode="link", max_distance=7)
+    duplicate = make_chunk(edited, uuid.uuid4())
+    kept, links, duplicate_ids = deduplicator.deduplicate([[original], [duplicate]])
+
+    assert ids(kept) == [[original.id], []]
+    assert duplicate_ids == [[], [original.id]]
+    assert [(link.chunk_id, link.canonical_id, link.document_id) for link in links] == [
+        (duplicate.id, original.id, duplicate.document_id)
+    ]
+    assert 0 < links[0].distance <= 7
+    assert deduplicator.num_near_duplicates == 1
+
+
+@pytest.mark.parametrize("max_distance", [0, 3])
+def test_chunks_overwritten_in_the_ring_are_forgotten(max_distance):
+    deduplicator = ChunkDeduplicator(max_distance=max_distance, max_entries=50)
+    document_id = uuid.uuid4()
+    chunks = [make_chunk(f"paragraph number {i} of a long article about vector search", document_id) for i in range(120)]
+
+    # 每批10个chunk，中间多次合并进有序表
+    for start in range(0, len(chunks), 10):
+        kept, _, _ = deduplicator.deduplicate([chunks[start : start + 10]])
+        assert len(kept[0]) == 10
+
+    other = uuid.uuid4()
+    again = [make_chunk(chunk.content, other) for chunk in chunks]
+    # 最后50个chunk还在环中，更早的已经被覆盖
+    kept, _, duplicate_ids = deduplicator.deduplicate([again[70:]])
+    assert kept == [[]]
+    assert duplicate_ids == [[chunk.id for chunk in again[70:]]]
+    kept, _, _ = deduplicator.deduplicate([again[:70]])
+    assert ids(kept) == [[chunk.id for chunk in again[:70]]]
+
+
+def test_invalid_parameters_are_rejected():
+    with pytest.raises(ValueError):
+        ChunkDeduplicator(max_distance=8)
+    with pytest.raises(ValueError):
+        ChunkDeduplicator(max_entries=0)
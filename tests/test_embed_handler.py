@@ -0,0 +1,41 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from llmtwin.domain.chunk_document import ChunkArticle
+from llmtwin.networks.embeddings import EmbeddingError
+from llmtwin.preprocess import embed_handler
+from llmtwin.preprocess.dispatcher import EmbedDispatcher
+from llmtwin.preprocess.embed_handler import ArticleEmbedHandler
+
+
+@pytest.fixture
+def failing_model(monkeypatch):
+    # 模拟模型对所有文本都生成失败
+    def embed_texts(texts):
+        return np.zeros((len(texts), 4), dtype=np.float32), np.ones(len(texts), dtype=bool)
+
+    monkeypatch.setattr(embed_handler, "embed_texts", embed_texts)
+
+
+def make_chunk() -> ChunkArticle:
+    return ChunkArticle(
+        content="a chunk",
+        platform="blog",
+        author_id=uuid.uuid4(),
+        document_id=uuid.uuid4(),
+        author_full_name="Author",
+        link="https://blog/1",
+    )
+
+
+def test_single_failed_chunk_raises_with_its_id(failing_model):
+    chunk = make_chunk()
+
+    with pytest.raises(EmbeddingError, match=str(chunk.id)):
+        ArticleEmbedHandler().embed(chunk)
+    with pytest.raises(EmbeddingError, match=str(chunk.id)):
+        EmbedDispatcher.dispatch(chunk)
+    # 批量嵌入时失败的chunk被丢弃
+    assert EmbedDispatcher.dispatch([chunk]) == []
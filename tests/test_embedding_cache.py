@@ -0,0 +1,67 @@
+import multiprocessing
+
+import numpy as np
+
+from llmtwin.networks.embedding_cache import EmbeddingCache
+
+DIM = 4
+
+
+def open_cache(cache_dir, **kwargs) -> EmbeddingCache:
+    return EmbeddingCache(cache_dir, model_id="org/model", embedding_size=DIM, **kwargs)
+
+
+def vectors_of(keys: list[str]) -> np.ndarray:
+    return np.array([[float(key.split("-")[0]), float(key.split("-")[1]), 0, 0] for key in keys], dtype=np.float32)
+
+
+def fill(cache_dir, worker: int) -> None:
+    cache = open_cache(cache_dir)
+    for start in range(0, 300, 30):
+        keys = [f"{worker}-{i}" for i in range(start, start + 30)]
+        cache.put_many(keys, vectors_of(keys))
+    cache.close()
+
+
+def test_processes_sharing_the_directory_get_their_own_rows(tmp_path):
+    # spawn与embedding pool相同，每个进程独立打开缓存
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=fill, args=(tmp_path, worker)) for worker in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    cache = open_cache(tmp_path)
+    keys = [f"{worker}-{i}" for worker in range(3) for i in range(300)]
+    embeddings, found = cache.get_many(keys)
+    assert found.all()
+    np.testing.assert_array_equal(embeddings, vectors_of(keys))
+    assert len(cache) == 900
+
+
+def test_the_least_recently_used_entries_are_evicted(tmp_path):
+    first = open_cache(tmp_path, max_size_mb=1)
+    second = open_cache(tmp_path, max_size_mb=1)
+    capacity = first.max_entries
+
+    keys = [f"0-{i}" for i in range(capacity)]
+    first.put_many(keys, vectors_of(keys))
+    # 另一个连接使用第一个key，淘汰的是第二个
+    second.get_many(keys[:1])
+    second.put_many(["1-0"], vectors_of(["1-0"]))
+
+    _, found = first.get_many([keys[0], keys[1], "1-0"])
+    assert found.tolist() == [True, False, True]
+    assert len(first) == capacity
+
+
+def test_backends_do_not_share_vectors(tmp_path):
+    keys = ["0-1"]
+    open_cache(tmp_path, variant="torch").put_many(keys, vectors_of(keys))
+
+    _, found = open_cache(tmp_path, variant="onnx-int8").get_many(keys)
+    assert not found.any()
+    _, found = open_cache(tmp_path, variant="torch").get_many(keys)
+    assert found.all()
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# 导入预算（秒），可以通过环境变量放宽，例如在很慢的CI机器上
+IMPORT_BUDGET = float(os.environ.get("LLMTWIN_IMPORT_BUDGET", "1.5"))
+
+HEAVY_MODULES = ["torch", "transformers", "sentence_transformers", "qdrant_client", "onnxruntime"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+
+from llmtwin.connection import MongoDBConnection, QdrantConnection
+print(json.dumps({{
+    "elapsed": elapsed,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+    "connected": [cls.__name__ for cls in (MongoDBConnection, QdrantConnection) if cls._instance is not None],
+}}))
+"""
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "llmtwin.feature_engineering.clean",
+        "llmtwin.feature_engineering.pipeline",
+        "llmtwin.preprocess.dispatcher",
+        "llmtwin.networks",
+    ],
+)
+def test_import_is_lazy_and_fast(module: str) -> None:
+    # 每个模块在新的解释器中导入，避免受其他测试已导入模块的影响
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert report["heavy"] == [], f"Importing {module} loaded {report['heavy']}"
+    assert report["connected"] == [], f"Importing {module} opened connections: {report['connected']}"
+    assert report["elapsed"] < IMPORT_BUDGET, f"Importing {module} took {report['elapsed']:.2f}s"
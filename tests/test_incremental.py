@@ -0,0 +1,250 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from llmtwin.domain.base import nosql
+from llmtwin.domain.chunk_document import ChunkArticle
+from llmtwin.domain.cleaned_document import CleanedArticle
+from llmtwin.domain.document import ArticleDocument
+from llmtwin.domain.embed_document import EmbedArticle
+from llmtwin.domain.processing_state import ProcessingState, ProcessingWatermark
+from llmtwin.feature_engineering.incremental import ChangeTracker
+from llmtwin.preprocess.chunk_handler import ArticleChunkHandler
+
+AUTHOR_ID = uuid.uuid4()
+
+
+@pytest.fixture
+def chunk_metadata(monkeypatch) -> dict:
+    # 不加载embedding模型，chunk参数固定
+    metadata = {"embedding_model_id": "test-model", "chunk_size": 128, "chunk_overlap": 32}
+    monkeypatch.setattr(ArticleChunkHandler, "metadata", property(lambda self: dict(metadata)))
+    return metadata
+
+
+@pytest.fixture
+def tracker(databases, chunk_metadata) -> ChangeTracker:
+    EmbedArticle.get_or_create_collection(vector_size=4)
+    return ChangeTracker()
+
+
+def make_document(text: str, **kwargs) -> ArticleDocument:
+    return ArticleDocument(
+        content={"text": text}, platform="blog", author_id=AUTHOR_ID, author_full_name="Author", link="l", **kwargs
+    )
+
+
+def process(
+    tracker: ChangeTracker,
+    document: ArticleDocument,
+    chunk_ids: list[uuid.UUID],
+    written: int | None = None,
+    duplicate_ids: list[uuid.UUID] | None = None,
+):
+    """Runs a changed document through the tracker as the pipeline does, writing its chunks as embedded points."""
+    cleaned = CleanedArticle(
+        id=document.id, content=document.content["text"], platform="blog", author_id=AUTHOR_ID,
+        author_full_name="Author", link="l",
+    )
+    chunks = [
+        ChunkArticle(
+            id=chunk_id, content=f"chunk {chunk_id}", platform="blog", author_id=AUTHOR_ID, document_id=document.id,
+            author_full_name="Author", link="l",
+        )
+        for chunk_id in chunk_ids
+    ]
+    tracker.register_chunks(cleaned, chunks, duplicate_ids=duplicate_ids)
+
+    embedded = [
+        EmbedArticle(**chunk.model_dump(exclude={"id"}), id=chunk.id, embedding=[1.0, 0.0, 0.0, 0.0])
+        for chunk in chunks[:written]
+    ]
+    if embedded:
+        EmbedArticle.bulk_insert(embedded)
+    tracker.mark_written(embedded)
+
+
+def point_ids() -> set[uuid.UUID]:
+    return {document.id for document in EmbedArticle.iter_find(with_payloads=False)}
+
+
+def point_owners() -> dict[uuid.UUID, uuid.UUID]:
+    return {document.id: document.document_id for document in EmbedArticle.iter_find()}
+
+
+def test_filter_changed_returns_new_and_changed_documents(tracker, chunk_metadata):
+    documents = [make_document(f"text {i}") for i in range(3)]
+    assert tracker.filter_changed(documents) == documents
+    for document in documents:
+        process(tracker, document, [uuid.uuid4()])
+    tracker.flush()
+
+    assert ChangeTracker().filter_changed(documents) == []
+
+    changed = documents[1].model_copy(update={"content": {"text": "new text"}})
+    touched = documents[2].model_copy(update={"updated_at": datetime.now(timezone.utc)})
+    assert ChangeTracker().filter_changed([documents[0], changed, touched]) == [changed]
+
+    # chunk参数变化时所有文档都需要重新处理
+    chunk_metadata["chunk_size"] = 64
+    assert ChangeTracker().filter_changed(documents) == documents
+
+
+def test_register_chunks_deletes_stale_points(tracker):
+    document, other = make_document("text"), make_document("other")
+    kept, stale = uuid.uuid4(), uuid.uuid4()
+    tracker.filter_changed([document, other])
+    process(tracker, document, [kept, stale])
+    process(tracker, other, [uuid.uuid4()])
+    tracker.flush()
+    assert {kept, stale} <= point_ids()
+
+    tracker = ChangeTracker()
+    changed = document.model_copy(update={"content": {"text": "new text"}})
+    tracker.filter_changed([changed])
+    added = uuid.uuid4()
+    process(tracker, changed, [kept, added])
+    tracker.flush()
+
+    ids = point_ids()
+    assert stale not in ids
+    assert {kept, added} <= ids
+    assert len(ids) == 3
+    assert ProcessingState.bulk_find({"_id": document.id})[0].chunk_ids == [kept, added]
+
+
+def test_state_is_saved_once_every_chunk_is_written(tracker):
+    document = make_document("text")
+    tracker.filter_changed([document])
+    process(tracker, document, [uuid.uuid4(), uuid.uuid4()], written=1)
+    tracker.flush()
+    assert ProcessingState.bulk_find({}) == []
+
+    # 没有写完的文档下次运行仍然被当成变化的文档
+    assert ChangeTracker().filter_changed([document]) == [document]
+
+
+def test_mark_written_saves_states_in_batches(databases, chunk_metadata):
+    EmbedArticle.get_or_create_collection(vector_size=4)
+    tracker = ChangeTracker(state_batch_size=2)
+    documents = [make_document(f"text {i}") for i in range(3)]
+    tracker.filter_changed(documents)
+
+    process(tracker, documents[0], [uuid.uuid4()])
+    assert ProcessingState.bulk_find({}) == []
+    process(tracker, documents[1], [uuid.uuid4()])
+    assert len(ProcessingState.bulk_find({})) == 2
+
+    # 没有chunk的文档不需要等待写入
+    process(tracker, documents[2], [])
+    assert len(ProcessingState.bulk_find({})) == 2
+    tracker.flush()
+    assert len(ProcessingState.bulk_find({})) == 3
+
+
+def test_changed_filter_reads_documents_updated_after_the_watermark(tracker):
+    old, legacy = make_document("old"), make_document("legacy")
+    ArticleDocument.bulk_upsert([old, legacy])
+    # 在updated_at之前写入的文档
+    nosql.get_database()[ArticleDocument.get_collection_name()].update_one(
+        {"_id": legacy.id}, {"$unset": {"updated_at": ""}}
+    )
+
+    assert tracker.changed_filter(ArticleDocument) == {}
+    documents = tracker.filter_changed(list(ArticleDocument.iter_find({})))
+    assert {document.id for document in documents} == {old.id, legacy.id}
+    for document in documents:
+        process(tracker, document, [uuid.uuid4()])
+    tracker.flush()
+    assert len(ProcessingWatermark.bulk_find({})) == 1
+
+    new = make_document("new")
+    # 原地修改的文档在写入时更新了updated_at
+    edited = old.model_copy(update={"content": {"text": "edited"}})
+    ArticleDocument.bulk_upsert([new, edited])
+    tracker = ChangeTracker()
+    candidates = list(ArticleDocument.iter_find(tracker.changed_filter(ArticleDocument)))
+    # 没有updated_at的文档仍然读取，再由指纹过滤
+    assert {document.id for document in candidates} == {new.id, edited.id, legacy.id}
+    assert {document.id for document in tracker.filter_changed(candidates)} == {new.id, edited.id}
+
+
+def test_watermark_is_not_moved_by_an_unfinished_run(tracker):
+    document = make_document("text")
+    ArticleDocument.bulk_upsert([document])
+
+    tracker.changed_filter(ArticleDocument)
+    tracker.filter_changed([document])
+    process(tracker, document, [uuid.uuid4()], written=0)
+    tracker.flush()
+    assert ProcessingWatermark.bulk_find({}) == []
+
+    tracker = ChangeTracker()
+    assert [d.id for d in ArticleDocument.iter_find(tracker.changed_filter(ArticleDocument))] == [document.id]
+
+
+def test_prune_deleted_removes_points_and_states(tracker):
+    kept, deleted = make_document("kept"), make_document("deleted")
+    ArticleDocument.bulk_upsert([kept, deleted])
+    tracker.filter_changed([kept, deleted])
+    process(tracker, kept, [uuid.uuid4()])
+    process(tracker, deleted, [uuid.uuid4(), uuid.uuid4()])
+    tracker.flush()
+    assert len(point_ids()) == 3
+
+    ArticleDocument.bulk_delete({"_id": deleted.id})
+    assert tracker.prune_deleted(ArticleDocument) == 1
+
+    assert len(point_ids()) == 1
+    assert [state.id for state in ProcessingState.bulk_find({})] == [kept.id]
+    assert tracker.prune_deleted(ArticleDocument) == 0
+
+
+def test_points_written_without_document_id_are_read(tracker):
+    from qdrant_client.models import PointStruct
+
+    point_id = uuid.uuid4()
+    payload = {"content": "old", "platform": "blog", "author_id": str(AUTHOR_ID), "author_full_name": "A", "link": "l"}
+    EmbedArticle.upsert_points([[PointStruct(id=str(point_id), vector=[1.0, 0.0, 0.0, 0.0], payload=payload)]])
+
+    documents, _ = EmbedArticle.bulk_find(limit=10)
+    assert [(document.id, document.document_id) for document in documents] == [(point_id, None)]
+
+
+def test_shared_point_moves_to_another_owner(tracker):
+    first, second = make_document("first"), make_document("second")
+    ArticleDocument.bulk_upsert([first, second])
+    shared, own = uuid.uuid4(), uuid.uuid4()
+    tracker.filter_changed([first, second])
+    # second的重复chunk被去重，只记下它共享的点
+    process(tracker, first, [shared, own])
+    process(tracker, second, [], duplicate_ids=[shared])
+    tracker.flush()
+    assert point_owners() == {shared: first.id, own: first.id}
+
+    tracker = ChangeTracker()
+    changed = first.model_copy(update={"content": {"text": "changed"}})
+    tracker.filter_changed([changed])
+    process(tracker, changed, [own])
+    tracker.flush()
+    assert point_owners() == {shared: second.id, own: first.id}
+
+    ArticleDocument.bulk_delete({"_id": second.id})
+    assert tracker.prune_deleted(ArticleDocument) == 1
+    assert point_owners() == {own: first.id}
+
+
+def test_documents_deleted_together_do_not_keep_their_shared_points(tracker):
+    documents = [make_document(f"text {i}") for i in range(3)]
+    ArticleDocument.bulk_upsert(documents)
+    shared = uuid.uuid4()
+    tracker.filter_changed(documents)
+    process(tracker, documents[0], [shared])
+    process(tracker, documents[1], [], duplicate_ids=[shared])
+    process(tracker, documents[2], [uuid.uuid4()])
+    tracker.flush()
+
+    ArticleDocument.bulk_delete({"_id": {"$in": [documents[0].id, documents[1].id]}})
+    assert tracker.prune_deleted(ArticleDocument) == 2
+    assert shared not in point_ids()
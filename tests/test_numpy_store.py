@@ -0,0 +1,177 @@
+from typing import Iterator
+
+import numpy as np
+import pytest
+from qdrant_client.http.models import FieldCondition, Filter, MatchValue
+
+from llmtwin.domain.base import vector
+from llmtwin.domain.base.collection_config import CollectionConfig
+from llmtwin.domain.base.vector import VectorBaseDocument
+from llmtwin.networks.sparse import SparseEmbedding
+from llmtwin.numpy_store import NumpyVectorStore
+
+DIM = 8
+
+
+class Note(VectorBaseDocument):
+    content: str
+    group: int
+    embedding: list[float] | None = None
+
+    @classmethod
+    def get_collection_name(cls) -> str:
+        return "notes"
+
+    @classmethod
+    def get_category(cls) -> str:
+        return "Note"
+
+    @classmethod
+    def get_collection_config(cls) -> CollectionConfig:
+        return CollectionConfig(payload_indexes={"group": "integer"})
+
+
+class HybridNote(Note):
+    sparse_embedding: SparseEmbedding | None = None
+
+    @classmethod
+    def get_collection_name(cls) -> str:
+        return "hybrid_notes"
+
+    @classmethod
+    def use_sparse_vectors(cls) -> bool:
+        return True
+
+
+def open_store(path, **kwargs) -> NumpyVectorStore:
+    store = NumpyVectorStore(str(path), **kwargs)
+    vector._database = store
+    return store
+
+
+@pytest.fixture
+def store(tmp_path) -> Iterator[NumpyVectorStore]:
+    previous = vector._database
+    store = open_store(tmp_path)
+    try:
+        yield store
+    finally:
+        vector._database.close()
+        vector._database = previous
+
+
+def make_notes(count: int, seed: int = 0) -> list[Note]:
+    vectors = np.random.default_rng(seed).normal(size=(count, DIM))
+    return [Note(content=f"note {i}", group=i % 3, embedding=vectors[i].tolist()) for i in range(count)]
+
+
+def group_filter(group: int) -> Filter:
+    return Filter(must=[FieldCondition(key="group", match=MatchValue(value=group))])
+
+
+def test_bulk_find_pages_through_every_point(store):
+    notes = make_notes(25)
+    Note.get_or_create_collection(vector_size=DIM)
+    Note.bulk_insert(notes)
+
+    found, offset = [], None
+    while True:
+        page, offset = Note.bulk_find(limit=10, offset=offset)
+        assert len(page) <= 10
+        found.extend(page)
+        if offset is None:
+            break
+
+    assert [note.id for note in found] == sorted((note.id for note in notes), key=str)
+    assert {note.id: note.content for note in found} == {note.id: note.content for note in notes}
+    assert len(Note.bulk_find(limit=100, scroll_filter=group_filter(1))[0]) == 8
+
+
+def test_search_with_a_filter(store):
+    notes = make_notes(30)
+    Note.get_or_create_collection(vector_size=DIM)
+    Note.bulk_insert(notes)
+
+    results = Note.search(notes[4].embedding, limit=5, query_filter=group_filter(1))
+
+    assert [note.group for note, _ in results] == [1] * 5
+    assert results[0][0].id == notes[4].id
+    assert results[0][1] == pytest.approx(1.0)
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_deleted_points_and_points_without_a_vector_are_not_returned(store):
+    notes = make_notes(10)
+    Note.get_or_create_collection(vector_size=DIM)
+    Note.bulk_insert(notes)
+
+    Note.bulk_delete([notes[0].id])
+    # 重新写入时不带向量，检索不到这个点，但仍然可以读取
+    Note.bulk_insert([notes[1].model_copy(update={"embedding": None})])
+
+    found = {note.id for note in Note.iter_find()}
+    assert notes[0].id not in found and notes[1].id in found
+    results = {note.id for note, _ in Note.search(notes[0].embedding, limit=10)}
+    assert results == {note.id for note in notes[2:]}
+
+
+def test_hybrid_search_fuses_both_rankings(store):
+    HybridNote.get_or_create_collection(vector_size=DIM)
+    vectors = np.eye(DIM)
+    notes = [
+        HybridNote(
+            content=f"note {i}",
+            group=0,
+            embedding=vectors[i].tolist(),
+            sparse_embedding=SparseEmbedding(indices=[i], values=[1.0]),
+        )
+        for i in range(4)
+    ]
+    HybridNote.bulk_insert(notes)
+
+    # 稠密向量最接近note 0，稀疏向量只匹配note 1
+    results = HybridNote.hybrid_search(
+        (vectors[0] + 0.5 * vectors[1]).tolist(), SparseEmbedding(indices=[1], values=[1.0]), limit=3
+    )
+
+    assert [note.id for note, _ in results][:2] == [notes[1].id, notes[0].id]
+    # 与qdrant相同，每个排名贡献1 / (rank + 2)
+    assert results[0][1] == pytest.approx(1 / 3 + 1 / 2)
+    assert results[1][1] == pytest.approx(1 / 2)
+
+
+def test_ivf_search_agrees_with_the_exact_search(tmp_path):
+    previous = vector._database
+    try:
+        open_store(tmp_path, ivf_lists=4, ivf_probes=4)
+        notes = make_notes(400)
+        Note.get_or_create_collection(vector_size=DIM)
+        Note.bulk_insert(notes)
+
+        for note in notes[:20]:
+            # 搜索所有分区时与精确检索结果相同
+            ivf = [(result.id, round(score, 5)) for result, score in Note.search(note.embedding, limit=5)]
+            exact = [(result.id, round(score, 5)) for result, score in Note.search(note.embedding, limit=5, exact=True)]
+            assert ivf == exact
+            assert ivf[0][0] == note.id
+    finally:
+        vector._database.close()
+        vector._database = previous
+
+
+def test_collection_is_reopened_from_disk(store, tmp_path):
+    notes = make_notes(20)
+    Note.get_or_create_collection(vector_size=DIM)
+    Note.bulk_insert(notes)
+    Note.bulk_delete([notes[0].id])
+    Note.bulk_insert([notes[1].model_copy(update={"embedding": None})])
+    store.close()
+
+    open_store(tmp_path)
+
+    assert {note.id for note in Note.iter_find()} == {note.id for note in notes[1:]}
+    assert len(Note.bulk_find(limit=100, scroll_filter=group_filter(2))[0]) == 6
+    results = Note.search(notes[5].embedding, limit=20)
+    assert results[0][0].id == notes[5].id
+    assert {note.id for note, _ in results} == {note.id for note in notes[2:]}
@@ -0,0 +1,78 @@
+import uuid
+
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from llmtwin.domain.base.collection_config import CollectionConfig
+from llmtwin.domain.base.vector import VectorBaseDocument
+
+DIM = 4
+
+
+class SlimNote(VectorBaseDocument):
+    content: str
+    group: int
+    metadata: dict
+    embedding: list[float] | None = None
+
+    @classmethod
+    def get_collection_name(cls) -> str:
+        return "slim_notes"
+
+    @classmethod
+    def get_category(cls) -> str:
+        return "Note"
+
+    @classmethod
+    def get_collection_config(cls) -> CollectionConfig:
+        return CollectionConfig(slim_payload=True, side_store_fields={"content"}, shared_fields={"metadata"})
+
+
+def make_notes() -> list[SlimNote]:
+    vectors = np.eye(DIM)
+    return [
+        SlimNote(content=f"note {i}", group=i, metadata={"model": "m"}, embedding=vectors[i].tolist())
+        for i in range(DIM)
+    ]
+
+
+def test_hydrated_documents_are_complete(databases):
+    notes = make_notes()
+    SlimNote.create_collection(vector_size=DIM)
+    SlimNote.bulk_insert(notes)
+
+    found = sorted(SlimNote.iter_find(trusted=False), key=lambda note: note.group)
+    assert [note.model_dump(exclude={"embedding"}) for note in found] == [
+        note.model_dump(exclude={"embedding"}) for note in notes
+    ]
+
+    # 不取回时只有payload中的字段，hydrate在原地补全
+    (candidate, _), *_ = SlimNote.search(notes[2].embedding, limit=1, hydrate=False)
+    assert "content" not in candidate.__dict__
+    SlimNote.hydrate([candidate])
+    assert candidate.content == "note 2" and candidate.metadata == {"model": "m"}
+
+
+def test_hydrated_documents_are_validated(databases):
+    notes = make_notes()
+    SlimNote.create_collection(vector_size=DIM)
+    SlimNote.bulk_insert(notes)
+    SlimNote._payload_store().put_many({notes[0].id: {"content": ["not", "a", "string"]}})
+
+    with pytest.raises(ValidationError):
+        list(SlimNote.iter_find(trusted=False))
+    with pytest.raises(ValidationError):
+        SlimNote.bulk_find(limit=10, trusted=True)
+
+
+def test_missing_side_store_payloads_are_left_partial(databases):
+    notes = make_notes()
+    SlimNote.create_collection(vector_size=DIM)
+    SlimNote.bulk_insert(notes)
+    SlimNote._payload_store().delete_many([notes[1].id])
+
+    found = {note.id: note for note in SlimNote.iter_find(trusted=False)}
+    assert "content" not in found[notes[1].id].__dict__
+    assert found[notes[0].id].content == "note 0"
+    assert isinstance(found[notes[0].id].id, uuid.UUID)
@@ -0,0 +1,120 @@
+from typing import Iterator
+
+import numpy as np
+import pytest
+
+from llmtwin import snapshot
+from llmtwin.domain.base import vector
+from llmtwin.domain.base.vector import DENSE_VECTOR_NAME, SPARSE_VECTOR_NAME, VectorBaseDocument
+from llmtwin.networks.sparse import SparseEmbedding
+from llmtwin.numpy_store import NumpyVectorStore
+
+DIM = 4
+
+
+class Note(VectorBaseDocument):
+    content: str
+    embedding: list[float] | None = None
+    sparse_embedding: SparseEmbedding | None = None
+
+    @classmethod
+    def get_collection_name(cls) -> str:
+        return "snapshot_notes"
+
+    @classmethod
+    def get_category(cls) -> str:
+        return "Note"
+
+
+class HybridNote(Note):
+    @classmethod
+    def use_sparse_vectors(cls) -> bool:
+        return True
+
+
+@pytest.fixture
+def store() -> Iterator[None]:
+    previous = vector._database
+    vector._database = NumpyVectorStore()
+    try:
+        yield
+    finally:
+        vector._database.close()
+        vector._database = previous
+
+
+def make_notes() -> list[Note]:
+    vectors = np.eye(DIM)
+    return [
+        HybridNote(
+            content=f"note {i}", embedding=vectors[i].tolist(), sparse_embedding=SparseEmbedding(indices=[i], values=[1.0])
+        )
+        for i in range(DIM)
+    ]
+
+
+def restore(document_class: type[Note], layout_class: type[Note], directory) -> None:
+    """Restores a snapshot with ``document_class`` into a new store whose collection was created by ``layout_class``."""
+    vector._database.close()
+    vector._database = NumpyVectorStore()
+    layout_class.create_collection(vector_size=DIM)
+    assert all(result.ok for result in snapshot.import_collection(document_class, directory, concurrency=1))
+
+
+def test_import_follows_the_named_layout_of_the_collection(store, tmp_path):
+    notes = make_notes()
+    HybridNote.create_collection(vector_size=DIM)
+    HybridNote.bulk_insert(notes)
+    assert snapshot.export_collection(HybridNote, tmp_path).sparse_vectors
+
+    # 文档类没有开启稀疏向量，但集合是以命名向量创建的
+    restore(Note, HybridNote, tmp_path)
+
+    point = vector._database.retrieve(Note.get_collection_name(), ids=[str(notes[1].id)], with_vectors=True)[0]
+    assert sorted(point.vector) == [DENSE_VECTOR_NAME, SPARSE_VECTOR_NAME]
+    results = HybridNote.hybrid_search(notes[2].embedding, SparseEmbedding(indices=[2], values=[1.0]), limit=1)
+    assert results[0][0].id == notes[2].id
+
+
+def test_import_drops_the_sparse_vectors_for_an_unnamed_collection(store, tmp_path):
+    notes = make_notes()
+    HybridNote.create_collection(vector_size=DIM)
+    HybridNote.bulk_insert(notes)
+    snapshot.export_collection(HybridNote, tmp_path)
+
+    restore(HybridNote, Note, tmp_path)
+
+    point = vector._database.retrieve(Note.get_collection_name(), ids=[str(notes[1].id)], with_vectors=True)[0]
+    assert point.vector == pytest.approx(notes[1].embedding)
+    assert [note.id for note in Note.query(notes[3].embedding, limit=1)] == [notes[3].id]
+
+
+def test_failed_export_keeps_the_previous_snapshot(store, tmp_path, monkeypatch):
+    notes = make_notes()
+    HybridNote.create_collection(vector_size=DIM)
+    HybridNote.bulk_insert(notes)
+    snapshot.export_collection(HybridNote, tmp_path, page_size=2)
+    previous = (tmp_path / snapshot.MANIFEST_FILE).read_text()
+
+    HybridNote.bulk_insert([notes[0].model_copy(update={"content": "changed"})])
+    scroll = vector._database.scroll
+    pages = iter([True, False])
+
+    def failing_scroll(*args, **kwargs):
+        # 写完第一个分页后失败
+        if not next(pages):
+            raise ConnectionError("scroll failed")
+        return scroll(*args, **kwargs)
+
+    monkeypatch.setattr(vector._database, "scroll", failing_scroll)
+    with pytest.raises(ConnectionError):
+        snapshot.export_collection(HybridNote, tmp_path, page_size=2)
+    monkeypatch.undo()
+
+    assert (tmp_path / snapshot.MANIFEST_FILE).read_text() == previous
+    restore(HybridNote, HybridNote, tmp_path)
+    assert {note.content for note in HybridNote.iter_find()} == {note.content for note in notes}
+
+    # 再次导出成功后只留下新快照的文件
+    snapshot.export_collection(HybridNote, tmp_path)
+    assert len(list(tmp_path.glob("data-*"))) == 1
@@ -0,0 +1,43 @@
+import uuid
+
+from llmtwin.networks.sparse import BM25Encoder
+
+
+def state(encoder: BM25Encoder) -> tuple:
+    return encoder.num_documents, encoder.average_length, dict(encoder._document_frequencies)
+
+
+def test_refitted_chunks_are_counted_once():
+    ids = [uuid.uuid4(), uuid.uuid4()]
+    texts = ["vector search with qdrant", "bm25 scores the terms"]
+    encoder = BM25Encoder().partial_fit(texts, ids)
+    expected = state(encoder)
+
+    # 重新embedding的chunk，以及同一批次中重复的chunk
+    encoder.partial_fit([texts[1], texts[0], texts[0]], [ids[1], ids[0], ids[0]])
+    assert state(encoder) == expected
+
+    encoder.partial_fit(["a new chunk", "a new chunk"], [uuid.uuid4()] * 2)
+    assert encoder.num_documents == 3
+
+
+def test_removed_chunks_are_subtracted():
+    ids = [uuid.uuid4(), uuid.uuid4()]
+    encoder = BM25Encoder().partial_fit(["vector search"], ids[:1])
+    expected = state(encoder)
+
+    encoder.partial_fit(["bm25 search"], ids[1:])
+    encoder.remove(["bm25 search", "never fitted"], [ids[1], uuid.uuid4()])
+    assert state(encoder) == expected
+    # 已经减去的chunk不会再减一次
+    encoder.remove(["bm25 search"], ids[1:])
+    assert state(encoder) == expected
+
+
+def test_fitted_ids_are_saved(tmp_path):
+    chunk_id = uuid.uuid4()
+    BM25Encoder().partial_fit(["vector search"], [chunk_id]).save(tmp_path / "bm25.json")
+
+    encoder = BM25Encoder.load(tmp_path / "bm25.json")
+    encoder.partial_fit(["vector search"], [chunk_id])
+    assert encoder.num_documents == 1